@@ -0,0 +1,29 @@
+"""Add (conversation_id, created_at) index to messages table
+
+Revision ID: 4b8e2f1a9c3d
+Revises: dcfb57b0c4d1
+Create Date: 2026-10-17 10:12:41.218530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b8e2f1a9c3d'
+down_revision: Union[str, Sequence[str], None] = 'dcfb57b0c4d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Lets the agent read the last N messages of a conversation without sorting all of them
+    op.create_index('ix_messages_conversation_created', 'messages', ['conversation_id', 'created_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_conversation_created', table_name='messages')
@@ -0,0 +1,158 @@
+"""Pending clarification questions per conversation, answered locally on the next message"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .intent_engine import clean_title, match_tasks, normalize_message
+from .schedule_extractor import describe
+
+DEFAULT_CLARIFICATION_TTL_SECONDS = float(os.getenv("CLARIFICATION_TTL_SECONDS", "300"))
+DEFAULT_MAX_CLARIFICATIONS = int(os.getenv("CLARIFICATION_MAX_PENDING", "1024"))
+# Candidates listed in the question
+MAX_CANDIDATES = 9
+
+_ORDINALS = {
+    "first": 1, "1st": 1, "one": 1, "ek": 1, "pehla": 1, "pehli": 1, "pehle": 1, "pahla": 1, "pahli": 1,
+    "second": 2, "2nd": 2, "two": 2, "do": 2, "doosra": 2, "doosri": 2, "dusra": 2, "dusri": 2, "doosre": 2,
+    "third": 3, "3rd": 3, "three": 3, "teesra": 3, "teesri": 3, "tisra": 3, "tisri": 3,
+    "fourth": 4, "4th": 4, "four": 4, "chautha": 4, "chauthi": 4, "chotha": 4, "chothi": 4,
+    "fifth": 5, "5th": 5, "five": 5, "panchwa": 5, "paanchwa": 5, "panchwi": 5, "paanchvi": 5,
+    "last": -1, "aakhri": -1, "akhri": -1, "aakhir": -1,
+}
+# Words around an ordinal answer ("the second one", "pehla wala", "number 2")
+_ORDINAL_FILLER = {"the", "wala", "wali", "wale", "number", "no", "num", "#", "task", "please", "plz",
+                   "ko", "kar", "karo", "dein", "yeh", "ye", "wo", "woh", "that", "this", "option", "item"}
+# "one" and "do" are numbers ("one", "number do") except where they are filler: "one" after any
+# other word ("the second one", "that one") and "do" after a verb ("kar do", "hata do")
+_NUMBER_PREFIX = {"number", "no", "num", "#"}
+_VERBS_BEFORE_DO = {"kar", "kr", "karo", "hata", "mita", "de", "dena"}
+_CANCEL = re.compile(r'^(?:cancel|nevermind|never\s+mind|rehne\s+do|rehne\s+dein|chhodo|chodo|chhod\s+do|'
+                     r'chod\s+do|nahi|nahin|no|kuch\s+nahi|koi\s+nahi|none)$')
+
+_VERBS = {
+    "update_task": "update karun",
+    "delete_task": "delete karun",
+    "complete_task": "complete karun",
+}
+_DONE = {
+    "update_task": "Theek hai, task '{title}' ko '{new_title}' kar diya hai. 🙂",
+    "delete_task": "Theek hai, task '{title}' delete kar diya hai. 🙂",
+    "complete_task": "Theek hai, task '{title}' complete kar diya hai. 🙂",
+}
+
+
+class ClarificationStore:
+    """
+    When a tool call names a task ambiguously, the agent asks which one was
+    meant and stores the pending call with its numbered candidates here, per
+    conversation, for `ttl_seconds`. The next message of that conversation
+    is first matched against the candidates (an ordinal such as "the second
+    one" / "doosra wala", the number shown, or a title) and, on a match, the
+    pending call runs without a model call. "cancel" / "rehne do" drops it;
+    anything else drops it and is handled as a normal message.
+    """
+
+    def __init__(self, ttl_seconds: float = DEFAULT_CLARIFICATION_TTL_SECONDS,
+                 max_entries: int = DEFAULT_MAX_CLARIFICATIONS, clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._clock = clock
+        self._pending: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.asked = 0
+        self.resolved = 0
+        self.cancelled = 0
+        self.abandoned = 0
+        self.expired = 0
+
+    def ask(self, user_id: str, conversation_id: Optional[str], action: str, target: str,
+            arguments: Dict[str, Any], candidates: List[Dict[str, Any]]) -> str:
+        """Remember the pending `action` and return the question to show the user."""
+        candidates = [{"id": str(t["id"]), "title": t["title"], "completed": bool(t["completed"])}
+                      for t in candidates[:MAX_CANDIDATES]]
+        key = (user_id, conversation_id or "")
+        with self._lock:
+            self._pending[key] = {
+                "action": action,
+                "arguments": dict(arguments),
+                "candidates": candidates,
+                "expires": self._clock() + self.ttl_seconds,
+            }
+            self._pending.move_to_end(key)
+            while len(self._pending) > self.max_entries:
+                self._pending.popitem(last=False)
+            self.asked += 1
+        lines = "\n".join(f"{i}. {t['title']} ({'Completed' if t['completed'] else 'Pending'})"
+                          for i, t in enumerate(candidates, 1))
+        return (f"Mujhe '{target}' se milte julte {len(candidates)} tasks mile hain. "
+                f"Kisko {_VERBS.get(action, 'select karun')}?\n{lines}\n\n(Number ya naam likh dein.)")
+
+    def answer(self, user_id: str, conversation_id: Optional[str], message: str) -> Optional[Dict[str, Any]]:
+        """
+        The reply to `message` when it answers the conversation's pending
+        question: {"response", "tool_calls", "conversation_id"}; otherwise None.
+        The pending question is consumed either way.
+        """
+        key = (user_id, conversation_id or "")
+        with self._lock:
+            entry = self._pending.pop(key, None)
+            if entry is None:
+                return None
+            if entry["expires"] <= self._clock():
+                self.expired += 1
+                return None
+
+        text = normalize_message(message)
+        if _CANCEL.match(text):
+            with self._lock:
+                self.cancelled += 1
+            return {"response": "Theek hai, rehne diya. 🙂", "tool_calls": [], "conversation_id": conversation_id}
+
+        task = self._pick(text, entry["candidates"])
+        if task is None:
+            with self._lock:
+                self.abandoned += 1
+            return None
+
+        with self._lock:
+            self.resolved += 1
+        action, arguments = entry["action"], entry["arguments"]
+        call = {"name": action, "arguments": {**arguments, "task_id": task["id"], "user_id": user_id}}
+        if action == "update_task" and not arguments.get("title"):
+            # Only the due date or priority changes
+            response = f"Theek hai, task '{task['title']}'{describe(arguments)} update kar diya hai. 🙂"
+        else:
+            response = _DONE.get(action, "Theek hai. 🙂").format(title=task["title"],
+                                                                  new_title=arguments.get("title", ""))
+        return {"response": response, "tool_calls": [call], "conversation_id": conversation_id}
+
+    @staticmethod
+    def _pick(text: str, candidates: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        raw = re.findall(r"[#\w]+", text)
+        words = [w for i, w in enumerate(raw) if w not in _ORDINAL_FILLER
+                 and not (w == "one" and i and raw[i - 1] not in _NUMBER_PREFIX)
+                 and not (w == "do" and i and raw[i - 1] in _VERBS_BEFORE_DO)]
+        if len(words) == 1:
+            word = words[0].lstrip("#")
+            index = int(word) if word.isdigit() else _ORDINALS.get(word)
+            if index is not None:
+                if index == -1:
+                    return candidates[-1]
+                return candidates[index - 1] if 1 <= index <= len(candidates) else None
+        task, status = match_tasks(clean_title(re.sub(r'\s+(?:one|wala|wali|wale)$', '', text)), candidates)
+        return task if status == "FOUND" else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "asked": self.asked,
+                "resolved": self.resolved,
+                "cancelled": self.cancelled,
+                "abandoned": self.abandoned,
+                "expired": self.expired
+            }
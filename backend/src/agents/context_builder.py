@@ -0,0 +1,181 @@
+"""Relevance-ranked, size-bounded task context for the agent prompt"""
+
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from .token_budget import estimate_tokens
+
+# Upper bounds for the task section of the prompt
+DEFAULT_CONTEXT_MAX_TASKS = int(os.getenv("TASK_CONTEXT_MAX_TASKS", "50"))
+DEFAULT_CONTEXT_TOKEN_BUDGET = int(os.getenv("TASK_CONTEXT_TOKEN_BUDGET", "1200"))
+# Tasks shown per page when listing
+DEFAULT_LIST_PAGE_SIZE = int(os.getenv("TASK_LIST_PAGE_SIZE", "20"))
+
+_WORD = re.compile(r"[^\W_]+", re.UNICODE)
+# Words that say nothing about which task is meant
+_STOPWORDS = {
+    "a", "an", "the", "to", "my", "me", "and", "or", "of", "for", "in", "on", "at", "is", "it", "i",
+    "task", "tasks", "please", "do", "kar", "karo", "ko", "ka", "ki", "ke", "hai", "hain", "wala", "wali",
+    "aur", "bhi", "mera", "mere", "meri", "ye", "yeh", "wo", "woh", "se"
+}
+
+
+def tokenize(text: str) -> set:
+    return {w for w in _WORD.findall(text.lower()) if w not in _STOPWORDS}
+
+
+# Per-turn short task IDs ("t1", "t2", ...) used in the prompt instead of the real IDs
+_ALIAS = re.compile(r'^\[?(t\d+)\]?$', re.IGNORECASE)
+_ALIAS_PREFIX = re.compile(r'^- t\d+: ', re.MULTILINE)
+_AGGREGATE = re.compile(r'^- \.\.\.and (?:([\d,]+) more pending)?(?: and )?(?:([\d,]+) more completed)? tasks? not shown$')
+
+
+def format_task_line(task: Dict[str, Any], alias: str = None) -> str:
+    # Clean format for user display (Hidden IDs)
+    line = f"{task['title']} ({'Completed' if task['completed'] else 'Pending'})"
+    return f"- {alias}: {line}" if alias else f"- {line}"
+
+
+def strip_aliases(text: str) -> str:
+    """The task section without its aliases, for showing to the user."""
+    return _ALIAS_PREFIX.sub("- ", text)
+
+
+def resolve_alias(value: Any, aliases: Dict[str, str]) -> Any:
+    """The real task ID for an alias such as "t3" (or "[T3]"); anything else is returned unchanged."""
+    if not aliases or not isinstance(value, str):
+        return value
+    match = _ALIAS.match(value.strip())
+    return aliases.get(match.group(1).lower(), value) if match else value
+
+
+def paginate(tasks: List[Dict[str, Any]], page: int, page_size: int = DEFAULT_LIST_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], int, int]:
+    """Return (tasks on page, page, total pages). Pages are 1-based; out-of-range pages are clamped."""
+    pages = max(1, math.ceil(len(tasks) / page_size))
+    page = min(max(1, page), pages)
+    start = (page - 1) * page_size
+    return tasks[start:start + page_size], page, pages
+
+
+class TaskContextBuilder:
+    """
+    Picks the tasks most relevant to a message for the prompt instead of
+    dumping the whole list. Tasks are ranked by title overlap with the
+    message, then pending before completed, then most recently updated,
+    and added until `max_tasks` or `token_budget` is reached. Whatever is
+    left out is summarized in one aggregate line.
+    """
+
+    def __init__(self, max_tasks: int = DEFAULT_CONTEXT_MAX_TASKS, token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET):
+        self.max_tasks = max_tasks
+        self.token_budget = token_budget
+
+    @staticmethod
+    def rank(message: str, tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        words = tokenize(message)
+        # Newest first gives every task a recency position in [0, 1)
+        by_recency = sorted(tasks, key=lambda t: t.get("updated_at") or t.get("created_at") or "", reverse=True)
+        recency = {id(t): i / len(tasks) for i, t in enumerate(by_recency)}
+
+        def score(task):
+            title_words = tokenize(task["title"])
+            overlap = len(words & title_words) / len(title_words) if title_words else 0.0
+            # Overlap dominates, pending breaks ties, recency orders the rest
+            return (-overlap, bool(task["completed"]), recency[id(task)])
+
+        return sorted(tasks, key=score)
+
+    def build(self, message: str, tasks: Optional[List[Dict[str, Any]]], token_budget: int = None,
+              aliases: bool = False) -> Dict[str, Any]:
+        """
+        Returns {"text", "included", "omitted_pending", "omitted_completed", "tokens", "aliases"}
+        where `text` is the task section to put into the prompt. `token_budget`
+        overrides the configured budget (used when the whole prompt is over budget).
+        With `aliases`, each line starts with a short ID (t1, t2, ... in ranked
+        order) and "aliases" maps those back to the real task IDs. A smaller
+        budget keeps a prefix of the same table.
+        """
+        budget = self.token_budget if token_budget is None else min(token_budget, self.token_budget)
+        if tasks is None:
+            return self._result("Could not fetch tasks.", [], 0, 0)
+        if not tasks:
+            return self._result("No tasks currently.", [], 0, 0)
+
+        # Leave room for the aggregate line in case not everything fits
+        limit = budget - estimate_tokens(self.aggregate_line(len(tasks), len(tasks)))
+        included, lines, used = [], [], 0
+        for task in self.rank(message, tasks):
+            if len(included) >= self.max_tasks:
+                break
+            line = format_task_line(task, f"t{len(included) + 1}" if aliases else None)
+            cost = estimate_tokens(line)
+            if used + cost > limit:
+                break
+            included.append(task)
+            lines.append(line)
+            used += cost
+
+        shown = {id(t) for t in included}
+        omitted_completed = sum(1 for t in tasks if id(t) not in shown and t["completed"])
+        omitted_pending = len(tasks) - len(included) - omitted_completed
+        if omitted_pending or omitted_completed:
+            lines.append(self.aggregate_line(omitted_pending, omitted_completed))
+        table = {f"t{i}": t["id"] for i, t in enumerate(included, 1)} if aliases else {}
+        return self._result("\n".join(lines), included, omitted_pending, omitted_completed, table)
+
+    def shrink(self, text: str, token_budget: int) -> str:
+        """
+        A task section already built (e.g. a conversation's snapshot) cut
+        down to `token_budget` by dropping its last task lines into the
+        aggregate line. Kept lines keep their aliases, so the section's alias
+        table still applies; rebuilding instead would rank and number anew.
+        """
+        lines = text.split("\n")
+        pending = completed = 0
+        aggregate = _AGGREGATE.match(lines[-1]) if lines else None
+        if aggregate:
+            lines.pop()
+            pending, completed = (int((n or "0").replace(",", "")) for n in aggregate.groups())
+        if not lines or not lines[0].startswith("- "):
+            # "No tasks currently." / "Could not fetch tasks."
+            return text
+        limit = token_budget - estimate_tokens(self.aggregate_line(pending + len(lines), completed + len(lines)))
+        kept, used = [], 0
+        for line in lines:
+            cost = estimate_tokens(line)
+            if used + cost > limit:
+                break
+            kept.append(line)
+            used += cost
+        for line in lines[len(kept):]:
+            if line.endswith("(Completed)"):
+                completed += 1
+            else:
+                pending += 1
+        if pending or completed:
+            kept.append(self.aggregate_line(pending, completed))
+        return "\n".join(kept)
+
+    @staticmethod
+    def aggregate_line(pending: int, completed: int) -> str:
+        parts = []
+        if pending:
+            parts.append(f"{pending:,} more pending")
+        if completed:
+            parts.append(f"{completed:,} more completed")
+        noun = "task" if pending + completed == 1 else "tasks"
+        return f"- ...and {' and '.join(parts)} {noun} not shown"
+
+    @staticmethod
+    def _result(text: str, included: List[Dict[str, Any]], omitted_pending: int, omitted_completed: int,
+                aliases: Dict[str, str] = None) -> Dict[str, Any]:
+        return {
+            "text": text,
+            "included": included,
+            "omitted_pending": omitted_pending,
+            "omitted_completed": omitted_completed,
+            "tokens": estimate_tokens(text),
+            "aliases": aliases or {}
+        }
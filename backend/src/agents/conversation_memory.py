@@ -0,0 +1,116 @@
+"""Bounded conversation history and rolling summary for the agent prompt"""
+
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlmodel import Session
+
+from ..models.conversation import Conversation
+from ..services.message_service import MessageService
+
+# Number of most recent messages shown verbatim in the prompt
+DEFAULT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "6"))
+# Size cap of the rolling summary (Conversation.context_data holds at most 5000 characters)
+DEFAULT_SUMMARY_MAX_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "1500"))
+# Longer messages are cut when shown in history or summary
+HISTORY_MESSAGE_MAX_CHARS = 300
+SUMMARY_LINE_MAX_CHARS = 160
+
+_ROLE_LABELS = {"user": "User", "assistant": "Assistant"}
+
+
+def compact(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def format_messages(messages: List[Dict[str, str]], limit: int = HISTORY_MESSAGE_MAX_CHARS) -> str:
+    return "\n".join(f"{_ROLE_LABELS.get(m['role'], m['role'])}: {compact(m['content'], limit)}" for m in messages)
+
+
+class ConversationMemory:
+    """
+    Gives the agent the last `window` messages of a conversation plus a
+    rolling summary of everything before them, so the prompt stays the same
+    size however long the conversation gets.
+
+    The summary lives in Conversation.context_data as JSON:
+        {"summary": "...", "through": "<created_at of the last folded message>", "folded": n}
+    Each load folds only the messages that slid out of the window since the
+    previous turn into it, one compact line per message, dropping the oldest
+    lines once `summary_max_chars` is reached.
+    """
+
+    def __init__(self, window: int = DEFAULT_HISTORY_WINDOW, summary_max_chars: int = DEFAULT_SUMMARY_MAX_CHARS):
+        self.window = window
+        self.summary_max_chars = summary_max_chars
+        self.message_service = MessageService()
+
+    def load(self, session: Session, user_id: str, conversation_id: Optional[str],
+             current_message: str = None) -> Dict[str, Any]:
+        """
+        Returns {"summary": str, "recent": [{"role", "content"}]} for the conversation,
+        excluding the message being answered. Updates the stored summary first.
+        """
+        empty = {"summary": "", "recent": []}
+        try:
+            conv_uuid = uuid.UUID(str(conversation_id))
+        except ValueError:
+            return empty
+        conversation = session.get(Conversation, conv_uuid)
+        if conversation is None or conversation.user_id != user_id:
+            return empty
+
+        # One extra row: the current user message is already saved by the chat route
+        rows = self.message_service.get_recent_messages(session, user_id, conv_uuid, self.window + 1)
+        if rows and current_message is not None and rows[-1].role == "user" and rows[-1].content == current_message:
+            rows = rows[:-1]
+        else:
+            rows = rows[-self.window:]
+
+        state = self._read_state(conversation)
+        if rows:
+            self._fold(session, conversation, state, user_id, before=rows[0].created_at)
+
+        return {
+            "summary": state["summary"],
+            "recent": [{"role": m.role, "content": m.content} for m in rows]
+        }
+
+    def _fold(self, session: Session, conversation: Conversation, state: Dict[str, Any], user_id: str,
+              before: datetime) -> None:
+        """Add messages older than the window and newer than the last fold to the summary."""
+        through = datetime.fromisoformat(state["through"]) if state["through"] else None
+        pending = self.message_service.get_messages_between(session, user_id, conversation.id, after=through, before=before)
+        if not pending:
+            return
+
+        lines = state["summary"].splitlines() if state["summary"] else []
+        lines.extend(f"{_ROLE_LABELS.get(m.role, m.role)}: {compact(m.content, SUMMARY_LINE_MAX_CHARS)}" for m in pending)
+        while lines and len("\n".join(lines)) > self.summary_max_chars:
+            lines.pop(0)
+
+        state.update({
+            "summary": "\n".join(lines),
+            "through": pending[-1].created_at.isoformat(),
+            "folded": state["folded"] + len(pending)
+        })
+        conversation.context_data = json.dumps(state, ensure_ascii=False)
+        session.add(conversation)
+        session.commit()
+
+    @staticmethod
+    def _read_state(conversation: Conversation) -> Dict[str, Any]:
+        state = {"summary": "", "through": None, "folded": 0}
+        if conversation.context_data:
+            try:
+                stored = json.loads(conversation.context_data)
+                if isinstance(stored, dict):
+                    state.update({k: stored[k] for k in state if k in stored})
+            except ValueError:
+                # Not written by us; start a fresh summary
+                pass
+        return state
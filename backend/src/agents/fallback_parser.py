@@ -0,0 +1,165 @@
+"""
+Rule table for the agent's fallback parser (used when the model call fails).
+
+Each rule pairs a `detect` pattern, which picks the intent (checked in table
+order, as the old inline branches were), with `extract` patterns matched at
+the position `detect` found. All of them are compiled once at import. They
+are anchored at that position and use at most one lazy group followed by
+literal text, so a parse costs a single linear pass. The old inline patterns
+(`.*?` followed by `(.+?)`, `mark.*?c`) were retried from every verb
+occurrence and took quadratic time on long input.
+
+Benchmark on a corpus of messages (per-message parse time, rule table vs the
+old inline patterns):
+    python -m src.agents.fallback_parser tests/fallback_corpus.json --long 2000
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from .title_generator import strip_filler
+
+# Pure greetings and task verbs, for TodoAgent._classify_message
+PURE_GREETING = re.compile(r'^(?:hi|hello|hey|asalam\s*o\s*alaikum|aoa|salam)$')
+TASK_VERB = re.compile(r'add|create|delete|remove|update|edit|complete|finish|list|show')
+
+
+class FallbackRule(NamedTuple):
+    intent: str
+    detect: "re.Pattern"
+    # Tried in order with .match() at the start of the `detect` match; named groups become fields
+    extract: Tuple["re.Pattern", ...] = ()
+
+
+FALLBACK_RULES: List[FallbackRule] = [
+    FallbackRule("add", re.compile(r'add|create'), (
+        re.compile(r'(?:add|create).*?(?:task|:|called|named)\s(?P<title>.+)'),
+    )),
+    FallbackRule("edit", re.compile(r'\b(?:upd|edi|cha|ren)'), (
+        # "change X to Y", "rename task X as Y"
+        re.compile(r'\w*:?\s(?P<target>.+?)\s(?:to|as|with)\s(?P<new>.+)'),
+        # "update X Y": one word names the task, the rest is the new title
+        re.compile(r'\w*:?\s(?:task\s)?+(?P<target>\S+)\s(?!(?:to|as|with)\b)(?P<new>\w.*)'),
+    )),
+    FallbackRule("delete", re.compile(r'\b(?:del|rem)'), (
+        re.compile(r'\w*:?\s(?P<target>.+?)(?:\stask)?$'),
+    )),
+    FallbackRule("complete", re.compile(r'\b(?:comp|fin|don|mark(?:ed)?\b)'), (
+        # "mark X as done"
+        re.compile(r'mark(?:ed)?\s(?P<target>.+?)(?:\s(?:as|is))?\s(?:done|complete|completed|finished)$'),
+        # "complete X", "mark X", "finish X task"
+        re.compile(r'\w*:?\s(?P<target>.+?)(?:\stask)?(?:\s(?:as|is)\sdone|\sdone)?$'),
+    )),
+    FallbackRule("list", re.compile(r'list|show|all')),
+]
+
+
+def parse_fallback(message: str) -> Dict[str, str]:
+    """
+    {"intent": add | edit | delete | complete | list | chat, plus the fields
+    found: "title" (add), "target" and "new" (edit), "target" (delete,
+    complete)}. An intent without its fields means the message named the
+    action but not the task.
+    """
+    text = " ".join(message.lower().split())
+    for rule in FALLBACK_RULES:
+        found = rule.detect.search(text)
+        if found is None:
+            continue
+        for pattern in rule.extract:
+            match = pattern.match(text, found.start())
+            if match:
+                return {"intent": rule.intent, **{k: strip_filler(v) for k, v in match.groupdict().items()}}
+        return {"intent": rule.intent}
+    return {"intent": "chat"}
+
+
+def legacy_parse(message: str) -> Dict[str, str]:
+    """The fallback branches' previous inline patterns, kept as the benchmark baseline."""
+    m = message.lower().strip()
+    if "add" in m or "create" in m:
+        match = re.search(r'(?:add|create).*?(?:task|:|called|named)\s+(.+)', m, re.IGNORECASE)
+        return {"intent": "add", "title": strip_filler(match.group(1))} if match else {"intent": "add"}
+    if re.search(r'\b(?:upd|edi|cha|ren)', m):
+        match = re.search(r'(?:upd|edi|cha|ren).*?(?:task|:|called|named)?\s+(.+?)\s+(?:to|as|with)\s+(.+)', m, re.IGNORECASE) or \
+            re.search(r'(?:upd|edi|cha|ren)\s+(.+?)\s+(?:to|as|with)\s+(.+)', m, re.IGNORECASE) or \
+            re.search(r'(?:upd|edi|cha|ren).*?(?:task|:|called|named)?\s+(.+?)\s+(?!to|as|with)(\w+.*)', m, re.IGNORECASE) or \
+            re.search(r'(?:upd|edi|cha|ren)\s+(.+?)\s+(?!to|as|with)(\w+.*)', m, re.IGNORECASE)
+        if match:
+            return {"intent": "edit", "target": strip_filler(match.group(1)), "new": strip_filler(match.group(2))}
+        return {"intent": "edit"}
+    if re.search(r'\b(?:del|rem)', m):
+        match = re.search(r'(?:del|rem).*?(?:task|:|called|named)?\s+(.+)', m, re.IGNORECASE) or \
+            re.search(r'(?:del|rem)\s+(?:task\s+)?(.+)', m, re.IGNORECASE)
+        return {"intent": "delete", "target": strip_filler(match.group(1))} if match else {"intent": "delete"}
+    if re.search(r'\b(?:comp|fin|don|mark.*?c|mark.*?d|as\s+done|mark.*?done)', m):
+        match = re.search(r'(?:comp|fin|don|mark.*?c|mark.*?d|as\s+done|mark.*?done).*?(?:task|:|called|named)?\s+(.+?)(?:\s+as\s+done|\s+is\s+done|\s+done)?$', m, re.IGNORECASE) or \
+            re.search(r'(?:comp|fin|don|mark.*?c|mark.*?d|as\s+done|mark.*?done)\s+(.+?)\s*(?:task)?$', m, re.IGNORECASE) or \
+            re.search(r'mark.*?(?:task)?\s+(.+?)\s+as\s+done', m, re.IGNORECASE)
+        return {"intent": "complete", "target": strip_filler(match.group(1))} if match else {"intent": "complete"}
+    if "list" in m or "show" in m or "all" in m:
+        return {"intent": "list"}
+    return {"intent": "chat"}
+
+
+def long_messages(words: int) -> List[str]:
+    """Long messages that make the legacy patterns backtrack (no separator where they expect one)."""
+    return [
+        "edit " + "milk " * words,
+        "mark " * words,
+        "update" + " x" * words + " to",
+        "complete " + "milk " * words + "please",
+    ]
+
+
+def benchmark(messages: List[str], repeat: int = 20) -> Dict[str, Any]:
+    """Mean parse time (µs) of every message with the rule table and with the legacy patterns."""
+    rows = []
+    for message in messages:
+        row = {"message": message, "intent": parse_fallback(message)["intent"]}
+        for name, fn in (("table", parse_fallback), ("legacy", legacy_parse)):
+            # Warm up the re module's pattern cache the legacy patterns rely on
+            fn(message)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fn(message)
+            row[f"{name}_us"] = round((time.perf_counter() - start) / repeat * 1e6, 1)
+        rows.append(row)
+    return {
+        "n": len(rows),
+        "rows": rows,
+        "table_mean_us": round(sum(r["table_us"] for r in rows) / len(rows), 1) if rows else 0.0,
+        "legacy_mean_us": round(sum(r["legacy_us"] for r in rows) / len(rows), 1) if rows else 0.0
+    }
+
+
+def format_benchmark(report: Dict[str, Any]) -> str:
+    lines = [f"Parsed {report['n']} messages", f"{'table µs':>10}{'legacy µs':>11}  {'intent':<9}message"]
+    for row in report["rows"]:
+        message = row["message"] if len(row["message"]) <= 50 else f"{row['message'][:40]}… ({len(row['message'])} chars)"
+        lines.append(f"{row['table_us']:>10.1f}{row['legacy_us']:>11.1f}  {row['intent']:<9}{message!r}")
+    lines.append(f"{report['table_mean_us']:>10.1f}{report['legacy_mean_us']:>11.1f}  mean")
+    return "\n".join(lines)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Per-message parse time of the fallback rule table vs the legacy patterns.")
+    parser.add_argument("corpus", help="JSON file with a list of {message, ...} objects")
+    parser.add_argument("--long", type=int, default=0, metavar="WORDS",
+                        help="also parse synthetic messages of this many words")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+    with open(args.corpus, encoding="utf-8") as f:
+        messages = [case["message"] for case in json.load(f)]
+    if args.long:
+        messages += long_messages(args.long)
+    print(format_benchmark(benchmark(messages, args.repeat)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""Hedged model calls: race a backup attempt when the primary is slower than usual"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Fire the hedge once the primary is slower than this percentile of recent latencies
+DEFAULT_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# Hedge delay used until enough latencies have been observed, and its bounds
+DEFAULT_HEDGE_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DELAY_SECONDS", "3"))
+DEFAULT_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "0.5"))
+DEFAULT_HEDGE_MAX_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MAX_DELAY_SECONDS", "10"))
+# Hard timeout of a single model attempt (passed to the SDK as request_options)
+DEFAULT_LLM_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "30"))
+# Set LLM_HEDGING=0 to disable hedging
+HEDGING_ENABLED = os.getenv("LLM_HEDGING", "1") != "0"
+
+MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+
+class Hedger:
+    """
+    Runs a primary attempt and, if it has not answered within the hedge delay,
+    a backup attempt with the same prompt. The first successful answer wins.
+
+    The hedge delay tracks `percentile` of recently observed successful
+    latencies, so only the slow tail gets hedged (about 5% of calls at p95).
+    A losing attempt that has not started yet is cancelled; one already in
+    flight cannot be interrupted from Python, so it is abandoned and ends at
+    its own per-attempt timeout with its result discarded. `on_lost` hears
+    about both, so whatever the attempt holds (a half-open probe slot, an
+    open stream) can be given back.
+    """
+
+    def __init__(self, percentile: float = DEFAULT_HEDGE_PERCENTILE, default_delay: float = DEFAULT_HEDGE_DELAY_SECONDS,
+                 min_delay: float = DEFAULT_HEDGE_MIN_DELAY_SECONDS, max_delay: float = DEFAULT_HEDGE_MAX_DELAY_SECONDS,
+                 attempt_timeout: float = DEFAULT_LLM_ATTEMPT_TIMEOUT_SECONDS, enabled: bool = HEDGING_ENABLED,
+                 max_workers: int = 16):
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.attempt_timeout = attempt_timeout
+        self.enabled = enabled
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+        self.calls = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+
+    def observe(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self) -> float:
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < MIN_SAMPLES:
+            return self.default_delay
+        value = samples[min(len(samples) - 1, int(len(samples) * self.percentile))]
+        return min(self.max_delay, max(self.min_delay, value))
+
+    def call(self, primary: Callable[[], Any], backup: Optional[Callable[[], Optional[Callable[[], Any]]]] = None,
+             on_lost: Optional[Callable[[bool, Any], None]] = None) -> Tuple[Any, bool]:
+        """
+        Run `primary()`; if it is still running after `delay()`, call `backup()` to
+        obtain the hedge attempt (it may return None, e.g. when no other model is
+        healthy) and run that too. Returns (result, hedge_won). Raises the primary's
+        error if every attempt failed.
+        `on_lost(is_hedge, result)` is called for the attempt that did not win:
+        with result None if it was cancelled before it started, or with its
+        result once it succeeds anyway. A loser that fails is not reported.
+        """
+        with self._lock:
+            self.calls += 1
+        if not self.enabled or backup is None:
+            return self._timed(primary), False
+
+        futures: Dict[Future, bool] = {self._pool.submit(self._timed, primary): False}
+        done, _ = wait(futures, timeout=self.delay())
+        if not done:
+            attempt = backup()
+            if attempt is not None:
+                with self._lock:
+                    self.hedges_fired += 1
+                futures[self._pool.submit(self._timed, attempt)] = True
+
+        errors = []
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in futures:
+                        if loser is not future:
+                            self._lose(loser, futures[loser], on_lost)
+                    if futures[future]:
+                        with self._lock:
+                            self.hedges_won += 1
+                    return future.result(), futures[future]
+                errors.append((futures[future], future.exception()))
+        # Prefer reporting the primary's error
+        errors.sort(key=lambda e: e[0])
+        raise errors[0][1]
+
+    @staticmethod
+    def _lose(future: Future, is_hedge: bool, on_lost: Optional[Callable[[bool, Any], None]]) -> None:
+        if future.cancel():
+            if on_lost is not None:
+                on_lost(is_hedge, None)
+        elif on_lost is not None:
+            # Runs now if the loser already finished, otherwise on its worker thread when it does
+            future.add_done_callback(lambda f: on_lost(is_hedge, f.result()) if f.exception() is None else None)
+
+    def _timed(self, fn: Callable[[], Any]) -> Any:
+        started = time.perf_counter()
+        result = fn()
+        self.observe(time.perf_counter() - started)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "calls": self.calls,
+            "hedges_fired": self.hedges_fired,
+            "hedges_won": self.hedges_won,
+            "fire_rate": round(self.hedges_fired / self.calls, 3) if self.calls else 0.0,
+            "win_rate": round(self.hedges_won / self.hedges_fired, 3) if self.hedges_fired else 0.0,
+            "delay_ms": round(self.delay() * 1000, 1),
+            "attempt_timeout_s": self.attempt_timeout
+        }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
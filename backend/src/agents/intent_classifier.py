@@ -0,0 +1,428 @@
+"""
+Lightweight trainable intent classifier and slot tagger.
+
+Character n-gram and word features are hashed into a fixed-size space and fed
+to NumPy softmax (multinomial logistic regression) models: one for the intent
+of a message and one per-token tagger for its slot spans (task target, new
+title, status). Inference is a handful of array lookups, so it runs in
+microseconds inside TodoAgent; low-confidence predictions go to Gemini.
+
+Training data comes from traffic we already record:
+- AGENT_INTERACTION lines written by log_agent_interaction (input + tools used)
+- user rows of the `messages` table, labelled from the assistant reply that
+  followed them ("... add kar diya", "... delete kar diya", ...)
+Slot spans are weakly labelled with the rule-based IntentEngine.
+
+Artifact format: a single .npz file (no pickling) holding the weight arrays
+and a JSON `meta` string with labels, tags, feature settings and training info.
+
+CLI:
+    python -m src.agents.intent_classifier train --log logs/todo_app.log --db $DATABASE_URL --out models/intent_classifier.npz
+    python -m src.agents.intent_classifier report --model models/intent_classifier.npz --log logs/todo_app.log
+"""
+
+import argparse
+import ast
+import json
+import random
+import re
+import sys
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .intent_engine import IntentEngine, normalize_message, _STATUS_MAP
+
+ARTIFACT_VERSION = 1
+INTENTS = ["add", "delete", "complete", "edit", "list", "chat"]
+TAGS = ["O", "TARGET", "NEW", "TITLE", "STATUS"]
+
+# Slot name (as produced by IntentEngine.parse) -> tag
+_SLOT_TAGS = {"target": "TARGET", "new": "NEW", "title": "TITLE", "status": "STATUS"}
+_TAG_SLOTS = {tag: slot for slot, tag in _SLOT_TAGS.items()}
+
+_TOOL_INTENTS = {
+    "add_task": "add", "delete_task": "delete", "complete_task": "complete",
+    "update_task": "edit", "list_tasks": "list"
+}
+
+# Confirmation phrasing used by the agent's replies -> intent of the user turn before it
+_REPLY_LABELS = [
+    ("edit", re.compile(r"\bko\s+'.+'\s+kar\s+diya|\bupdate\s+kar\s+diya|\brename", re.IGNORECASE)),
+    ("add", re.compile(r"\badd\s+kar\s+(?:diya|diye)|\badded\s+task", re.IGNORECASE)),
+    ("delete", re.compile(r"\bdelete\s+kar\s+diya|\bhata\s+diya|\bmita\s+diya", re.IGNORECASE)),
+    ("complete", re.compile(r"\bcomplete\s+(?:kar|mark\s+kar)\s+diya|\bmark\s+kar\s+diya", re.IGNORECASE)),
+    ("list", re.compile(r"\btasks?\s+hain\b|\bye\s+hain\s+aapke|\bhere\s+are\s+your\s+tasks", re.IGNORECASE)),
+]
+
+_LOG_LINE = re.compile(
+    r"AGENT_INTERACTION - User: (?P<user>.*?), Conversation: (?P<conv>.*?), "
+    r"Input: (?P<input>.*?)\.\.\., Response: (?P<response>.*)\.\.\., Tools: (?P<tools>.*)$"
+)
+
+
+def _hash(feature: str, dims: int) -> int:
+    return zlib.crc32(feature.encode("utf-8")) % dims
+
+
+def message_features(text: str, dims: int, ngram_range: Tuple[int, int] = (2, 4)) -> List[int]:
+    """Hashed character n-grams plus word unigrams/bigrams of a normalized message."""
+    padded = f" {text} "
+    feats = []
+    lo, hi = ngram_range
+    for n in range(lo, hi + 1):
+        for i in range(len(padded) - n + 1):
+            feats.append(_hash("c:" + padded[i:i + n], dims))
+    words = text.split()
+    for i, word in enumerate(words):
+        feats.append(_hash("w:" + word, dims))
+        if i:
+            feats.append(_hash("b:" + words[i - 1] + " " + word, dims))
+    feats.append(_hash("len:" + str(min(len(words), 12)), dims))
+    return feats
+
+
+def token_features(tokens: List[str], i: int, intent: str, dims: int) -> List[int]:
+    """Hashed context features for token i (word, affixes, neighbours, position, intent)."""
+    tok = tokens[i]
+    prev1 = tokens[i - 1] if i > 0 else "<s>"
+    prev2 = tokens[i - 2] if i > 1 else "<s>"
+    next1 = tokens[i + 1] if i + 1 < len(tokens) else "</s>"
+    next2 = tokens[i + 2] if i + 2 < len(tokens) else "</s>"
+    raw = [
+        "w=" + tok, "p3=" + tok[:3], "s3=" + tok[-3:],
+        "-1=" + prev1, "-2=" + prev2, "+1=" + next1, "+2=" + next2,
+        "-1,+1=" + prev1 + "|" + next1,
+        "i=" + intent, "i,w=" + intent + "|" + tok, "i,-1=" + intent + "|" + prev1, "i,+1=" + intent + "|" + next1,
+        "first" if i == 0 else "mid", "last" if i + 1 == len(tokens) else "notlast",
+    ]
+    return [_hash(f, dims) for f in raw]
+
+
+def _softmax(z: np.ndarray) -> np.ndarray:
+    z = z - z.max(axis=-1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def _train_softmax(rows: List[List[int]], labels: List[int], n_classes: int, dims: int,
+                   epochs: int, lr: float, l2: float, batch_size: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Mini-batch gradient descent for multinomial logistic regression over hashed features."""
+    rng = np.random.default_rng(seed)
+    W = np.zeros((dims, n_classes), dtype=np.float32)
+    b = np.zeros(n_classes, dtype=np.float32)
+    y = np.asarray(labels)
+    order = np.arange(len(rows))
+    for _ in range(epochs):
+        rng.shuffle(order)
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            X = np.zeros((len(idx), dims), dtype=np.float32)
+            for r, row in enumerate(idx):
+                np.add.at(X[r], rows[row], 1.0)
+            probs = _softmax(X @ W + b)
+            probs[np.arange(len(idx)), y[idx]] -= 1.0
+            grad_W = X.T @ probs / len(idx) + l2 * W
+            grad_b = probs.mean(axis=0)
+            W -= lr * grad_W
+            b -= lr * grad_b
+    return W, b
+
+
+class IntentClassifier:
+    """Trained intent model + slot tagger with the same output shape as IntentEngine.parse."""
+
+    def __init__(self, W_intent: np.ndarray, b_intent: np.ndarray, W_tag: np.ndarray, b_tag: np.ndarray,
+                 meta: Dict[str, Any]):
+        self.W_intent, self.b_intent = W_intent, b_intent
+        self.W_tag, self.b_tag = W_tag, b_tag
+        self.meta = meta
+        self.intents: List[str] = meta["intents"]
+        self.tags: List[str] = meta["tags"]
+        self.dims: int = meta["dims"]
+        self.ngram_range = tuple(meta["ngram_range"])
+
+    # --- inference ---
+
+    def intent_probs(self, text: str) -> np.ndarray:
+        feats = message_features(text, self.dims, self.ngram_range)
+        return _softmax(self.W_intent[feats].sum(axis=0) + self.b_intent)
+
+    def tag_tokens(self, tokens: List[str], intent: str) -> List[str]:
+        if not tokens:
+            return []
+        scores = np.stack([self.W_tag[token_features(tokens, i, intent, self.dims)].sum(axis=0)
+                           for i in range(len(tokens))]) + self.b_tag
+        return [self.tags[k] for k in scores.argmax(axis=1)]
+
+    def predict(self, message: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns {"intent", "confidence", "slots"} like IntentEngine.parse, or None
+        for chat/small talk. Callers decide what confidence is good enough.
+        """
+        text = normalize_message(message)
+        if not text:
+            return None
+        probs = self.intent_probs(text)
+        best = int(probs.argmax())
+        intent = self.intents[best]
+        if intent == "chat":
+            return None
+
+        tokens = text.split()
+        spans: Dict[str, List[str]] = {}
+        closed, previous = set(), None
+        for token, tag in zip(tokens, self.tag_tokens(tokens, intent)):
+            slot = _TAG_SLOTS.get(tag)
+            if previous and previous != slot:
+                closed.add(previous)
+            # Keep only the first contiguous span of each slot
+            if slot and slot not in closed:
+                spans.setdefault(slot, []).append(token)
+            previous = slot
+        slots = {slot: " ".join(words) for slot, words in spans.items()}
+        if intent == "list":
+            slots["status"] = _STATUS_MAP.get(slots.get("status"), "all")
+        return {"intent": intent, "confidence": float(probs[best]), "slots": slots}
+
+    # --- persistence ---
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(
+            path,
+            W_intent=self.W_intent, b_intent=self.b_intent,
+            W_tag=self.W_tag, b_tag=self.b_tag,
+            meta=np.array(json.dumps(self.meta))
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "IntentClassifier":
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("version") != ARTIFACT_VERSION:
+                raise ValueError(f"Unsupported intent model version: {meta.get('version')}")
+            return cls(data["W_intent"], data["b_intent"], data["W_tag"], data["b_tag"], meta)
+
+    # --- training ---
+
+    @classmethod
+    def train(cls, examples: List[Tuple[str, str]], dims: int = 2 ** 14, ngram_range: Tuple[int, int] = (2, 4),
+              epochs: int = 30, lr: float = 0.5, l2: float = 1e-5, batch_size: int = 64,
+              seed: int = 13) -> "IntentClassifier":
+        """Train from (message, intent) pairs. Slot spans are weakly labelled with IntentEngine rules."""
+        rules = IntentEngine()
+        texts = [normalize_message(m) for m, _ in examples]
+        intent_rows = [message_features(t, dims, ngram_range) for t in texts]
+        intent_labels = [INTENTS.index(label) for _, label in examples]
+        W_intent, b_intent = _train_softmax(intent_rows, intent_labels, len(INTENTS), dims,
+                                            epochs, lr, l2, batch_size, seed)
+
+        tag_rows, tag_labels = [], []
+        for text, (_, label) in zip(texts, examples):
+            tags = weak_slot_tags(text, label, rules)
+            if tags is None:
+                continue
+            tokens = text.split()
+            for i, tag in enumerate(tags):
+                tag_rows.append(token_features(tokens, i, label, dims))
+                tag_labels.append(TAGS.index(tag))
+        if tag_rows:
+            W_tag, b_tag = _train_softmax(tag_rows, tag_labels, len(TAGS), dims, epochs, lr, l2, batch_size, seed)
+        else:
+            W_tag = np.zeros((dims, len(TAGS)), dtype=np.float32)
+            b_tag = np.zeros(len(TAGS), dtype=np.float32)
+
+        meta = {
+            "version": ARTIFACT_VERSION,
+            "intents": INTENTS,
+            "tags": TAGS,
+            "dims": dims,
+            "ngram_range": list(ngram_range),
+            "trained_at": datetime.utcnow().isoformat(),
+            "n_examples": len(examples),
+            "n_tagged_tokens": len(tag_rows)
+        }
+        return cls(W_intent, b_intent, W_tag, b_tag, meta)
+
+
+def weak_slot_tags(text: str, intent: str, rules: IntentEngine) -> Optional[List[str]]:
+    """Token tags for `text` derived from the rule engine's slots, or None if the rules disagree."""
+    tokens = text.split()
+    if intent == "chat":
+        return ["O"] * len(tokens)
+    parsed = rules.parse(text)
+    if not parsed or parsed["intent"] != intent:
+        return None
+    tags = ["O"] * len(tokens)
+    for slot, value in parsed["slots"].items():
+        if slot not in _SLOT_TAGS or (slot == "status" and value == "all"):
+            continue
+        span = value.split()
+        for start in range(len(tokens) - len(span) + 1):
+            if tokens[start:start + len(span)] == span:
+                tags[start:start + len(span)] = [_SLOT_TAGS[slot]] * len(span)
+                break
+    return tags
+
+
+# --- data loading ---
+
+def load_log_examples(path: str) -> List[Tuple[str, str]]:
+    """(message, intent) pairs from AGENT_INTERACTION lines in any text log (file or container stdout)."""
+    examples = []
+    with open(path, encoding="utf-8", errors="replace") as fh:
+        for line in fh:
+            match = _LOG_LINE.search(line.rstrip("\n"))
+            if not match:
+                continue
+            tools = match.group("tools").strip()
+            try:
+                names = [] if tools == "None" else ast.literal_eval(tools)
+            except (ValueError, SyntaxError):
+                continue
+            intent = _TOOL_INTENTS.get(names[0], "chat") if names else "chat"
+            examples.append((match.group("input"), intent))
+    return examples
+
+
+def label_from_reply(reply: str) -> Optional[str]:
+    for intent, pattern in _REPLY_LABELS:
+        if pattern.search(reply):
+            return intent
+    return None
+
+
+def load_message_examples(database_url: str) -> List[Tuple[str, str]]:
+    """(message, intent) pairs from the messages table, labelled by the assistant reply that followed."""
+    from sqlmodel import Session, create_engine, select
+    from ..models.message import Message
+
+    engine = create_engine(database_url)
+    examples = []
+    with Session(engine) as session:
+        rows = session.exec(select(Message).order_by(Message.conversation_id, Message.created_at)).all()
+    for current, following in zip(rows, rows[1:]):
+        if current.role != "user" or following.role != "assistant" or current.conversation_id != following.conversation_id:
+            continue
+        intent = label_from_reply(following.content)
+        if intent:
+            examples.append((current.content, intent))
+    return examples
+
+
+def dedupe(examples: Iterable[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    seen = {}
+    for message, intent in examples:
+        seen.setdefault(normalize_message(message), (message, intent))
+    return list(seen.values())
+
+
+# --- evaluation ---
+
+def legacy_fallback_intent(message: str) -> str:
+    """Intent chosen by the branch order of TodoAgent's original fallback regexes."""
+    m = message.lower().strip()
+    if "add" in m or "create" in m:
+        return "add"
+    if re.search(r'\b(?:upd|edi|cha|ren)', m):
+        return "edit"
+    if re.search(r'\b(?:del|rem)', m):
+        return "delete"
+    if re.search(r'\b(?:comp|fin|don|mark.*?c|mark.*?d|as\s+done|mark.*?done)', m):
+        return "complete"
+    if "list" in m or "show" in m or "all" in m:
+        return "list"
+    return "chat"
+
+
+def evaluate(classifier: IntentClassifier, examples: List[Tuple[str, str]]) -> Dict[str, Dict[str, float]]:
+    """Accuracy and per-message latency (µs) of the classifier vs the rule engine vs the legacy regexes."""
+    rules = IntentEngine()
+
+    def classifier_intent(message):
+        parsed = classifier.predict(message)
+        return parsed["intent"] if parsed else "chat"
+
+    def rules_intent(message):
+        parsed = rules.parse(message)
+        return parsed["intent"] if parsed else "chat"
+
+    methods = {
+        "classifier": classifier_intent,
+        "intent_engine": rules_intent,
+        "legacy_fallback": legacy_fallback_intent,
+    }
+    report = {}
+    for name, fn in methods.items():
+        correct, timings = 0, []
+        for message, label in examples:
+            start = time.perf_counter()
+            predicted = fn(message)
+            timings.append((time.perf_counter() - start) * 1e6)
+            correct += predicted == label
+        timings.sort()
+        report[name] = {
+            "accuracy": correct / len(examples) if examples else 0.0,
+            "mean_us": sum(timings) / len(timings) if timings else 0.0,
+            "p50_us": timings[len(timings) // 2] if timings else 0.0,
+            "p99_us": timings[min(len(timings) - 1, int(len(timings) * 0.99))] if timings else 0.0,
+        }
+    return report
+
+
+def format_report(report: Dict[str, Dict[str, float]], n: int) -> str:
+    lines = [f"Evaluated on {n} messages", f"{'method':<18}{'accuracy':>10}{'mean µs':>10}{'p50 µs':>10}{'p99 µs':>10}"]
+    for name, row in report.items():
+        lines.append(f"{name:<18}{row['accuracy']:>10.3f}{row['mean_us']:>10.1f}{row['p50_us']:>10.1f}{row['p99_us']:>10.1f}")
+    return "\n".join(lines)
+
+
+def _load_examples(args) -> List[Tuple[str, str]]:
+    examples = []
+    for path in args.log or []:
+        examples.extend(load_log_examples(path))
+    if args.db:
+        examples.extend(load_message_examples(args.db))
+    return dedupe(examples)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Train or evaluate the chat intent classifier.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("train", "report"):
+        cmd = sub.add_parser(name)
+        cmd.add_argument("--log", action="append", help="Log file with AGENT_INTERACTION lines (repeatable)")
+        cmd.add_argument("--db", help="Database URL to read the messages table from")
+    train_cmd = sub.choices["train"]
+    train_cmd.add_argument("--out", required=True, help="Where to write the .npz artifact")
+    train_cmd.add_argument("--dims", type=int, default=2 ** 14)
+    train_cmd.add_argument("--epochs", type=int, default=30)
+    train_cmd.add_argument("--holdout", type=float, default=0.2, help="Fraction kept aside for the report")
+    sub.choices["report"].add_argument("--model", required=True)
+    args = parser.parse_args(argv)
+
+    examples = _load_examples(args)
+    if not examples:
+        print("No labelled examples found.", file=sys.stderr)
+        return 1
+
+    if args.command == "train":
+        random.Random(13).shuffle(examples)
+        cut = int(len(examples) * (1 - args.holdout))
+        train_set, test_set = examples[:cut], examples[cut:] or examples[:cut]
+        classifier = IntentClassifier.train(train_set, dims=args.dims, epochs=args.epochs)
+        classifier.save(args.out)
+        print(f"Saved {args.out} ({len(train_set)} training examples)")
+    else:
+        classifier = IntentClassifier.load(args.model)
+        test_set = examples
+
+    print(format_report(evaluate(classifier, test_set), len(test_set)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
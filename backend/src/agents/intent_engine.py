@@ -0,0 +1,363 @@
+"""Deterministic pre-LLM intent engine for common task commands"""
+
+import logging
+import os
+import re
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..utils.validation import validate_task_title
+from .context_builder import DEFAULT_LIST_PAGE_SIZE, paginate
+from .schedule_extractor import apply_schedule, describe, local_now
+from .title_generator import generate_title
+
+logger = logging.getLogger(__name__)
+
+# Below this confidence the message is handed to the model
+DEFAULT_MIN_CONFIDENCE = float(os.getenv("INTENT_ENGINE_MIN_CONFIDENCE", "0.8"))
+# Optional trained classifier (see intent_classifier.py) consulted when no rule matches
+DEFAULT_INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "")
+
+# Longer messages are treated as chat and left to the model
+MAX_COMMAND_WORDS = 15
+# Users whose last listed page is remembered for "more" / "next page"
+MAX_LIST_CURSORS = 1024
+
+_DO = r'(?:kar\s+do|kardo|kr\s+do|karo|kar\s+dein|kar\s+den|do|dein|den)'
+_TASK_WORD = r'(?:tasks?|todos?|to-dos?|list)'
+_LEAD = r'(?:please\s+|plz\s+|pls\s+)?'
+# "... wala task", "... wali", "... task": marks the words before it as a task reference
+_TASK_MARKER = r'(?:(?:wala|wali)\s+(?:task\s+)?|task\s+)'
+_TAIL = r'(?:\s+(?:please|plz|pls|now))?'
+# "add ...", "create a new task: ...", "new task ..."; a bare "new" starts a title ("new york trip")
+_ADD = (r'(?:(?:add|create)\s+(?:a\s+|an\s+)?(?:new\s+)?(?:task\s*(?:called\s+|named\s+|:\s*)?)?'
+        r'|new\s+(?:task|todo)\s*(?:called\s+|named\s+|:\s*)?)')
+
+# (intent, confidence, pattern). Checked in order; the first match wins.
+# English rules are anchored on a leading verb, Roman Urdu rules on a trailing verb phrase.
+RULES: List[Tuple[str, float, "re.Pattern"]] = [
+    # --- list (paging) ---
+    ("list", 0.95, re.compile(
+        rf'^(?:show\s+)?(?:the\s+)?(?P<page>more|next)(?:\s+(?:tasks|page))?{_TAIL}$')),
+    ("list", 0.95, re.compile(
+        r'^(?:show\s+)?(?:tasks\s+)?page\s+(?P<page>\d+)$')),
+    ("list", 0.9, re.compile(
+        r'^(?P<page>aur|agle|agla)\s+(?:tasks\s+|kaam\s+|page\s+)?(?:dikhao|dikha\s+do|batao|bata\s+do)$')),
+
+    # --- list ---
+    ("list", 0.95, re.compile(
+        rf'^{_LEAD}(?:show|list|display|view|see|get|give|tell)(?:\s+me)?(?:\s+(?:all|my|all\s+my|the))?'
+        rf'(?:\s+(?P<status>pending|completed|done|incomplete|remaining|finished))?\s+{_TASK_WORD}{_TAIL}$')),
+    ("list", 0.95, re.compile(
+        rf'^(?:list|tasks|todos|my\s+tasks|all\s+tasks|(?P<status>pending|completed)\s+tasks)$')),
+    ("list", 0.9, re.compile(
+        rf'^what\s+(?:are|is)\s+(?:on\s+)?my\s+(?:(?P<status>pending|completed)\s+)?{_TASK_WORD}$')),
+    ("list", 0.9, re.compile(
+        r'^(?:mere|meray|meri|sab|saare|sare)?\s*(?:(?P<status>pending|completed|baqi|baaki|mukammal)\s+)?'
+        r'(?:tasks?|kaam)\s+(?:dikhao|dikha\s+do|dikhayen|batao|bata\s+do|btao|show\s+karo|list\s+karo)$')),
+    ("list", 0.9, re.compile(
+        r'^(?:mere\s+)?(?:kya\s+kya|kon\s+se|kaun\s+se|kitne)\s+(?:(?P<status>pending|baqi|baaki)\s+)?'
+        r'(?:tasks?|kaam)\s+(?:hain|hai|baqi\s+hain)$')),
+
+    # --- edit (English) ---
+    ("edit", 0.95, re.compile(
+        rf'^{_LEAD}(?:edit|change|update|rename|modify)\s+(?:the\s+)?(?:task\s+(?:called\s+|named\s+)?)?'
+        r'(?P<target>.+?)\s+(?:to|into|as)\s+(?P<new>.+?)$')),
+
+    # --- delete ---
+    ("delete", 0.95, re.compile(
+        rf'^{_LEAD}(?:delete|remove|erase|drop)\s+(?:the\s+)?(?:task\s+(?:called\s+|named\s+)?)?'
+        rf'(?P<target>.+?)(?:\s+task)?(?:\s+from\s+(?:my\s+)?{_TASK_WORD})?{_TAIL}$')),
+    ("delete", 0.9, re.compile(
+        rf'^(?P<target>.+?)\s+(?:wala\s+|wali\s+)?(?:task\s+)?(?:ko\s+)?'
+        rf'(?:delete|remove|mita|mitaa|hata|hataa|nikal)\s+{_DO}{_TAIL}$')),
+
+    # --- complete ---
+    ("complete", 0.95, re.compile(
+        rf'^{_LEAD}mark\s+(?:the\s+)?(?:task\s+)?(?P<target>.+?)\s+(?:as\s+)?(?:done|complete|completed|finished){_TAIL}$')),
+    ("complete", 0.95, re.compile(
+        rf'^{_LEAD}(?:complete|finish|tick\s+off|check\s+off)\s+(?:the\s+)?(?:task\s+(?:called\s+|named\s+)?)?'
+        rf'(?P<target>.+?)(?:\s+task)?{_TAIL}$')),
+    ("complete", 0.9, re.compile(
+        rf'^(?P<target>.+?)\s+(?:wala\s+|wali\s+)?(?:task\s+)?(?:ko\s+)?'
+        rf'(?:complete|mukammal|khatam|done|poora|pura)\s+(?:{_DO}|kar\s+diya){_TAIL}$')),
+    # A statement ("... ho gaya") only with a task marker: "milk khatam ho gaya" means the milk ran out
+    ("complete", 0.85, re.compile(
+        rf'^(?P<target>.+?)\s+{_TASK_MARKER}(?:is\s+)?'
+        r'(?:(?:done|complete|khatam|mukammal|poora|pura)(?:\s+(?:ho\s+gaya|ho\s+gya|hogaya|ho\s+chuka))?'
+        r'|ho\s+gaya|ho\s+gya|hogaya|ho\s+chuka)$')),
+
+    # --- add ---
+    ("add", 0.9, re.compile(
+        rf'^{_LEAD}{_ADD}(?P<title>.+?)(?:\s+to\s+(?:my\s+)?{_TASK_WORD}){_TAIL}$')),
+    ("add", 0.9, re.compile(
+        rf'^{_LEAD}{_ADD}(?P<title>.+?){_TAIL}$')),
+    ("add", 0.85, re.compile(
+        rf'^{_LEAD}(?:remind\s+me\s+to|remember\s+to)\s+(?P<title>.+?){_TAIL}$')),
+    # Only with a task or list marker: "chai mein cheeni dal do" is not a task
+    ("add", 0.85, re.compile(
+        rf'^(?P<title>.+?)\s+(?:(?:ka|ki|ko)\s+)?(?:task\s+|(?:ko\s+)?{_TASK_WORD}\s+(?:mein|me|main|par|pe)\s+)'
+        rf'(?:add|shamil|daal|dal|likh)\s+{_DO}{_TAIL}$')),
+
+    # --- edit (Roman Urdu): "milk ka naam doodh rakh do", "milk ko rename karke doodh kar do" ---
+    # Only with an explicit rename marker: "ammi ko call kar do" is a request, not a rename
+    ("edit", 0.85, re.compile(
+        r'^(?P<target>.+?)\s+(?:wala\s+|wali\s+)?(?:task\s+)?'
+        r'(?:ka\s+naam(?:\s+badal\s+(?:ke|kar|kr)(?:\s+se)?)?|(?:ko\s+)?rename\s+(?:kar\s+ke|karke|kr\s+ke|krke))'
+        r'\s+(?P<new>.+?)\s+(?:kar\s+do|kardo|kr\s+do|karo|rakh\s+do|rakho|bana\s+do|badal\s+do)$')),
+]
+
+_STATUS_MAP = {
+    "pending": "pending", "incomplete": "pending", "remaining": "pending", "baqi": "pending", "baaki": "pending",
+    "completed": "completed", "done": "completed", "finished": "completed", "mukammal": "completed"
+}
+
+# Leading words that make a message a question or small talk rather than a command
+_CHATTY_START = re.compile(
+    r'^(?:what|why|how|when|where|who|which|should|could|would|can\s+you\s+explain|do\s+you|'
+    r'kya\s+aap|kyun|kyon|kaise|kab|kahan)\b')
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase, collapse whitespace and strip trailing sentence punctuation."""
+    text = " ".join(message.lower().split())
+    return text.strip().rstrip('.!').strip()
+
+
+def clean_title(text: str) -> str:
+    """Strip quotes and filler articles from an extracted title or identifier."""
+    text = text.strip().strip('"\'').strip()
+    text = re.sub(r'^(?:the|a|an|my|task|called|named)\s+', '', text)
+    text = re.sub(r'\s+(?:wala|wali|task)$', '', text)
+    text = text.strip().strip('"\'').strip()
+    return "" if text in ("task", "tasks") else text
+
+
+def match_tasks(identifier: str, tasks: List[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    Resolve an identifier against an in-memory task list with the same rules
+    as TaskService.resolve_task: ID, then exact title, then unique substring.
+    Returns (task, status) where status is 'FOUND', 'AMBIGUOUS', or 'NOT_FOUND'.
+    """
+    if not identifier:
+        return None, "NOT_FOUND"
+    identifier = identifier.strip().strip('"').strip("'").strip('[]').strip('()').strip('{}').strip()
+    if not identifier:
+        return None, "NOT_FOUND"
+
+    if len(identifier) >= 30:
+        for task in tasks:
+            if str(task["id"]) == identifier:
+                return task, "FOUND"
+
+    needle = identifier.lower()
+    exact = [t for t in tasks if t["title"].lower() == needle]
+    if len(exact) == 1:
+        return exact[0], "FOUND"
+    elif len(exact) > 1:
+        return None, "AMBIGUOUS"
+
+    partial = [t for t in tasks if needle in t["title"].lower()]
+    if len(partial) == 1:
+        return partial[0], "FOUND"
+    elif len(partial) > 1:
+        return None, "AMBIGUOUS"
+    return None, "NOT_FOUND"
+
+
+def ambiguous_candidates(identifier: str, tasks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    The tasks an AMBIGUOUS identifier could mean, under the rules of
+    match_tasks: every exact title match, otherwise every partial match.
+    """
+    needle = clean_title(identifier or "").lower()
+    if not needle:
+        return []
+    exact = [t for t in tasks if t["title"].lower() == needle]
+    if len(exact) > 1:
+        return exact
+    return [t for t in tasks if needle in t["title"].lower()]
+
+
+class IntentEngine:
+    """
+    Answers unambiguous add/delete/complete/edit/list commands (English and
+    Roman Urdu) locally, producing the same result shape as the model path.
+    Anything ambiguous, unresolvable or chatty is left to the model.
+    """
+
+    def __init__(self, min_confidence: float = DEFAULT_MIN_CONFIDENCE, classifier=None,
+                 model_path: str = DEFAULT_INTENT_MODEL_PATH, page_size: int = DEFAULT_LIST_PAGE_SIZE,
+                 clock: Callable[[], datetime] = local_now):
+        self.min_confidence = min_confidence
+        # Reads relative due dates ("kal", "tomorrow") in added titles
+        self._clock = clock
+        self.classifier = classifier or self._load_classifier(model_path)
+        self.page_size = page_size
+        # user_id -> (status, page) of the last list answer, for "more"
+        self._list_cursors: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self.handled = 0
+        self.deferred = 0
+        self.classified = 0
+
+    @staticmethod
+    def _load_classifier(model_path: str):
+        if not model_path:
+            return None
+        if not os.path.exists(model_path):
+            logger.warning(f"INTENT_ENGINE - Intent model {model_path} not found, using rules only")
+            return None
+        # Imported lazily so NumPy is only needed when a trained model is configured
+        from .intent_classifier import IntentClassifier
+        classifier = IntentClassifier.load(model_path)
+        logger.info(f"INTENT_ENGINE - Loaded intent model {model_path} ({classifier.meta.get('n_examples')} examples)")
+        return classifier
+
+    def parse(self, message: str) -> Optional[Dict[str, Any]]:
+        """
+        Classify a message without looking at the task list.
+        Returns {"intent", "confidence", "slots"} or None when no rule applies.
+        """
+        text = normalize_message(message)
+        if not text or len(text.split()) > MAX_COMMAND_WORDS:
+            return None
+
+        for intent, confidence, pattern in RULES:
+            match = pattern.match(text)
+            if not match:
+                continue
+            slots = {k: v for k, v in match.groupdict().items() if v}
+            if intent != "list" and ('?' in text or _CHATTY_START.match(text)):
+                # Questions that happen to contain a verb ("what should I add?")
+                return None
+            if intent == "list":
+                slots["status"] = _STATUS_MAP.get(slots.get("status"), "all")
+            return {"intent": intent, "confidence": confidence, "slots": slots}
+        return None
+
+    def answer(self, user_id: str, message: str, tasks: List[Dict[str, Any]],
+               conversation_id: str = None) -> Optional[Dict[str, Any]]:
+        """
+        Build a full reply (response text + tool calls) when the message is a
+        confident command that resolves against `tasks`; otherwise None.
+        """
+        parsed = self.parse(message)
+        if parsed is None and self.classifier is not None:
+            parsed = self.classifier.predict(message)
+            if parsed is not None and parsed["confidence"] >= self.min_confidence:
+                self.classified += 1
+        result = self._build(user_id, parsed, tasks) if parsed else None
+        if result is None or result["confidence"] < self.min_confidence:
+            self.deferred += 1
+            return None
+
+        self.handled += 1
+        result.update({"conversation_id": conversation_id, "chat_title": generate_title(message)})
+        return result
+
+    def _build(self, user_id: str, parsed: Dict[str, Any], tasks: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        intent, confidence, slots = parsed["intent"], parsed["confidence"], parsed["slots"]
+
+        if intent == "list":
+            status, page = slots["status"], slots.get("page")
+            if page is None:
+                page = 1
+            elif page.isdigit():
+                page = int(page)
+            else:
+                # "more" / "aur dikhao": next page of the previous listing
+                status, last_page = self._list_cursors.get(user_id, (status, 1))
+                page = last_page + 1
+            matching = [t for t in tasks if status == "all"
+                        or (status == "completed") == bool(t["completed"])]
+            shown, page, pages = paginate(matching, page, self.page_size)
+            self._remember_page(user_id, status, page)
+
+            label = "" if status == "all" else f"{status} "
+            if shown:
+                start = (page - 1) * self.page_size + 1
+                lines = "\n".join(f"{i}. {t['title']} ({'Completed' if t['completed'] else 'Pending'})"
+                                  for i, t in enumerate(shown, start))
+                response = f"Aapke paas {len(matching)} {label}tasks hain:\n{lines}"
+                if pages > 1:
+                    response += f"\n\n(Page {page}/{pages}"
+                    response += ". Agle tasks dekhne ke liye 'more' likhein.)" if page < pages else ")"
+            else:
+                response = f"Aapke paas abhi koi {label}task nahi hai. 🙂"
+            calls = [{"name": "list_tasks", "arguments": {"status": status, "user_id": user_id}}]
+            return {"intent": intent, "confidence": confidence, "response": response, "tool_calls": calls}
+
+        if intent == "add":
+            raw = slots.get("title", "")
+            # "milk, eggs and bread" -> three tasks; without a comma keep the phrase whole
+            parts = re.split(r'\s*,\s*|\s+(?:and|aur)\s+', raw) if ',' in raw else [raw]
+            titles = [clean_title(p) for p in parts]
+            titles = [t for t in titles if t]
+            if not titles or not all(validate_task_title(t)[0] for t in titles):
+                return None
+            calls = [{"name": "add_task", "arguments": {"title": t, "user_id": user_id}} for t in titles]
+            # "doctor ko call karna kal 5 baje" -> title "doctor ko call karna" due tomorrow 17:00
+            apply_schedule(calls, now=self._clock())
+            titles = [call["arguments"]["title"] for call in calls]
+            if len(titles) == 1:
+                response = f"Theek hai, '{titles[0]}'{describe(calls[0]['arguments'])} add kar diya hai. 🙂"
+            else:
+                response = f"Theek hai, {len(titles)} tasks add kar diye: {', '.join(titles)}. 🙂"
+            return {"intent": intent, "confidence": confidence, "response": response, "tool_calls": calls}
+
+        target = clean_title(slots.get("target", ""))
+        task, status = match_tasks(target, tasks)
+        if status == "AMBIGUOUS":
+            return self._clarify(intent, confidence, target, slots, tasks)
+        if status != "FOUND":
+            # Unknown target: let the model explain
+            return {"intent": intent, "confidence": 0.3, "response": "", "tool_calls": []}
+        if not re.search(rf'\b{re.escape(target)}\b', task["title"].lower()) and target != str(task["id"]):
+            # Found only as a fragment of a word ("all" in "call mom"): too weak to act on
+            return {"intent": intent, "confidence": 0.5, "response": "", "tool_calls": []}
+
+        if intent == "delete":
+            response = f"Theek hai, task '{task['title']}' delete kar diya hai. 🙂"
+            calls = [{"name": "delete_task", "arguments": {"task_id": task["id"], "user_id": user_id}}]
+        elif intent == "complete":
+            response = f"Theek hai, task '{task['title']}' complete kar diya hai. 🙂"
+            calls = [{"name": "complete_task", "arguments": {"task_id": task["id"], "user_id": user_id}}]
+        else:
+            new_title = clean_title(slots.get("new", ""))
+            if not validate_task_title(new_title)[0]:
+                return None
+            response = f"Theek hai, task '{task['title']}' ko '{new_title}' kar diya hai. 🙂"
+            calls = [{"name": "update_task", "arguments": {"task_id": task["id"], "title": new_title, "user_id": user_id}}]
+        return {"intent": intent, "confidence": confidence, "response": response, "tool_calls": calls}
+
+    def _clarify(self, intent: str, confidence: float, target: str, slots: Dict[str, Any],
+                 tasks: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        A confident command whose target matches several tasks: the result
+        carries "clarify" ({action, target, arguments, candidates}) instead of
+        tool calls, and the agent asks which task was meant.
+        """
+        # Fragments of words ("all" in "call mom") are too weak to ask about
+        candidates = [t for t in ambiguous_candidates(target, tasks)
+                      if re.search(rf'\b{re.escape(target)}\b', t["title"].lower())]
+        if len(candidates) < 2:
+            return {"intent": intent, "confidence": 0.3, "response": "", "tool_calls": []}
+        arguments = {}
+        if intent == "edit":
+            new_title = clean_title(slots.get("new", ""))
+            if not validate_task_title(new_title)[0]:
+                return None
+            arguments["title"] = new_title
+        action = {"delete": "delete_task", "complete": "complete_task", "edit": "update_task"}[intent]
+        return {"intent": intent, "confidence": confidence, "response": "", "tool_calls": [],
+                "clarify": {"action": action, "target": target, "arguments": arguments, "candidates": candidates}}
+
+    def _remember_page(self, user_id: str, status: str, page: int) -> None:
+        self._list_cursors[user_id] = (status, page)
+        self._list_cursors.move_to_end(user_id)
+        while len(self._list_cursors) > MAX_LIST_CURSORS:
+            self._list_cursors.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"handled": self.handled, "deferred": self.deferred, "classified": self.classified}
@@ -0,0 +1,84 @@
+"""Bounded executor for blocking LLM calls made from async endpoints"""
+
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator
+
+# Maximum number of LLM turns running at the same time
+DEFAULT_LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+
+class LLMExecutor:
+    """
+    Runs synchronous agent work (Gemini generate_content, fallback DB lookups)
+    on a dedicated thread pool so a slow model never blocks the event loop.
+
+    The pool is separate from the default executor used by FastAPI for sync
+    endpoints, so pending LLM calls cannot starve plain task CRUD either.
+    Calls beyond `max_concurrency` wait in the pool's queue.
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._pending = 0
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run `fn(*args, **kwargs)` on the pool and await its result."""
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        try:
+            return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self._pending -= 1
+
+    async def stream(self, fn: Callable[..., Iterator], *args, **kwargs) -> AsyncIterator:
+        """
+        Iterate the sync generator returned by `fn(*args, **kwargs)` on the pool,
+        yielding its items on the event loop as soon as they are produced.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                iterator = fn(*args, **kwargs)
+                for item in iterator:
+                    if stop.is_set():
+                        # Consumer went away (e.g. client disconnected)
+                        iterator.close()
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+            except BaseException as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (finished, e))
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, (finished, None))
+
+        self._pending += 1
+        loop.run_in_executor(self._pool, produce)
+        try:
+            while True:
+                item, error = await queue.get()
+                if item is finished:
+                    if error is not None:
+                        raise error
+                    break
+                yield item
+        finally:
+            stop.set()
+            self._pending -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """Current load: calls submitted and not yet finished (running + queued)."""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "pending": self._pending
+        }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
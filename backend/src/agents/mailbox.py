@@ -0,0 +1,111 @@
+"""Per-user serialization and single-flight coalescing of chat turns"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .intent_engine import normalize_message
+
+TurnKey = Tuple[str, str, str]
+
+
+class ChatMailbox:
+    """
+    Runs chat turns for one user strictly one after another, and lets an
+    identical message that arrives while the first copy is still in flight
+    (double-click, client retry) share that turn's result instead of running
+    the agent and its tool calls a second time.
+
+    Identity is (user id, conversation id, normalized message text). A copy
+    sent after the first turn has finished is a new turn.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[TurnKey, asyncio.Future] = {}
+        # user_id -> [lock, number of turns holding or waiting for it]
+        self._locks: Dict[str, list] = {}
+        self.turns = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key(user_id: str, conversation_id: Optional[str], message: str) -> TurnKey:
+        return (user_id, conversation_id or "", normalize_message(message))
+
+    def join(self, key: TurnKey) -> Optional[asyncio.Future]:
+        """The in-flight result for `key`, if an identical turn is already running."""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        return future
+
+    @asynccontextmanager
+    async def claim(self, key: TurnKey):
+        """
+        Register the caller as the turn that owns `key`. Yields the future that
+        identical requests wait on; the owner must set its result. If the block
+        exits without a result, waiters receive the same exception; if the
+        owner is cancelled (its client went away), the future is cancelled and
+        waiters run the turn themselves (see run).
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.turns += 1
+        try:
+            yield future
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                # Mark retrieved so an unobserved failure is not logged twice
+                future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    @asynccontextmanager
+    async def serialized(self, user_id: str):
+        """Hold the user's turn lock: turns of one user run in arrival order."""
+        entry = self._locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[user_id]
+
+    async def run(self, user_id: str, conversation_id: Optional[str], message: str,
+                  turn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `turn()` for this user in order, or share the result of an identical in-flight turn."""
+        key = self.key(user_id, conversation_id, message)
+        shared = self.join(key)
+        while shared is not None:
+            try:
+                return await asyncio.shield(shared)
+            except asyncio.CancelledError:
+                if not shared.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                # The owner was cancelled, not this request: run the turn (or join a newer owner)
+                shared = self.join(key)
+        async with self.claim(key) as future:
+            async with self.serialized(user_id):
+                result = await turn()
+            future.set_result(result)
+            return result
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "turns": self.turns,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+            "users_waiting": sum(1 for entry in self._locks.values() if entry[1] > 1)
+        }
+
+
+mailbox = ChatMailbox()
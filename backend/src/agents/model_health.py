@@ -0,0 +1,224 @@
+"""Per-model circuit breakers with rolling error rate and EWMA latency"""
+
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional
+
+# Consecutive failures (or a single 429) that open a model's breaker
+DEFAULT_BREAKER_FAILURES = int(os.getenv("MODEL_BREAKER_FAILURES", "3"))
+# Rolling error rate over the last DEFAULT_BREAKER_WINDOW calls that also opens it
+DEFAULT_BREAKER_ERROR_RATE = float(os.getenv("MODEL_BREAKER_ERROR_RATE", "0.5"))
+DEFAULT_BREAKER_WINDOW = int(os.getenv("MODEL_BREAKER_WINDOW", "20"))
+# Backoff while open: base * 2^(times opened in a row - 1), capped, with +/-50% jitter
+DEFAULT_BREAKER_BACKOFF_SECONDS = float(os.getenv("MODEL_BREAKER_BACKOFF_SECONDS", "2"))
+DEFAULT_BREAKER_MAX_BACKOFF_SECONDS = float(os.getenv("MODEL_BREAKER_MAX_BACKOFF_SECONDS", "120"))
+EWMA_ALPHA = 0.3
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+_RETRY_IN = re.compile(r'retry(?:_delay)?\s*(?:in|:|\{\s*seconds:)\s*(\d+(?:\.\d+)?)\s*s?', re.IGNORECASE)
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """True for HTTP 429 / RESOURCE_EXHAUSTED errors from either SDK."""
+    for attr in ("code", "status_code"):
+        if getattr(error, attr, None) == 429:
+            return True
+    text = str(error)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text or "Resource has been exhausted" in text
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Server-requested delay from a Retry-After header or Gemini's 'retry in Ns' hint, if any."""
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if headers is not None:
+            value = headers.get("retry-after") or headers.get("Retry-After")
+    if value is not None:
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            try:
+                return max(0.0, parsedate_to_datetime(str(value)).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    match = _RETRY_IN.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+class ModelHealth:
+    """Breaker state and rolling statistics for one model."""
+
+    def __init__(self, name: str, window: int):
+        self.name = name
+        self.outcomes: deque = deque(maxlen=window)
+        self.ewma_latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.times_opened = 0
+        self.probe_in_flight = False
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "error_rate": round(self.error_rate, 3),
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in_s": round(max(0.0, self.open_until - now), 1) if self.state == OPEN else 0.0
+        }
+
+
+class ModelHealthTracker:
+    """
+    Circuit breaker per candidate model.
+
+    A breaker opens after `failure_threshold` consecutive failures, a rolling
+    error rate above `error_rate_threshold`, or any 429. While open, calls are
+    refused until the backoff (or the server's Retry-After, whichever is longer)
+    has passed; then a single half-open probe decides whether it closes again.
+    `ordered()` returns the models that may be called, healthiest first.
+    """
+
+    def __init__(self, candidates: List[str], failure_threshold: int = DEFAULT_BREAKER_FAILURES,
+                 error_rate_threshold: float = DEFAULT_BREAKER_ERROR_RATE, window: int = DEFAULT_BREAKER_WINDOW,
+                 backoff_seconds: float = DEFAULT_BREAKER_BACKOFF_SECONDS,
+                 max_backoff_seconds: float = DEFAULT_BREAKER_MAX_BACKOFF_SECONDS, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.window = window
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._models: Dict[str, ModelHealth] = {}
+        self._preference: List[str] = []
+        self.short_circuited = 0
+        for name in candidates:
+            self.add(name)
+
+    def add(self, name: str, preferred: bool = False) -> None:
+        """Track `name`; `preferred` moves it to the front of the tie-break order."""
+        with self._lock:
+            if name not in self._models:
+                self._models[name] = ModelHealth(name, self.window)
+            if name in self._preference:
+                self._preference.remove(name)
+            if preferred:
+                self._preference.insert(0, name)
+            else:
+                self._preference.append(name)
+
+    def _available(self, health: ModelHealth, now: float) -> bool:
+        if health.state == CLOSED:
+            return True
+        if health.state == OPEN and now >= health.open_until:
+            health.state = HALF_OPEN
+            health.probe_in_flight = False
+        # Half-open: let exactly one probe through
+        return health.state == HALF_OPEN and not health.probe_in_flight
+
+    def ordered(self) -> List[str]:
+        """Callable models, healthiest first: low error rate, then low EWMA latency, then preference."""
+        now = self._clock()
+        with self._lock:
+            available = [self._models[n] for n in self._preference if self._available(self._models[n], now)]
+
+            def key(health):
+                latency = health.ewma_latency if health.ewma_latency is not None else float("inf")
+                return (round(health.error_rate, 1), latency, self._preference.index(health.name))
+
+            return [h.name for h in sorted(available, key=key)]
+
+    def acquire(self, exclude=()) -> Optional[str]:
+        """
+        Pick the model to call for this request, or None when every breaker is open.
+        `exclude` skips models already in use (e.g. the primary when hedging).
+        """
+        for name in self.ordered():
+            if name in exclude:
+                continue
+            with self._lock:
+                health = self._models[name]
+                if health.state == HALF_OPEN:
+                    if health.probe_in_flight:
+                        continue
+                    health.probe_in_flight = True
+                return name
+        if not exclude:
+            with self._lock:
+                self.short_circuited += 1
+        return None
+
+    def record_success(self, name: str, latency: float) -> None:
+        with self._lock:
+            health = self._models[name]
+            health.outcomes.append(True)
+            health.ewma_latency = latency if health.ewma_latency is None \
+                else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * health.ewma_latency
+            health.consecutive_failures = 0
+            if health.state != CLOSED:
+                health.state = CLOSED
+                health.times_opened = 0
+                # Fresh window so the old failures do not re-open it immediately
+                health.outcomes.clear()
+                health.outcomes.append(True)
+            health.probe_in_flight = False
+
+    def release(self, name: str) -> None:
+        """Give back a half-open probe slot taken by `acquire` for a call that never ran."""
+        with self._lock:
+            self._models[name].probe_in_flight = False
+
+    def record_failure(self, name: str, latency: float, error: BaseException = None) -> None:
+        with self._lock:
+            health = self._models[name]
+            health.outcomes.append(False)
+            # Timeouts count towards latency too, so slow models sink in the ordering
+            health.ewma_latency = latency if health.ewma_latency is None \
+                else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * health.ewma_latency
+            health.consecutive_failures += 1
+            health.probe_in_flight = False
+
+            rate_limited = error is not None and is_rate_limited(error)
+            should_open = (
+                health.state == HALF_OPEN
+                or rate_limited
+                or health.consecutive_failures >= self.failure_threshold
+                or (len(health.outcomes) >= min(self.window, 2 * self.failure_threshold)
+                    and health.error_rate > self.error_rate_threshold)
+            )
+            if should_open:
+                self._open(health, retry_after_seconds(error) if error is not None else None)
+
+    def _open(self, health: ModelHealth, retry_after: Optional[float]) -> None:
+        health.times_opened += 1
+        backoff = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (health.times_opened - 1))
+        # Jitter spreads the half-open probes of many workers apart
+        delay = backoff * random.uniform(0.5, 1.5)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        health.state = OPEN
+        health.open_until = self._clock() + delay
+
+    def state(self, name: str) -> str:
+        with self._lock:
+            return self._models[name].state
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        with self._lock:
+            return {
+                "short_circuited": self.short_circuited,
+                "models": {name: self._models[name].snapshot(now) for name in self._preference}
+            }
@@ -0,0 +1,341 @@
+"""LLM provider backends for the chat agent: Gemini, OpenAI-compatible servers and an in-process stub"""
+
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+# Prioritized list of Gemini models probed at startup
+MODEL_CANDIDATES = [
+    'gemini-2.0-flash',
+    'gemini-2.5-flash',
+    'gemini-1.5-flash',
+    'gemini-pro'
+]
+
+# Task tools declared to providers with native function calling (JSON-schema parameters)
+TOOL_DECLARATIONS = [
+    {
+        "name": "add_task",
+        "description": "Add a new task for the user.",
+        "parameters": {
+            "type": "object",
+            "properties": {"title": {"type": "string", "description": "Title of the new task"}},
+            "required": ["title"]
+        }
+    },
+    {
+        "name": "delete_task",
+        "description": "Delete one of the user's tasks.",
+        "parameters": {
+            "type": "object",
+            "properties": {"task_id": {"type": "string", "description": "Short task ID from the context (t1, t2, ...), or the exact task title"}},
+            "required": ["task_id"]
+        }
+    },
+    {
+        "name": "complete_task",
+        "description": "Mark one of the user's tasks as completed.",
+        "parameters": {
+            "type": "object",
+            "properties": {"task_id": {"type": "string", "description": "Short task ID from the context (t1, t2, ...), or the exact task title"}},
+            "required": ["task_id"]
+        }
+    },
+    {
+        "name": "update_task",
+        "description": "Rename one of the user's tasks.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "task_id": {"type": "string", "description": "Short task ID from the context (t1, t2, ...), or the exact current title"},
+                "title": {"type": "string", "description": "The new title"}
+            },
+            "required": ["task_id", "title"]
+        }
+    },
+    {
+        "name": "list_tasks",
+        "description": "Signal that the user asked to see their tasks (list them in the reply text as well).",
+        "parameters": {
+            "type": "object",
+            "properties": {"status": {"type": "string", "enum": ["all", "pending", "completed"]}}
+        }
+    }
+]
+
+# Defaults for the OpenAI-compatible backend (llama.cpp server, vLLM, Ollama, LM Studio, ...)
+DEFAULT_LOCAL_BASE_URL = "http://localhost:8080/v1"
+DEFAULT_LOCAL_MODELS = "local-model"
+
+
+class Usage:
+    """Token usage in the shape of Gemini's usage_metadata."""
+    def __init__(self, prompt_token_count: Optional[int], candidates_token_count: Optional[int]):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class TextResponse:
+    """
+    Minimal response/chunk object with the attributes TodoAgent reads (text,
+    usage_metadata, and tool_calls when the backend returned native function calls).
+    """
+    def __init__(self, text: str, usage_metadata: Usage = None, tool_calls: List[Dict[str, Any]] = None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+        self.tool_calls = tool_calls
+
+
+def response_text(response) -> str:
+    """Text of a response or chunk. Gemini raises on `.text` when the reply holds only function calls."""
+    try:
+        return response.text or ""
+    except (ValueError, AttributeError):
+        parts = []
+        for candidate in getattr(response, "candidates", None) or []:
+            for part in getattr(getattr(candidate, "content", None), "parts", None) or []:
+                parts.append(getattr(part, "text", "") or "")
+        return "".join(parts)
+
+
+def function_calls(response) -> List[Dict[str, Any]]:
+    """
+    Native function calls in a response or chunk as [{"name", "arguments"}].
+    Arguments that could not be decoded are None.
+    """
+    calls = getattr(response, "tool_calls", None)
+    if isinstance(calls, list):
+        return list(calls)
+    found = []
+    for candidate in getattr(response, "candidates", None) or []:
+        for part in getattr(getattr(candidate, "content", None), "parts", None) or []:
+            call = getattr(part, "function_call", None)
+            if call and call.name:
+                found.append({"name": call.name, "arguments": dict(call.args.items()) if call.args else {}})
+    return found
+
+
+def _decode_arguments(arguments: str) -> Optional[Dict[str, Any]]:
+    try:
+        decoded = json.loads(arguments or "{}")
+    except ValueError:
+        return None
+    return decoded if isinstance(decoded, dict) else None
+
+
+class LLMProvider:
+    """
+    A source of model handles. A handle exposes
+    `generate_content(prompt, stream=False, request_options=None)` returning an
+    object with `.text` (or an iterator of such chunks when streaming), which
+    is the interface of google.generativeai.GenerativeModel that TodoAgent uses.
+    """
+    name = "base"
+
+    def __init__(self, candidates: List[str]):
+        self.candidates = list(candidates)
+
+    def get_model(self, model_name: str):
+        raise NotImplementedError
+
+    def probe(self, model) -> None:
+        """Raise if the model cannot serve requests."""
+        raise NotImplementedError
+
+    def declare_tools(self, declarations: List[Dict[str, Any]]):
+        """
+        `declarations` in the form this backend's `generate_content(tools=...)`
+        expects, or None if it has no native function calling.
+        """
+        return None
+
+    def resolve(self, models_to_try: List[str] = None):
+        """Return (model, model_name) for the first candidate that passes `probe`."""
+        candidates = models_to_try or self.candidates
+        for model_name in candidates:
+            try:
+                model = self.get_model(model_name)
+                self.probe(model)
+                return model, model_name
+            except Exception:
+                continue
+        # Fall back to the first candidate if all fail
+        return self.get_model(candidates[0]), candidates[0]
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, api_key: str = None, candidates: List[str] = None):
+        super().__init__(candidates or MODEL_CANDIDATES)
+        # Imported here so other backends do not need the Gemini SDK
+        from google.generativeai import configure, GenerativeModel
+        self._model_class = GenerativeModel
+        configure(api_key=api_key or os.getenv("GEMINI_API_KEY"))
+
+    def get_model(self, model_name: str):
+        # Constructing a GenerativeModel makes no network call
+        return self._model_class(model_name)
+
+    def probe(self, model) -> None:
+        # Lightweight call
+        model.count_tokens("test")
+
+    def declare_tools(self, declarations: List[Dict[str, Any]]):
+        return [{"function_declarations": declarations}]
+
+
+class OpenAICompatibleModel:
+    """Chat-completions model behind the GenerativeModel-style interface."""
+
+    def __init__(self, client, model_name: str):
+        self.client = client
+        self.model_name = model_name
+
+    def generate_content(self, prompt: str, stream: bool = False, request_options: Dict[str, Any] = None,
+                         tools: List[Dict[str, Any]] = None, **kwargs):
+        timeout = (request_options or {}).get("timeout")
+        extra = {"tools": tools} if tools else {}
+        response = self.client.chat.completions.create(
+            model=self.model_name,
+            messages=[{"role": "user", "content": prompt}],
+            stream=stream,
+            timeout=timeout,
+            **extra
+        )
+        if stream:
+            return self._chunks(response)
+        usage = getattr(response, "usage", None)
+        message = response.choices[0].message
+        calls = [{"name": c.function.name, "arguments": _decode_arguments(c.function.arguments)}
+                 for c in getattr(message, "tool_calls", None) or []]
+        return TextResponse(
+            message.content or "",
+            Usage(getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)),
+            calls if tools else None
+        )
+
+    @staticmethod
+    def _chunks(response) -> Iterator[TextResponse]:
+        # Tool call names and arguments arrive in pieces keyed by index
+        pending: Dict[int, Dict[str, str]] = {}
+        for chunk in response:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            for call in getattr(delta, "tool_calls", None) or []:
+                entry = pending.setdefault(call.index, {"name": "", "arguments": ""})
+                entry["name"] += getattr(call.function, "name", None) or ""
+                entry["arguments"] += getattr(call.function, "arguments", None) or ""
+            if delta.content:
+                yield TextResponse(delta.content)
+        if pending:
+            yield TextResponse("", tool_calls=[
+                {"name": entry["name"], "arguments": _decode_arguments(entry["arguments"])}
+                for _, entry in sorted(pending.items())
+            ])
+
+    def count_tokens(self, text):
+        return len(str(text).split())
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Any server speaking the OpenAI chat-completions API, e.g. a local CPU inference server."""
+    name = "openai"
+
+    def __init__(self, base_url: str = None, api_key: str = None, candidates: List[str] = None, client=None):
+        models = candidates or [m.strip() for m in os.getenv("LLM_MODELS", DEFAULT_LOCAL_MODELS).split(",") if m.strip()]
+        super().__init__(models)
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(
+                base_url=base_url or os.getenv("LLM_BASE_URL", DEFAULT_LOCAL_BASE_URL),
+                # Local servers usually ignore the key, but the client requires one
+                api_key=api_key or os.getenv("LLM_API_KEY", "not-needed"),
+                # Retries are the circuit breaker's and hedger's job
+                max_retries=0
+            )
+        self.client = client
+
+    def get_model(self, model_name: str):
+        return OpenAICompatibleModel(self.client, model_name)
+
+    def probe(self, model) -> None:
+        available = {m.id for m in self.client.models.list()}
+        if available and model.model_name not in available:
+            raise ValueError(f"Model {model.model_name} is not served by {self.client.base_url}")
+
+    def declare_tools(self, declarations: List[Dict[str, Any]]):
+        return [{"type": "function", "function": declaration} for declaration in declarations]
+
+
+class StubLLM:
+    """
+    Deterministic in-process model: answers every prompt with the same small
+    JSON reply after an optional fixed delay. For offline benchmarks of the
+    chat path and for local development without an API key.
+    """
+
+    def __init__(self, reply: Dict[str, Any] = None, delay: float = 0.0):
+        self.parsed = reply or {"response": "Theek hai 🙂", "tool_calls": [], "chat_title": "Quick Chat"}
+        self.reply = json.dumps(self.parsed, ensure_ascii=False)
+        self.delay = delay
+
+    def generate_content(self, prompt: str, stream: bool = False, tools: List[Dict[str, Any]] = None, **kwargs):
+        if self.delay:
+            time.sleep(self.delay)
+        # With declared tools, answer like a function-calling model: plain text plus structured calls
+        text = self.parsed.get("response", "") if tools else self.reply
+        calls = list(self.parsed.get("tool_calls", [])) if tools else None
+        if stream:
+            chunks = [TextResponse(text[i:i + 8]) for i in range(0, len(text), 8)]
+            if calls:
+                chunks.append(TextResponse("", tool_calls=calls))
+            return iter(chunks)
+        return TextResponse(text, tool_calls=calls)
+
+    def count_tokens(self, text):
+        return len(str(text).split())
+
+
+class StubProvider(LLMProvider):
+    name = "stub"
+
+    def __init__(self, delay: float = None):
+        super().__init__(["stub"])
+        self.delay = delay if delay is not None else float(os.getenv("LLM_STUB_DELAY_MS", "0")) / 1000
+
+    def get_model(self, model_name: str):
+        return StubLLM(delay=self.delay)
+
+    def probe(self, model) -> None:
+        pass
+
+    def declare_tools(self, declarations: List[Dict[str, Any]]):
+        return declarations
+
+
+PROVIDERS = {
+    "gemini": GeminiProvider,
+    "openai": OpenAICompatibleProvider,
+    "stub": StubProvider
+}
+
+_default_provider: Optional[LLMProvider] = None
+
+
+def create_provider(name: str = None) -> LLMProvider:
+    """Build the provider named by `name` or the LLM_PROVIDER env var (default: gemini)."""
+    name = (name or os.getenv("LLM_PROVIDER", "gemini")).lower()
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM_PROVIDER '{name}'. Expected one of: {', '.join(PROVIDERS)}")
+    return PROVIDERS[name]()
+
+
+def get_provider() -> LLMProvider:
+    """Process-wide provider selected by configuration."""
+    global _default_provider
+    if _default_provider is None:
+        _default_provider = create_provider()
+    return _default_provider
@@ -0,0 +1,98 @@
+"""Process-wide registry for the chat agent and its Gemini model"""
+
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from .todo_agent import TodoAgent, resolve_working_model
+from .llm_executor import LLMExecutor
+from .providers import get_provider
+
+logger = logging.getLogger(__name__)
+
+# How often the background task re-probes the candidate models (seconds)
+DEFAULT_REPROBE_INTERVAL = int(os.getenv("AGENT_MODEL_REPROBE_SECONDS", "300"))
+
+
+class AgentRegistry:
+    """
+    Holds a single TodoAgent bound to the application's shared engine.
+
+    The working model is resolved once at startup and re-probed periodically
+    in the background, so chat requests never pay for model selection or
+    engine/table setup.
+    """
+
+    def __init__(self, reprobe_interval: int = DEFAULT_REPROBE_INTERVAL, provider=None):
+        self.reprobe_interval = reprobe_interval
+        self._provider = provider
+        self._agent: Optional[TodoAgent] = None
+        self._engine = None
+        self._reprobe_task: Optional[asyncio.Task] = None
+        self.llm_executor = LLMExecutor()
+
+    @property
+    def provider(self):
+        """LLM backend selected by LLM_PROVIDER (gemini, openai or stub)."""
+        if self._provider is None:
+            self._provider = get_provider()
+        return self._provider
+
+    async def start(self, engine) -> None:
+        """Resolve the model and build the shared agent (called from the app lifespan)."""
+        self._engine = engine
+        provider = self.provider
+        model, model_name = await asyncio.to_thread(resolve_working_model, provider.candidates, provider)
+        self._agent = TodoAgent(engine=engine, model=model, model_name=model_name,
+                                llm_executor=self.llm_executor, candidates=provider.candidates, provider=provider)
+        logger.info(f"AGENT_REGISTRY - Using {provider.name} model {model_name}")
+
+        if self.reprobe_interval > 0:
+            self._reprobe_task = asyncio.create_task(self._reprobe_loop())
+
+    async def stop(self) -> None:
+        """Cancel the background re-probe task and release the LLM worker threads."""
+        if self._reprobe_task:
+            self._reprobe_task.cancel()
+            try:
+                await self._reprobe_task
+            except asyncio.CancelledError:
+                pass
+            self._reprobe_task = None
+        if self._agent is not None:
+            self._agent.hedger.shutdown()
+        self.llm_executor.shutdown()
+
+    async def _reprobe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.reprobe_interval)
+            try:
+                await self.reprobe()
+            except Exception as e:
+                logger.error(f"AGENT_REGISTRY - Re-probe failed: {e}")
+
+    async def reprobe(self) -> str:
+        """Re-resolve the working model and swap it into the shared agent if it changed."""
+        model, model_name = await asyncio.to_thread(resolve_working_model, self.provider.candidates, self.provider)
+        agent = self._agent
+        if agent is not None and model_name != agent.model_name:
+            logger.info(f"AGENT_REGISTRY - Switching model {agent.model_name} -> {model_name}")
+            agent.set_model(model, model_name)
+        return model_name
+
+    def get_agent(self) -> TodoAgent:
+        """Return the shared agent, building it lazily if the lifespan did not run."""
+        if self._agent is None:
+            from ..database.session import engine
+            self._engine = self._engine or engine
+            self._agent = TodoAgent(engine=self._engine, llm_executor=self.llm_executor, provider=self.provider)
+        return self._agent
+
+
+registry = AgentRegistry()
+
+
+def get_agent() -> TodoAgent:
+    """FastAPI dependency returning the shared TodoAgent."""
+    return registry.get_agent()
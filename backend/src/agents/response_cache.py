@@ -0,0 +1,79 @@
+"""Bounded LRU/TTL cache for agent replies"""
+
+import copy
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+DEFAULT_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "300"))
+
+# Tool calls that only read the task list; replies using anything else are never cached
+READ_ONLY_TOOLS = {"list_tasks"}
+
+CacheKey = Tuple[str, str, int]
+
+
+class ResponseCache:
+    """
+    Caches process_message results keyed by (user id, normalized message,
+    task-set version). Any task mutation bumps the version, so a hit is only
+    possible while the user's task list is unchanged.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_MAX_ENTRIES, ttl_seconds: float = DEFAULT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        """Lowercase, collapse whitespace and drop punctuation that does not change intent."""
+        text = re.sub(r'[?!.,]+', ' ', message.lower())
+        return " ".join(text.split())
+
+    def make_key(self, user_id: str, message: str, version: int) -> CacheKey:
+        return (user_id, self.normalize(message), version)
+
+    @staticmethod
+    def is_cacheable(result: Dict[str, Any]) -> bool:
+        """Only replies whose tool calls are all read-only may be replayed."""
+        return all(call.get("name") in READ_ONLY_TOOLS for call in result.get("tool_calls", []))
+
+    def get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] >= self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, key: CacheKey, result: Dict[str, Any]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), copy.deepcopy(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size": len(self._entries),
+            "max_entries": self.max_entries
+        }
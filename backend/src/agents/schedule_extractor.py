@@ -0,0 +1,331 @@
+"""Local due-date and priority extraction for chat-created tasks (English and Roman Urdu)"""
+
+import calendar
+import os
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# IANA zone relative dates ("kal", "tomorrow") are read in; empty means the server's local time
+DEFAULT_SCHEDULE_TIMEZONE = os.getenv("SCHEDULE_TIMEZONE", "")
+
+# Task.priority values used by the frontend
+PRIORITIES = ("high", "medium", "low")
+# A date without a time is due by the end of that day
+END_OF_DAY = time(23, 59)
+
+_MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+_MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+_MONTHS["sept"] = 9
+_MONTH = r'(?P<month>' + '|'.join(sorted(_MONTHS, key=len, reverse=True)) + r')\.?'
+# Month names that are also ordinary words ("read may 5 chapters"): before the day they need
+# an ordinal or a year ("may 5th", "may 5, 2027")
+_WORD_MONTHS = {"may"}
+
+_WEEKDAYS = {
+    "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3, "friday": 4, "saturday": 5, "sunday": 6,
+    "somwar": 0, "peer": 0, "pir": 0, "mangal": 1, "budh": 2, "jumeraat": 3, "jumerat": 3,
+    "juma": 4, "jumma": 4, "jummah": 4, "sanichar": 5, "itwar": 6, "itwaar": 6,
+}
+_RELATIVE_DAYS = {
+    "today": 0, "tonight": 0, "aaj": 0, "tomorrow": 1, "tmrw": 1, "kal": 1,
+    "day after tomorrow": 2, "parson": 2, "parso": 2, "parsoon": 2,
+}
+# Part of the day -> (default hour, whether 1-11 o'clock means p.m.)
+_DAYPARTS = {
+    "morning": (9, False), "subah": (9, False), "subha": (9, False), "subh": (9, False),
+    "afternoon": (14, True), "dopahar": (13, True), "dopehar": (13, True), "dopaher": (13, True),
+    "evening": (18, True), "sham": (18, True), "shaam": (18, True),
+    "night": (21, True), "tonight": (21, True), "raat": (21, True),
+}
+_NUMBER_WORDS = {"a": 1, "an": 1, "one": 1, "ek": 1, "two": 2, "do": 2, "three": 3, "teen": 3}
+# "sawa 9" = 9:15, "saade 9" = 9:30, "paune 9" = 8:45
+_CLOCK_WORDS = {"sawa": 15, "saade": 30, "sarhe": 30, "sadhe": 30, "paune": -15, "pone": -15}
+
+# Words tying a date to the title ("by friday", "kal tak", "juma ko") are removed with it
+_BEFORE = r'(?:(?:by|on|at|before|until|till|due(?:\s+(?:on|by))?)\s+)?'
+_AFTER = r'(?:\s+(?:ko|tak|se\s+pehle|pe|par|mein|main))?'
+
+
+def _part(core: str) -> "re.Pattern":
+    return re.compile(rf'\b{_BEFORE}(?:{core}){_AFTER}\b', re.IGNORECASE)
+
+
+# (kind, pattern); every match is removed from the title and read by _read_<kind>
+_DATE_RULES: List[Tuple[str, "re.Pattern"]] = [
+    ("iso", _part(r'(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})')),
+    ("day_month", _part(r'(?P<day>\d{1,2})/(?P<month>\d{1,2})(?:/(?P<year>\d{2}|\d{4}))?')),
+    ("month_name", _part(rf'(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?{_MONTH}(?:,?\s+(?P<year>\d{{4}}))?')),
+    ("month_day", _part(rf'{_MONTH}\s+(?P<day>\d{{1,2}})(?P<ordinal>st|nd|rd|th)?(?:,?\s+(?P<year>\d{{4}}))?')),
+    ("in_days", _part(r'in\s+(?P<n>\d+|a|an|one|two|three)\s+(?P<unit>days?|weeks?)')),
+    ("in_days", _part(r'(?P<n>\d+|ek|do|teen)\s+(?P<unit>din|dino|dinon|hafte|haftay)\s+(?:mein|main|baad|bad)')),
+    ("week", _part(r'(?P<which>next|agle|aglay|agla)\s+(?P<unit>week|hafte|haftay|hafta|month|mahine|mahinay)')),
+    ("weekend", _part(r'(?:this\s+)?weekend')),
+    ("weekday", _part(r'(?:(?P<which>next|this|coming|agle|aglay|agla|is)\s+)?(?P<name>'
+                      + '|'.join(n for n in _WEEKDAYS if n not in ("peer", "pir")) + r'|peer(?=\s+ko)|pir(?=\s+ko))')),
+    ("relative", _part(r'(?P<name>day\s+after\s+tomorrow|today|tonight|tomorrow|tmrw|aaj|kal|parsoon|parson|parso)')),
+]
+# "in 2 hours", "30 minute baad": a moment counted from now, which needs no date or time words
+_FROM_NOW = [
+    _part(r'in\s+(?P<n>\d+|a|an|one|two|three)\s+(?P<unit>hours?|hrs?|minutes?|mins?)'),
+    _part(r'(?P<n>\d+|ek|do|teen)\s+(?P<unit>ghante|ghanta|ghanton|minute|minat|mint)\s+(?:mein|main|baad|bad)'),
+]
+_TIME_RULES: List[Tuple[str, "re.Pattern"]] = [
+    ("clock", _part(r'(?:(?P<daypart>' + '|'.join(_DAYPARTS) + r')\s+)?(?:(?P<word>sawa|saade|sarhe|sadhe|paune|pone)\s+)?'
+                    r'(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?:baje|bje|bajay|bajey)')),
+    ("clock", _part(r'(?:(?P<daypart>' + '|'.join(_DAYPARTS) + r')\s+)?(?P<word>dedh|dhai)\s+(?:baje|bje|bajay|bajey)')),
+    ("clock", _part(r'(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?P<ampm>a\.?m\.?|p\.?m\.?)')),
+    ("clock", _part(r'(?P<hour>[01]?\d|2[0-3]):(?P<minute>\d{2})')),
+    ("clock", re.compile(r'\b(?:at|@)\s+(?P<hour>\d{1,2})(?![\d/:-])\b', re.IGNORECASE)),
+    ("noon", _part(r'(?P<name>noon|midday|midnight)')),
+    ("daypart", _part(r'(?:in\s+the\s+)?(?P<daypart>' + '|'.join(_DAYPARTS) + r')')),
+]
+# Multi-word priority phrases count anywhere; single keywords only at the start or end of the title
+_PRIORITY_PHRASES = [
+    ("low", re.compile(r'[\s,(-]*\b(?:low\s+priority|priority\s*:?\s*low|not\s+urgent|kam\s+zaroori|kam\s+zaruri|'
+                       r'koi\s+jaldi\s+nahi|jab\s+waqt\s+mile|fursat\s+mein)\b\)?', re.IGNORECASE)),
+    ("medium", re.compile(r'[\s,(-]*\b(?:medium\s+priority|normal\s+priority|priority\s*:?\s*(?:medium|normal))\b\)?',
+                          re.IGNORECASE)),
+    ("high", re.compile(r'[\s,(-]*\b(?:high\s+priority|top\s+priority|priority\s*:?\s*high|bohat\s+zaroori|'
+                        r'bohot\s+zaroori)\b\)?', re.IGNORECASE)),
+]
+_PRIORITY_WORD = r'(?:urgent(?:ly)?|asap|important|zaroori|zaruri|foran|fauran|jaldi)'
+_PRIORITY_EDGES = [
+    re.compile(rf'^\W*{_PRIORITY_WORD}\b[\s,:!-]*', re.IGNORECASE),
+    re.compile(rf'[\s,(-]*\b{_PRIORITY_WORD}\W*$', re.IGNORECASE),
+]
+
+
+@dataclass(frozen=True)
+class Schedule:
+    """What extract_schedule found: the title without the date/priority words, and the values read from them."""
+    title: str
+    due_date: Optional[datetime] = None
+    priority: Optional[str] = None
+
+
+def local_now() -> datetime:
+    """Current wall-clock time in SCHEDULE_TIMEZONE (naive, like Task.due_date)."""
+    if DEFAULT_SCHEDULE_TIMEZONE:
+        try:
+            return datetime.now(ZoneInfo(DEFAULT_SCHEDULE_TIMEZONE)).replace(tzinfo=None)
+        except ZoneInfoNotFoundError:
+            pass
+    return datetime.now()
+
+
+def extract_schedule(text: str, now: datetime = None) -> Schedule:
+    """
+    Read a due date/time and a priority out of a task title or message:
+    "call mom kal subah 9 baje" -> ("call mom", tomorrow 09:00),
+    "submit report by friday urgent" -> ("submit report", Friday 23:59, "high").
+    Dates without a year that already passed mean next year; a time alone
+    that already passed today means tomorrow. If nothing but date and
+    priority words would be left, the text is returned unchanged.
+    """
+    now = now or local_now()
+    rest = text
+    day, when, daypart = None, None, None
+
+    for pattern in _FROM_NOW:
+        match = pattern.search(rest)
+        if match:
+            n = match.group("n").lower()
+            n = int(n) if n.isdigit() else _NUMBER_WORDS[n]
+            hours = match.group("unit").lower().startswith(("h", "ghant"))
+            moment = (now + timedelta(hours=n) if hours else now + timedelta(minutes=n)).replace(second=0, microsecond=0)
+            day, when, rest = moment.date(), moment.time(), _cut(rest, match)
+            break
+
+    for kind, pattern in _DATE_RULES if day is None else ():
+        match = pattern.search(rest)
+        if match is None:
+            continue
+        found = _read_date(kind, match, now)
+        if found is None:
+            continue
+        day, daypart = found
+        rest = _cut(rest, match)
+        break
+
+    for kind, pattern in _TIME_RULES if when is None else ():
+        match = pattern.search(rest)
+        if match is None:
+            continue
+        found = _read_time(kind, match, daypart)
+        if found is None:
+            continue
+        when, daypart = found
+        rest = _cut(rest, match)
+        break
+
+    priority = None
+    for value, pattern in _PRIORITY_PHRASES:
+        match = pattern.search(rest)
+        if match:
+            priority, rest = value, _cut(rest, match)
+            break
+    if priority is None:
+        for pattern in _PRIORITY_EDGES:
+            match = pattern.search(rest)
+            if match:
+                priority, rest = "high", _cut(rest, match)
+                break
+
+    if when is None and daypart is not None:
+        when = time(_DAYPARTS[daypart][0])
+    due_date = None
+    if day is not None or when is not None:
+        if day is None:
+            day = now.date() if when > now.time() else now.date() + timedelta(days=1)
+        due_date = datetime.combine(day, when if when is not None else END_OF_DAY)
+
+    title = _tidy(rest)
+    if not title:
+        return Schedule(text)
+    return Schedule(title, due_date, priority)
+
+
+def _cut(text: str, match: "re.Match") -> str:
+    return f"{text[:match.start()]} {text[match.end():]}"
+
+
+def _tidy(text: str) -> str:
+    return " ".join(text.split()).strip(" ,.;:-–()")
+
+
+def _year_for(month: int, day: int, year: Optional[str], today: date) -> Optional[date]:
+    try:
+        if year:
+            return date(int(year) + (2000 if len(year) == 2 else 0), month, day)
+        candidate = date(today.year, month, day)
+        return candidate if candidate >= today else date(today.year + 1, month, day)
+    except ValueError:
+        return None
+
+
+def _read_date(kind: str, match: "re.Match", now: datetime) -> Optional[Tuple[date, Optional[str]]]:
+    """(day, daypart implied by the words or None); None when the match is not a valid date."""
+    today = now.date()
+    groups = match.groupdict()
+    if kind == "iso":
+        try:
+            return date(int(groups["year"]), int(groups["month"]), int(groups["day"])), None
+        except ValueError:
+            return None
+    if kind == "month_day" and groups["month"].lower() in _WORD_MONTHS and not (groups["ordinal"] or groups["year"]):
+        return None
+    if kind in ("day_month", "month_name", "month_day"):
+        month = groups["month"].lower().rstrip(".")
+        month = int(month) if month.isdigit() else _MONTHS[month]
+        day = _year_for(month, int(groups["day"]), groups["year"], today) if 1 <= month <= 12 else None
+        return (day, None) if day else None
+    if kind == "in_days":
+        n = groups["n"].lower()
+        n = int(n) if n.isdigit() else _NUMBER_WORDS[n]
+        unit = groups["unit"].lower()
+        days = n * 7 if unit.startswith(("week", "haft")) else n
+        return today + timedelta(days=days), None
+    if kind == "week":
+        if groups["unit"].lower().startswith(("month", "mahin")):
+            first = today.replace(day=1) + timedelta(days=32)
+            return first.replace(day=1), None
+        # Next week starts on Monday
+        return today + timedelta(days=7 - today.weekday()), None
+    if kind == "weekend":
+        return today + timedelta(days=(5 - today.weekday()) % 7), None
+    if kind == "weekday":
+        ahead = (_WEEKDAYS[groups["name"].lower()] - today.weekday()) % 7
+        if ahead == 0 and (groups["which"] or "").lower() in ("next", "agle", "aglay", "agla"):
+            ahead = 7
+        return today + timedelta(days=ahead), None
+    name = " ".join(groups["name"].lower().split())
+    return today + timedelta(days=_RELATIVE_DAYS[name]), ("tonight" if name == "tonight" else None)
+
+
+def _read_time(kind: str, match: "re.Match", daypart: Optional[str]) -> Optional[Tuple[time, Optional[str]]]:
+    """(time of day, daypart); None when the match is not a valid time."""
+    groups = match.groupdict()
+    daypart = (groups.get("daypart") or daypart or "").lower() or None
+    if kind == "daypart":
+        return time(_DAYPARTS[daypart][0]), daypart
+    if kind == "noon":
+        return (time(0) if groups["name"].lower() == "midnight" else time(12)), daypart
+
+    word = (groups.get("word") or "").lower()
+    if word in ("dedh", "dhai"):
+        hour, minute = (1, 30) if word == "dedh" else (2, 30)
+    else:
+        hour, minute = int(groups["hour"]), int(groups.get("minute") or 0)
+        if word in _CLOCK_WORDS:
+            offset = _CLOCK_WORDS[word]
+            hour, minute = (hour - 1, 60 + offset) if offset < 0 else (hour, offset)
+    ampm = (groups.get("ampm") or "").lower().replace(".", "")
+    if ampm:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if ampm == "pm" else 0)
+    elif daypart is not None and 1 <= hour < 12:
+        pm = _DAYPARTS[daypart][1]
+        if daypart in ("raat", "night", "tonight") and hour <= 4:
+            pm = False
+        elif daypart in ("dopahar", "dopehar", "dopaher") and hour == 11:
+            pm = False
+        hour += 12 if pm else 0
+    elif daypart in ("raat", "night", "tonight") and hour == 12:
+        hour = 0
+    elif ":" not in match.group(0) and 1 <= hour <= 6:
+        # "at 5", "5 baje": nobody means five in the morning
+        hour += 12
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        return None
+    return time(hour, minute), daypart
+
+
+def apply_schedule(calls: List[Dict[str, Any]], message: str = None,
+                   now: datetime = None) -> List[Dict[str, Any]]:
+    """
+    Fill in "due_date" (ISO string) and "priority" on add_task/update_task
+    calls that do not carry them, removing the date and priority words from
+    the call's title. An add_task call whose title has none of them takes
+    them from the user's `message` instead (the model often drops "kal" from
+    the titles it writes; "add milk and eggs kal" dates both). An update
+    keeps its due date unless its own title names one: the message may date
+    something else. Calls are updated in place, and applying again changes
+    nothing.
+    """
+    now = now or local_now()
+    from_message = None
+    for call in calls:
+        if not (isinstance(call, dict) and call.get("name") in ("add_task", "update_task")
+                and isinstance(call.get("arguments"), dict)):
+            continue
+        arguments = call["arguments"]
+        key = "new_title" if call["name"] == "update_task" and arguments.get("new_title") else "title"
+        title = arguments.get(key)
+        schedule = extract_schedule(title, now) if isinstance(title, str) and title else None
+        if schedule is not None and schedule.title != title:
+            arguments[key] = schedule.title
+        elif message and call["name"] == "add_task":
+            from_message = from_message or extract_schedule(message, now)
+            schedule = from_message
+        if schedule is None:
+            continue
+        if schedule.due_date is not None and not arguments.get("due_date"):
+            arguments["due_date"] = schedule.due_date.isoformat()
+        if schedule.priority is not None and not arguments.get("priority"):
+            arguments["priority"] = schedule.priority
+    return calls
+
+
+def describe(arguments: Dict[str, Any]) -> str:
+    """Short suffix for a reply naming the due date and priority of a call: " (18 Oct 09:00, high priority)"."""
+    parts = []
+    if arguments.get("due_date"):
+        due = datetime.fromisoformat(arguments["due_date"])
+        parts.append(due.strftime("%d %b") if due.time() == END_OF_DAY else due.strftime("%d %b %H:%M"))
+    if arguments.get("priority"):
+        parts.append(f"{arguments['priority']} priority")
+    return f" ({', '.join(parts)})" if parts else ""
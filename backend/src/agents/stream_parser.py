@@ -0,0 +1,194 @@
+"""Incremental parsing of streamed model output"""
+
+import json
+import re
+
+_RESPONSE_KEY = re.compile(r'"response"\s*:\s*"')
+
+_SIMPLE_ESCAPES = {
+    '"': '"', '\\': '\\', '/': '/',
+    'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'
+}
+
+
+class ResponseTextExtractor:
+    """
+    Pulls the value of the top-level "response" string out of a JSON reply
+    while it is still being streamed, so its text can be forwarded to the
+    client before the rest of the object (tool calls, title) arrives.
+
+    Feed raw chunks in order; each call returns the newly decoded text.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._in_value = False
+        self.done = False
+        self.emitted = False
+
+    def feed(self, chunk: str) -> str:
+        if self.done or not chunk:
+            return ""
+        self._buffer += chunk
+
+        if not self._in_value:
+            match = _RESPONSE_KEY.search(self._buffer, self._pos)
+            if not match:
+                # Keep scanning from a point that can still hold a split key
+                self._pos = max(0, len(self._buffer) - 32)
+                return ""
+            self._in_value = True
+            self._pos = match.end()
+
+        out = []
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch == '\\':
+                if i + 1 >= len(buf):
+                    break  # escape split across chunks
+                esc = buf[i + 1]
+                if esc == 'u':
+                    if i + 6 > len(buf):
+                        break
+                    try:
+                        code = int(buf[i + 2:i + 6], 16)
+                    except ValueError:
+                        out.append(buf[i:i + 6])
+                        i += 6
+                        continue
+                    if 0xD800 <= code < 0xDC00:
+                        # High surrogate: wait for the low half (e.g. emoji)
+                        if i + 12 > len(buf):
+                            break
+                        low_hex = buf[i + 8:i + 12] if buf[i + 6:i + 8] == '\\u' else ""
+                        low = int(low_hex, 16) if re.fullmatch(r'[0-9a-fA-F]{4}', low_hex) else 0
+                        if 0xDC00 <= low < 0xE000:
+                            out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                            i += 12
+                            continue
+                    out.append('�' if 0xD800 <= code < 0xE000 else chr(code))
+                    i += 6
+                    continue
+                out.append(_SIMPLE_ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            out.append(ch)
+            i += 1
+        self._pos = i
+
+        text = "".join(out)
+        if text:
+            self.emitted = True
+        return text
+
+
+class JSONReplyParser:
+    """
+    Incremental scanner for the model's JSON reply. Skips anything before the
+    first top-level object (markdown fences, a leading sentence), tracks
+    strings and nesting so braces inside text do not confuse it, and returns
+    each element of the top-level "tool_calls" array as soon as its closing
+    brace arrives, while the rest of the reply is still being generated.
+
+    Feed raw chunks in order; each call returns the tool calls completed by
+    that chunk. Once the object is closed, `value` holds the decoded reply.
+    If a closed candidate does not decode, scanning resumes after its opening
+    brace; tool calls already returned from it are not taken back.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._reset()
+        self.tool_calls = []
+        self.value = None
+
+    def _reset(self):
+        self._start = None        # index of the top-level '{'
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None  # last string closed at depth 1 (a key, once ':' follows)
+        self._key = None
+        self._in_tools = False
+        self._element_start = None
+
+    @property
+    def done(self) -> bool:
+        return self.value is not None
+
+    def feed(self, chunk: str) -> list:
+        if self.done or not chunk:
+            return []
+        self._buffer += chunk
+        completed = []
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = buf[self._string_start + 1:i]
+            elif self._start is None:
+                if ch == '{':
+                    self._start, self._depth = i, 1
+            elif ch == '"':
+                self._in_string, self._string_start = True, i
+            elif ch == ':' and self._depth == 1:
+                self._key = self._last_string
+            elif ch in '{[':
+                if ch == '[' and self._depth == 1 and self._key == "tool_calls":
+                    self._in_tools = True
+                elif ch == '{' and self._depth == 2 and self._in_tools:
+                    self._element_start = i
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 2 and ch == '}' and self._element_start is not None:
+                    call = _loads(buf[self._element_start:i + 1])
+                    self._element_start = None
+                    if isinstance(call, dict):
+                        self.tool_calls.append(call)
+                        completed.append(call)
+                elif self._depth == 1 and ch == ']':
+                    self._in_tools = False
+                elif self._depth == 0:
+                    value = _loads(buf[self._start:i + 1])
+                    if isinstance(value, dict):
+                        self.value = value
+                        i += 1
+                        break
+                    # Not JSON after all: look for the next candidate object
+                    i = self._start
+                    self._reset()
+            i += 1
+        self._pos = i
+        return completed
+
+
+def _loads(text: str):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def parse_json_reply(text: str):
+    """The first JSON object in `text` (ignoring fences and surrounding prose), or None."""
+    parser = JSONReplyParser()
+    parser.feed(text or "")
+    return parser.value
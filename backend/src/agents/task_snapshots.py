@@ -0,0 +1,176 @@
+"""Per-conversation task snapshots: the task list on the first turn, a compact delta on later turns"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+
+from .context_builder import TaskContextBuilder, format_task_line, tokenize
+from .token_budget import estimate_tokens
+
+# Resync the task list once the delta is longer than this many lines...
+DEFAULT_TASK_DELTA_MAX_LINES = int(os.getenv("TASK_DELTA_MAX_LINES", "10"))
+# ...or costs more than this fraction of the list it replaces
+DEFAULT_TASK_DELTA_MAX_RATIO = float(os.getenv("TASK_DELTA_MAX_RATIO", "0.5"))
+# Conversations whose snapshot is remembered; the oldest is forgotten (and resynced) first
+DEFAULT_MAX_SNAPSHOTS = int(os.getenv("TASK_SNAPSHOT_MAX_CONVERSATIONS", "1024"))
+# Tasks relevant to a new message, listed on delta turns
+MAX_RELEVANT_LINES = 5
+# What a delta turn sends instead of the list
+REFERENCE = ("({count} tasks were listed earlier in this conversation and are not repeated; "
+             "see TASK CHANGES for what changed since and the tasks this message is about)")
+
+
+class TaskSnapshots:
+    """
+    Remembers, per conversation, the task list the model was shown (the
+    snapshot) and a fingerprint of the tasks it was diffed against. Later
+    turns of the conversation leave the list out: they send a one-line
+    reference to it and a few delta lines describing what changed since
+    ("completed: t2 Buy milk") and which tasks the new message is about.
+    Aliases stay the same for the whole snapshot; new tasks get the next
+    free alias. When the delta grows past `max_delta_lines` or
+    `max_delta_ratio` of the list, the list is rebuilt (a resync).
+
+    The fingerprint is taken from the tasks each turn reads from the
+    database, not from the process-local task-set version, so writes made
+    by another worker process are still diffed.
+    """
+
+    def __init__(self, max_delta_lines: int = DEFAULT_TASK_DELTA_MAX_LINES,
+                 max_delta_ratio: float = DEFAULT_TASK_DELTA_MAX_RATIO,
+                 max_conversations: int = DEFAULT_MAX_SNAPSHOTS):
+        self.max_delta_lines = max_delta_lines
+        self.max_delta_ratio = max_delta_ratio
+        self.max_conversations = max_conversations
+        self._snapshots: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.full_turns = 0
+        self.delta_turns = 0
+        self.resyncs = 0
+        self.saved_tokens = 0
+
+    def context(self, user_id: str, conversation_id: str, message: str, tasks: List[Dict[str, Any]],
+                build: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Task context for one turn of a conversation. `build()` returns a fresh
+        aliased TaskContextBuilder.build result and is only called when a new
+        snapshot is needed. Returns {"text", "delta", "aliases", "resync", "full"}:
+        on a full turn `text` is the snapshot list and `delta` is ""; on a delta
+        turn `text` is a reference to the list and `delta` the change and
+        relevance lines. `aliases` covers both.
+        """
+        key = (user_id, conversation_id)
+        with self._lock:
+            entry = self._snapshots.get(key)
+            resync = entry is not None
+            if entry is not None:
+                self._snapshots.move_to_end(key)
+                delta = self._delta(entry, message, tasks)
+                if not self._too_large(entry, delta):
+                    self.delta_turns += 1
+                    reference = REFERENCE.format(count=len(entry["tasks"]))
+                    self.saved_tokens += max(entry["tokens"] - estimate_tokens(reference), 0)
+                    return {"text": reference, "delta": "\n".join(delta),
+                            "aliases": dict(entry["aliases"]), "resync": False, "full": False}
+                self.resyncs += 1
+            else:
+                self.full_turns += 1
+
+        built = build()
+        entry = {
+            "text": built["text"],
+            "tokens": built["tokens"],
+            "fingerprint": self._fingerprint(tasks),
+            "changes": [],
+            "tasks": {t["id"]: (t["title"], bool(t["completed"])) for t in tasks},
+            "aliases": dict(built["aliases"]),
+            "alias_of": {task_id: alias for alias, task_id in built["aliases"].items()},
+        }
+        with self._lock:
+            self._snapshots[key] = entry
+            self._snapshots.move_to_end(key)
+            while len(self._snapshots) > self.max_conversations:
+                self._snapshots.popitem(last=False)
+        return {"text": entry["text"], "delta": "", "aliases": dict(entry["aliases"]), "resync": resync,
+                "full": True}
+
+    def forget(self, user_id: str, conversation_id: str) -> None:
+        with self._lock:
+            self._snapshots.pop((user_id, conversation_id), None)
+
+    def _alias(self, entry: Dict[str, Any], task_id: str) -> str:
+        alias = entry["alias_of"].get(task_id)
+        if alias is None:
+            alias = f"t{len(entry['aliases']) + 1}"
+            entry["aliases"][alias] = task_id
+            entry["alias_of"][task_id] = alias
+        return alias
+
+    @staticmethod
+    def _fingerprint(tasks: List[Dict[str, Any]]) -> int:
+        # What the delta lines are made of; cheaper to compare than to diff
+        return hash(tuple((t["id"], t["title"], bool(t["completed"])) for t in tasks))
+
+    def _delta(self, entry: Dict[str, Any], message: str, tasks: List[Dict[str, Any]]) -> List[str]:
+        # The tasks have not changed since the last diff: only relevance can add lines
+        fingerprint = self._fingerprint(tasks)
+        if fingerprint != entry["fingerprint"]:
+            entry["changes"] = self._changes(entry, tasks)
+            entry["fingerprint"] = fingerprint
+        lines = list(entry["changes"])
+        lines.extend(self._relevant(entry, message, tasks, lines))
+        return lines
+
+    def _changes(self, entry: Dict[str, Any], tasks: List[Dict[str, Any]]) -> List[str]:
+        lines = []
+        current = {}
+        for task in tasks:
+            title, completed = task["title"], bool(task["completed"])
+            current[task["id"]] = task
+            before = entry["tasks"].get(task["id"])
+            if before is None:
+                lines.append(f"- added: {format_task_line(task, self._alias(entry, task['id']))[2:]}")
+                continue
+            alias = None
+            if before[0] != title:
+                alias = self._alias(entry, task["id"])
+                lines.append(f"- renamed: {alias}: {before[0]} -> {title}")
+            if before[1] != completed:
+                alias = alias or self._alias(entry, task["id"])
+                lines.append(f"- {'completed' if completed else 'reopened'}: {alias}: {title}")
+        for task_id, (title, _) in entry["tasks"].items():
+            if task_id not in current:
+                lines.append(f"- deleted: {self._alias(entry, task_id)}: {title}")
+        return lines
+
+    def _relevant(self, entry: Dict[str, Any], message: str, tasks: List[Dict[str, Any]],
+                  lines: List[str]) -> List[str]:
+        # The list is not resent: surface the tasks this message is about
+        words = tokenize(message)
+        mentioned = {task_id for alias, task_id in entry["aliases"].items()
+                     if any(f" {alias}: " in line for line in lines)}
+        relevant = []
+        for task in TaskContextBuilder.rank(message, tasks):
+            if len(relevant) == MAX_RELEVANT_LINES or not words & tokenize(task["title"]):
+                break
+            if task["id"] in mentioned:
+                continue
+            relevant.append(f"- relevant: {format_task_line(task, self._alias(entry, task['id']))[2:]}")
+        return relevant
+
+    def _too_large(self, entry: Dict[str, Any], delta: List[str]) -> bool:
+        if len(delta) > self.max_delta_lines:
+            return True
+        return estimate_tokens("\n".join(delta)) > self.max_delta_ratio * max(entry["tokens"], 1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "conversations": len(self._snapshots),
+                "full_turns": self.full_turns,
+                "delta_turns": self.delta_turns,
+                "resyncs": self.resyncs,
+                # Task-list tokens delta turns left out of the prompt
+                "saved_tokens": self.saved_tokens
+            }
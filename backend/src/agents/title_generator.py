@@ -0,0 +1,244 @@
+"""Local extractive conversation titles (e.g. "Shopping: milk, eggs") built from the first message"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+# "local" (default) titles every chat with generate_title; "model" also asks the LLM for a chat_title
+DEFAULT_TITLE_SOURCE = os.getenv("CHAT_TITLE_SOURCE", "local").lower()
+
+MAX_TITLE_CHARS = 40
+MAX_OBJECTS = 3
+MAX_OBJECT_WORDS = 3
+
+# Filler that precedes a task title ("add a task called milk"); shared with the agent's fallback parser
+FILLER_PREFIX = re.compile(r'^(?:(?:to|my|a|the|task|tasks|called|named|as|is|with|label)\s+)+', re.IGNORECASE)
+
+_FILLER = {"to", "my", "a", "the", "task", "tasks", "called", "named", "as", "is", "with", "label"}
+
+_STOPWORDS = _FILLER | {
+    "an", "and", "or", "of", "for", "in", "on", "at", "it", "i", "me", "we", "our", "you", "your", "this", "that",
+    "these", "those", "some", "any", "all", "new", "list", "todo", "todos", "item", "items", "also", "too", "just",
+    "please", "plz", "pls", "can", "could", "would", "will", "should", "need", "want", "wanna", "let", "lets",
+    "hey", "hi", "hello", "salam", "ok", "okay", "thanks", "now", "today", "then", "get", "got", "be", "are",
+    "am", "was", "have", "has", "from", "by", "about", "up", "out", "into", "one", "there", "what", "which",
+    # Roman Urdu function words
+    "do", "kar", "karo", "kardo", "kr", "dein", "den", "ko", "ka", "ki", "ke", "hai", "hain", "wala", "wali",
+    "bhi", "mera", "mere", "meri", "ye", "yeh", "wo", "woh", "se", "mein", "main", "mujhe", "hum", "hamara",
+    "zara", "bhai", "yaar", "jee", "ji", "na", "nahi", "ab", "abhi", "aaj", "kuch", "sab", "saare", "sare",
+    "karna", "karni", "karne", "jana", "jaana", "hona", "hoga", "tayari", "tayyari",
+    # When, not what
+    "tomorrow", "tonight", "morning", "evening", "week", "weekend", "monday", "tuesday", "wednesday", "thursday",
+    "friday", "saturday", "sunday", "kal", "parson", "subah", "shaam", "raat", "jaldi",
+    # Generic verbs
+    "make", "prepare", "take", "bring", "start", "try", "go", "help", "organise", "organize", "plan", "check",
+}
+
+# Words that split a message into separate objects
+_SEPARATORS = re.compile(r'\s*(?:,|;|&|\+|\band\b|\baur\b|\bor\b|\bthen\b|\bphir\b)\s*', re.IGNORECASE)
+# Old and new title of a rename
+_RENAME_SEPARATOR = re.compile(r'\s+(?:to|into|as|ko|se)\s+', re.IGNORECASE)
+_WORD = re.compile(r"[a-z0-9][a-z0-9'\-]*")
+
+# Verb -> action. Verbs never become part of an object.
+_ACTIONS = {
+    "add": "add", "create": "add", "remember": "add", "remind": "add", "note": "add", "save": "add",
+    "likh": "add", "likho": "add", "daal": "add", "dal": "add", "dalo": "add", "daalo": "add",
+    "delete": "delete", "remove": "delete", "clear": "delete", "drop": "delete", "cancel": "delete",
+    "hata": "delete", "hatao": "delete", "mita": "delete", "mitao": "delete",
+    "complete": "complete", "done": "complete", "finish": "complete", "finished": "complete", "mark": "complete",
+    "completed": "complete", "mukammal": "complete", "khatam": "complete",
+    "update": "edit", "edit": "edit", "rename": "edit", "change": "edit", "modify": "edit",
+    "badal": "edit", "badlo": "edit",
+    "show": "list", "view": "list", "display": "list", "see": "list", "dikhao": "list", "dikha": "list",
+    "batao": "list", "bata": "list", "btao": "list",
+}
+
+# Title prefix for an action when no topic is recognised
+_ACTION_LABELS = {
+    "add": "New task",
+    "delete": "Remove",
+    "complete": "Done",
+    "edit": "Rename",
+}
+
+# (label, words that name the topic and are dropped, words that hint at it and are kept)
+_TOPICS = [
+    ("Shopping", {"shopping", "shop", "grocery", "groceries", "buy", "purchase", "order", "kharidna", "kharido",
+                  "khareedna", "lana", "lao", "le", "lena", "sauda", "market"},
+     {"milk", "eggs", "egg", "bread", "butter", "cheese", "rice", "sugar", "tea", "coffee", "fruit", "fruits",
+      "vegetables", "veggies", "chicken", "meat", "flour", "atta", "doodh", "anday", "ande", "sabzi", "chai",
+      "cheeni", "soap", "shampoo", "oil", "juice"}),
+    ("Bills", {"pay", "bill", "bills", "payment", "dues", "bharna", "bharo", "jama"},
+     {"rent", "electricity", "bijli", "gas", "internet", "wifi", "fee", "fees", "insurance", "tax", "emi",
+      "credit", "card", "loan"}),
+    ("Health", {"health", "appointment", "checkup"},
+     {"doctor", "dentist", "medicine", "medicines", "dawai", "pharmacy", "gym", "workout", "run", "yoga",
+      "hospital", "clinic", "vaccine", "pills", "walk", "exercise"}),
+    ("Work", {"work", "office", "job", "kaam"},
+     {"meeting", "report", "email", "emails", "client", "deadline", "presentation", "slides", "project",
+      "invoice", "review", "standup", "boss", "proposal", "deploy", "bug", "code", "pr"}),
+    ("Study", {"study", "parhai", "padhai", "parhna"},
+     {"exam", "exams", "homework", "assignment", "quiz", "notes", "lecture", "class", "course", "thesis",
+      "chapter", "revision", "test"}),
+    ("Travel", {"travel", "trip", "safar"},
+     {"flight", "ticket", "tickets", "hotel", "visa", "passport", "packing", "pack", "booking", "train", "bus"}),
+    ("Calls", {"call", "phone", "ring"},
+     {"mom", "dad", "ammi", "abbu", "ami", "abu", "bhai", "behen", "friend", "uncle", "aunty"}),
+    ("Home", {"home", "ghar", "chores"},
+     {"laundry", "dishes", "clean", "cleaning", "safai", "plants", "trash", "garbage", "kitchen", "repair",
+      "plumber", "electrician"}),
+]
+
+_GREETING = re.compile(
+    r'^(?:hi+|hello+|hey+|salam|assalam[u ]?o?\s*alaikum|aoa|good\s+(?:morning|evening|afternoon)|'
+    r'how\s+are\s+you|kya\s+haal\s+hai|thanks?|thank\s+you|shukriya|ok(?:ay)?)\W*$', re.IGNORECASE)
+_LIST = re.compile(r'\b(?:show|list|display|view|dikhao|dikha|batao|btao)\b.*\b(?:tasks?|todos?|list|kaam)\b|'
+                   r'\b(?:tasks?|kaam)\s+(?:dikhao|dikha\s+do|batao|bata\s+do|btao)\b|'
+                   r'^(?:my\s+)?(?:pending\s+|completed\s+)?(?:tasks?|todos?)$', re.IGNORECASE)
+
+
+def strip_filler(title: str) -> str:
+    """Remove leading filler words ("to", "my", "a task called", ...) and surrounding quotes."""
+    if not title:
+        return ""
+    # One pass: the prefix pattern takes a whole run of filler words
+    title = FILLER_PREFIX.sub('', title.strip()).strip()
+    return title.strip('"').strip("'").strip().strip('"').strip("'")
+
+
+def legacy_title(message: str) -> str:
+    """The previous fallback title: the first four words of the message."""
+    title = " ".join(message.split()[:4])
+    if len(title) > 30:
+        title = title[:30] + "..."
+    return title
+
+
+def _detect_topic(words: List[str]) -> Optional[str]:
+    best, best_hits = None, 0
+    for label, names, cues in _TOPICS:
+        hits = sum(2 if w in names else 1 for w in words if w in names or w in cues)
+        if hits > best_hits:
+            best, best_hits = label, hits
+    return best
+
+
+def _topic_names(label: Optional[str]) -> set:
+    for name, names, _ in _TOPICS:
+        if name == label:
+            return names
+    return set()
+
+
+def _objects(segments: List[str], dropped: set) -> List[str]:
+    objects = []
+    for segment in segments:
+        words = [w for w in _WORD.findall(segment.lower())
+                 if w not in _STOPWORDS and w not in _ACTIONS and w not in dropped]
+        if not words:
+            continue
+        obj = " ".join(words[:MAX_OBJECT_WORDS])
+        if obj not in objects:
+            objects.append(obj)
+        if len(objects) == MAX_OBJECTS:
+            break
+    return objects
+
+
+def _fit(prefix: str, objects: List[str]) -> str:
+    # Drop trailing objects until the title fits
+    while objects:
+        body = ", ".join(objects)
+        title = f"{prefix}: {body}" if prefix else body[:1].upper() + body[1:]
+        if len(title) <= MAX_TITLE_CHARS or len(objects) == 1:
+            return title if len(title) <= MAX_TITLE_CHARS else title[:MAX_TITLE_CHARS - 3].rstrip() + "..."
+        objects = objects[:-1]
+    return prefix
+
+
+def generate_title(message: str) -> str:
+    """
+    Extractive title for a chat that starts with `message`: a topic or action
+    label followed by the main objects, e.g. "add milk and eggs" ->
+    "Shopping: milk, eggs". Pure string work, no model call.
+    """
+    text = (message or "").strip()
+    if not text:
+        return "New Chat"
+    if _GREETING.match(text):
+        return "Quick Chat"
+    if _LIST.search(text):
+        status = re.search(r'\b(pending|completed|done|baqi|baaki)\b', text, re.IGNORECASE)
+        if status:
+            return "Completed tasks" if status.group(1).lower() in ("completed", "done") else "Pending tasks"
+        return "Task list"
+
+    words = _WORD.findall(text.lower())
+    action = next((_ACTIONS[w] for w in words if w in _ACTIONS), None)
+    topic = _detect_topic(words)
+    segments = _SEPARATORS.split(text)
+    if action == "edit":
+        segments = [part for segment in segments for part in _RENAME_SEPARATOR.split(segment)]
+
+    if topic and action in (None, "add"):
+        # The topic label replaces the words that named it ("shopping list")
+        prefix, dropped = topic, _topic_names(topic)
+    elif action in _ACTION_LABELS:
+        prefix, dropped = _ACTION_LABELS[action], set()
+    else:
+        prefix, dropped = topic or "", set()
+    objects = _objects(segments, dropped)
+    if not objects:
+        return prefix or legacy_title(text)
+    return _fit(prefix, objects)
+
+
+def compare(corpus: List[Dict[str, str]]) -> Dict[str, Any]:
+    """
+    Score generate_title and the legacy four-word title against the expected
+    titles of `corpus` ([{"message", "expected"}]). Matching is case-insensitive.
+    """
+    report = {"n": len(corpus), "misses": []}
+    for name, fn in (("local", generate_title), ("legacy", legacy_title)):
+        correct, elapsed = 0, 0.0
+        for case in corpus:
+            start = time.perf_counter()
+            title = fn(case["message"])
+            elapsed += time.perf_counter() - start
+            if title.lower() == case["expected"].lower():
+                correct += 1
+            elif name == "local":
+                report["misses"].append({**case, "got": title})
+        report[name] = {
+            "accuracy": round(correct / len(corpus), 3) if corpus else 0.0,
+            "mean_us": round(elapsed / len(corpus) * 1e6, 1) if corpus else 0.0
+        }
+    return report
+
+
+def format_comparison(report: Dict[str, Any]) -> str:
+    lines = [f"Compared on {report['n']} messages", f"{'method':<10}{'accuracy':>10}{'mean µs':>10}"]
+    for name in ("local", "legacy"):
+        lines.append(f"{name:<10}{report[name]['accuracy']:>10.3f}{report[name]['mean_us']:>10.1f}")
+    for miss in report["misses"]:
+        lines.append(f"MISS {miss['message']!r}: expected {miss['expected']!r}, got {miss['got']!r}")
+    return "\n".join(lines)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare local chat titles with the expected titles of a corpus.")
+    parser.add_argument("corpus", help="JSON file with a list of {message, expected} objects")
+    args = parser.parse_args(argv)
+    with open(args.corpus, encoding="utf-8") as f:
+        report = compare(json.load(f))
+    print(format_comparison(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
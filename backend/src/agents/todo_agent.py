@@ -1,22 +1,109 @@
 import os
 import re
-from typing import Dict, Any, List
-from google.generativeai import configure, GenerativeModel
+import json
+import time
+import logging
+from typing import Dict, Any, List, Iterator, Optional
 from ..tools.task_tools import TaskTools
+from .llm_executor import LLMExecutor
+from .stream_parser import JSONReplyParser, ResponseTextExtractor, parse_json_reply
+from .response_cache import ResponseCache
+from .intent_engine import IntentEngine, ambiguous_candidates
+from .clarifications import ClarificationStore
+from .context_builder import TaskContextBuilder, resolve_alias, strip_aliases
+from .conversation_memory import ConversationMemory, format_messages
+from .task_snapshots import TaskSnapshots
+from .model_health import ModelHealthTracker
+from .hedging import Hedger
+from .providers import (LLMProvider, MODEL_CANDIDATES, TOOL_DECLARATIONS, function_calls, get_provider,
+                        response_text)
+from .title_generator import DEFAULT_TITLE_SOURCE, generate_title
+from .fallback_parser import PURE_GREETING, TASK_VERB, parse_fallback
+from .token_budget import (PromptBudget, PromptSection, ReplyModeMetrics, TokenMetrics, estimate_tokens,
+                           truncate_to_tokens)
+from ..services.task_service import TaskService, TaskSnapshot, task_versions
 from dotenv import load_dotenv
 
 # Load environment variables explicitly from backend/.env
 env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), '.env')
 load_dotenv(dotenv_path=env_path, override=True)
 
-# Configure the Gemini API
-api_key = os.getenv("GEMINI_API_KEY")
-configure(api_key=api_key)
+logger = logging.getLogger(__name__)
+
+# Tool calls the chat endpoints know how to execute
+TOOL_NAMES = ("add_task", "delete_task", "update_task", "complete_task", "list_tasks")
+# Set LLM_FUNCTION_CALLING=1 to declare the tools to the provider instead of describing them in the prompt
+DEFAULT_FUNCTION_CALLING = os.getenv("LLM_FUNCTION_CALLING", "0") == "1"
+
+# Tool and output instructions of the prompt, per reply mode
+JSON_TOOL_INSTRUCTIONS = """4. Use the available tool functions (expressed as intents) ONLY when the user intends to manage tasks.
+        5. **Available Tools**:
+           - `list_tasks(status: "all" | "pending" | "completed")`
+           - `add_task(title: string)`
+           - `complete_task(task_id: string)`
+           - `delete_task(task_id: string)`
+           - `update_task(task_id: string, title: string)`
+
+        6. **OUTPUT FORMAT**: ALWAYS return a VALID JSON object. No markdown, no extra text.
+           Write "tool_calls" first, then "response".
+           {
+             "tool_calls": [
+                { "name": "tool_name", "arguments": { "arg1": "val1" } }
+             ],
+             "response": "Your natural language response here."{title_field}
+           }"""
+FUNCTION_TOOL_INSTRUCTIONS = """4. Call the declared functions ONLY when the user intends to manage tasks.
+        5. Reply to the user in plain text (no JSON)."""
+
+
+def resolve_working_model(models_to_try: List[str] = None, provider: LLMProvider = None):
+    """
+    Probe the candidate models of the configured provider in order and return
+    (model, model_name) for the first one that answers.
+    """
+    return (provider or get_provider()).resolve(models_to_try)
+
+
+class ModelsUnavailableError(Exception):
+    """Every candidate model's circuit breaker is open."""
+
 
 class TodoAgent:
-    def __init__(self, database_url: str):
-        self.task_tools = TaskTools(database_url)
-        self.model, self.model_name = self._initialize_model()
+    def __init__(self, database_url: str = None, engine=None, model=None, model_name: str = None,
+                 llm_executor: LLMExecutor = None, response_cache: ResponseCache = None,
+                 intent_engine: IntentEngine = None, context_builder: TaskContextBuilder = None,
+                 prompt_budget: PromptBudget = None, memory: ConversationMemory = None,
+                 candidates: List[str] = None, model_health: ModelHealthTracker = None,
+                 hedger: Hedger = None, provider: LLMProvider = None, model_titles: bool = None,
+                 function_calling: bool = None, task_snapshots: TaskSnapshots = None,
+                 clarifications: ClarificationStore = None):
+        self.task_tools = TaskTools(database_url, engine=engine)
+        self.llm_executor = llm_executor or LLMExecutor()
+        self.response_cache = response_cache or ResponseCache()
+        self.intent_engine = intent_engine or IntentEngine()
+        self.context_builder = context_builder or TaskContextBuilder()
+        self.prompt_budget = prompt_budget or PromptBudget()
+        self.token_metrics = TokenMetrics()
+        self.memory = memory or ConversationMemory()
+        self.task_snapshots = task_snapshots or TaskSnapshots()
+        self.clarifications = clarifications or ClarificationStore()
+        # Titles come from title_generator unless the model is asked for them too
+        self.model_titles = DEFAULT_TITLE_SOURCE == "model" if model_titles is None else model_titles
+        self.function_calling = DEFAULT_FUNCTION_CALLING if function_calling is None else function_calling
+        self._declared_tools = None
+        self.reply_modes = ReplyModeMetrics()
+        self._provider = provider
+        if model is not None:
+            # Model already resolved by the registry, skip the network probe
+            self.model, self.model_name = model, model_name or MODEL_CANDIDATES[0]
+        else:
+            self.model, self.model_name = self._initialize_model()
+            candidates = candidates or self.provider.candidates
+        # The resolved model is preferred; other candidates take over while its breaker is open
+        self.candidates = [self.model_name] + [c for c in (candidates or []) if c != self.model_name]
+        self._models = {self.model_name: self.model}
+        self.model_health = model_health or ModelHealthTracker(self.candidates)
+        self.hedger = hedger or Hedger()
         self.system_prompt = """
         SYSTEM PROMPT FOR TASK MANAGEMENT AGENT
 
@@ -87,6 +174,9 @@ class TodoAgent:
     Agent: "Ye hain aapke tasks:\n1. Milk\n2. Bread"
     Tool call: list_tasks(status="all", user_id=USER_ID)
     """
+        # With declared functions the textual tool list is redundant
+        self._function_system_prompt = re.sub(r'\n *6\. TOOL CALLS USAGE\n.*?(?=\n *7\. )', '',
+                                              self.system_prompt, flags=re.S)
 
     def _get_best_model(self) -> str:
         # Prioritized list of models to try
@@ -98,346 +188,749 @@ class TodoAgent:
         ]
         return models_to_try[0]
         
+    @property
+    def provider(self) -> LLMProvider:
+        # Resolved lazily: an agent built around an injected model never needs the configured backend
+        if self._provider is None:
+            self._provider = get_provider()
+        return self._provider
+
     def _initialize_model(self):
         """Try to initialize a working model from a list of candidates."""
-        models_to_try = [
-            'gemini-2.0-flash',
-            'gemini-2.5-flash',
-            'gemini-1.5-flash',
-            'gemini-pro'
-        ]
-        
-        for model_name in models_to_try:
-            try:
-                model = GenerativeModel(model_name)
-                # Test with a lightweight call
-                model.count_tokens("test")
-                return model, model_name
-            except Exception as e:
-                # print(f"DEBUG: Failed to init {model_name}: {e}")
-                continue
-        
-        # Fallback to a default if all fail
-        return GenerativeModel('gemini-2.0-flash'), 'gemini-2.0-flash'
-
-    def process_message(self, user_id: str, message: str, conversation_id: str = None) -> Dict[str, Any]:
-        import re  # Import at the beginning of the function
-
+        return self.provider.resolve()
+
+    def set_model(self, model, model_name: str):
+        """Swap the model used for generation (called by the registry after a re-probe)."""
+        self.model, self.model_name = model, model_name
+        self._models[model_name] = model
+        self.model_health.add(model_name, preferred=True)
+
+    def _get_model(self, name: str):
+        model = self._models.get(name)
+        if model is None:
+            model = self._models.setdefault(name, self.provider.get_model(name))
+        return model
+
+    def _acquire_model(self):
+        """(name, model) of the healthiest candidate; raises ModelsUnavailableError if all breakers are open."""
+        name = self.model_health.acquire()
+        if name is None:
+            raise ModelsUnavailableError("All model circuit breakers are open")
+        return name, self._get_model(name)
+
+    def _call_options(self, tools) -> Dict[str, Any]:
+        options = {"request_options": {"timeout": self.hedger.attempt_timeout}}
+        if tools:
+            options["tools"] = tools
+        return options
+
+    def _attempt(self, name: str, model, prompt: str, tools=None):
+        """One model call with a hard timeout, recorded in the model's circuit breaker."""
+        started = time.perf_counter()
         try:
-            # Detect simple greetings early to skip AI/DB ONLY IF no task verbs are present
-            greetings = [r'^hi$', r'^hello$', r'^hey$', r'^asalam\s*o\s*alaikum$', r'^aoa$', r'^salam$']
-            task_verbs = ['add', 'create', 'delete', 'remove', 'update', 'edit', 'complete', 'finish', 'list', 'show']
-
-            message_clean = message.lower().strip().replace('?', '').replace('!', '').replace('.', '')
-            has_task_verb = any(verb in message_clean for verb in task_verbs)
-            is_pure_greeting = any(re.match(g, message_clean) for g in greetings)
+            response = model.generate_content(prompt, **self._call_options(tools))
+            raw_text = response_text(response).strip()
+        except Exception as e:
+            self.model_health.record_failure(name, time.perf_counter() - started, e)
+            raise
+        self.model_health.record_success(name, time.perf_counter() - started)
+        return response, raw_text
+
+    def _hedge_backup(self, names: Dict[bool, str], attempt):
+        """
+        Backup attempt for the hedger: `attempt(other_name, other_model)` on the
+        next healthy candidate. `names` maps is_hedge to the model of each
+        attempt (names[False] is the primary); the backup's model is added.
+        """
+        name = names[False]
+        other = self.model_health.acquire(exclude={name})
+        if other is None:
+            return None
+        names[True] = other
+        logger.info(f"AGENT - Hedging slow call to {name} with {other}")
+        return lambda: attempt(other, self._get_model(other))
+
+    def _lost_attempt(self, names: Dict[bool, str], streaming: bool, is_hedge: bool, result) -> None:
+        """
+        Hedger callback for the attempt that lost. One cancelled before it ran
+        gives back the breaker slot acquire() took (a half-open probe would
+        otherwise stay in flight forever). A stream that opened after the
+        winner counts as a success up to its first chunk and is closed
+        unread. A finished _attempt already recorded its own outcome.
+        """
+        if result is None:
+            self.model_health.release(names[is_hedge])
+        elif streaming:
+            name, started, _, iterator = result
+            self.model_health.record_success(name, time.perf_counter() - started)
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def _hedged(self, name: str, model, attempt, streaming: bool = False):
+        """Run `attempt(name, model)` through the hedger, backed up on the next healthy candidate."""
+        names = {False: name}
+        result, _ = self.hedger.call(lambda: attempt(name, model), lambda: self._hedge_backup(names, attempt),
+                                     lambda is_hedge, lost: self._lost_attempt(names, streaming, is_hedge, lost))
+        return result
+
+    def _generate(self, prompt: str, tools=None):
+        """
+        Non-streaming model call through the circuit breakers. If the healthiest
+        model is slower than usual, the same prompt is hedged to the next
+        healthy candidate and the first answer wins. Returns (response, raw_text).
+        """
+        name, model = self._acquire_model()
+        return self._hedged(name, model, lambda n, m: self._attempt(n, m, prompt, tools))
+
+    def _open_stream(self, name: str, model, prompt: str, tools=None):
+        """Start a streaming call and wait for its first chunk. Returns (name, started, first chunk, iterator)."""
+        started = time.perf_counter()
+        try:
+            iterator = iter(model.generate_content(prompt, stream=True, **self._call_options(tools)))
+            first = next(iterator, None)
+        except Exception as e:
+            self.model_health.record_failure(name, time.perf_counter() - started, e)
+            raise
+        return name, started, first, iterator
+
+    def _generate_stream(self, prompt: str, tools=None) -> Iterator:
+        """
+        Streaming model call through the circuit breakers; yields response chunks.
+        Hedged like _generate, on the time to the first chunk: the stream that
+        starts first is the one read to the end.
+        """
+        name, model = self._acquire_model()
+        name, started, first, iterator = self._hedged(name, model,
+                                                      lambda n, m: self._open_stream(n, m, prompt, tools),
+                                                      streaming=True)
+        try:
+            if first is not None:
+                yield first
+            for chunk in iterator:
+                yield chunk
+        except GeneratorExit:
+            # Consumer stopped early (client went away); not the model's fault
+            self.model_health.record_success(name, time.perf_counter() - started)
+            raise
+        except Exception as e:
+            self.model_health.record_failure(name, time.perf_counter() - started, e)
+            raise
+        self.model_health.record_success(name, time.perf_counter() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        """Runtime counters for the health endpoint."""
+        return {
+            "provider": self._provider.name if self._provider else None,
+            "model": self.model_name,
+            "llm_executor": self.llm_executor.stats(),
+            "response_cache": self.response_cache.stats(),
+            "intent_engine": self.intent_engine.stats(),
+            "tokens": self.token_metrics.stats(),
+            "model_health": self.model_health.stats(),
+            "hedging": self.hedger.stats(),
+            "reply_modes": self.reply_modes.stats(),
+            "task_snapshots": self.task_snapshots.stats(),
+            "clarifications": self.clarifications.stats()
+        }
+
+    async def aprocess_message(self, user_id: str, message: str, conversation_id: str = None) -> Dict[str, Any]:
+        """
+        Async variant of process_message for use from async endpoints.
+        The blocking model call runs on the bounded LLM executor, keeping the event loop free.
+        """
+        return await self.llm_executor.run(self.process_message, user_id, message, conversation_id)
+
+    async def astream_message(self, user_id: str, message: str, conversation_id: str = None):
+        """Async iterator over stream_message events, produced on the bounded LLM executor."""
+        async for event in self.llm_executor.stream(self.stream_message, user_id, message, conversation_id):
+            yield event
+
+    def _classify_message(self, message: str):
+        """Return (has_task_verb, is_pure_greeting) for the raw user message."""
+        # Detect simple greetings early to skip AI/DB ONLY IF no task verbs are present
+        message_clean = message.lower().strip().replace('?', '').replace('!', '').replace('.', '')
+        has_task_verb = TASK_VERB.search(message_clean) is not None
+        is_pure_greeting = PURE_GREETING.match(message_clean) is not None
+        return has_task_verb, is_pure_greeting
+
+    def _fetch_tasks(self, user_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Load the user's tasks for context. Returns None if they could not be fetched."""
+        try:
+            tasks_result = self.task_tools.list_tasks(user_id)
+        except Exception:
+            return None
+        if not tasks_result.get("success"):
+            return None
+        return tasks_result.get("tasks") or []
+
+    def _resolve_tasks(self, user_id: str, identifiers: List[str], snapshot: TaskSnapshot = None) -> Dict[str, Any]:
+        """
+        {identifier: (task, status)} for the fallback parser: matched against the
+        turn's snapshot, with one query for the rest (see TaskService.resolve_tasks).
+        """
+        db = self.task_tools.get_db_session()
+        try:
+            return TaskService.resolve_tasks(db, user_id, identifiers, snapshot)
+        finally:
+            db.close()
+
+    def _clarify(self, user_id: str, conversation_id: Optional[str], snapshot: Optional[TaskSnapshot], action: str,
+                 target: str, arguments: Dict[str, Any], default: str) -> str:
+        """Ask which of the snapshot's matching tasks `target` means; `default` when they are not known."""
+        tasks = [t._asdict() for t in snapshot.tasks] if snapshot is not None else []
+        candidates = ambiguous_candidates(target, tasks)
+        if len(candidates) < 2:
+            return default
+        return self.clarifications.ask(user_id, conversation_id, action, target, arguments, candidates)
+
+    def _load_history(self, user_id: str, conversation_id: Optional[str], message: str) -> Dict[str, Any]:
+        """Recent messages and rolling summary of the conversation; empty if unavailable."""
+        if not conversation_id:
+            return {"summary": "", "recent": []}
+        db = self.task_tools.get_db_session()
+        try:
+            return self.memory.load(db, user_id, conversation_id, current_message=message)
+        except Exception as e:
+            logger.warning(f"AGENT - Could not load conversation history: {e}")
+            return {"summary": "", "recent": []}
+        finally:
+            db.close()
+
+    def _tools(self):
+        """Tool declarations for the provider in function-calling mode; None means the JSON-in-prompt mode."""
+        if not self.function_calling:
+            return None
+        if self._declared_tools is None:
+            # Providers without native function calling stay on the JSON path
+            self._declared_tools = self.provider.declare_tools(TOOL_DECLARATIONS) or []
+        return self._declared_tools or None
+
+    def _build_prompt(self, message: str, tasks: Optional[List[Dict[str, Any]]], history: Dict[str, Any] = None,
+                      mode: str = "json", user_id: str = None, conversation_id: str = None):
+        """
+        Build the model prompt from the message, task list and conversation history,
+        trimmed to the prompt budget. Returns (prompt, tasks_context_clean, budget_report);
+        budget_report["aliases"] maps the short task IDs used in the prompt to real IDs.
+        Within a conversation the task list is only sent on the first turn (and
+        on resyncs); later turns send the changes since (see TaskSnapshots).
+        """
+        history = history or {"summary": "", "recent": []}
+        recent = history["recent"]
+        # Only the most relevant tasks fit in the prompt; the rest become an aggregate line
+        build = lambda: self.context_builder.build(message, tasks, aliases=True)
+        if conversation_id and tasks is not None:
+            tasks_context = self.task_snapshots.context(user_id, conversation_id, message, tasks, build)
+        else:
+            tasks_context = {**build(), "delta": "", "full": True}
+
+        def shrink_history(tokens):
+            # Keep the newest messages that fit
+            kept = []
+            for m in reversed(recent):
+                if estimate_tokens(format_messages([m] + kept)) > tokens:
+                    break
+                kept.insert(0, m)
+            return format_messages(kept)
+
+        sections = [
+            # Lowest priority is trimmed first
+            PromptSection("summary", history["summary"], priority=0),
+            PromptSection("history", format_messages(recent), priority=1, shrink=shrink_history),
+            PromptSection("tasks", tasks_context["text"], priority=2,
+                          shrink=lambda tokens: self.context_builder.shrink(tasks_context["text"], tokens)),
+            PromptSection("task_changes", tasks_context["delta"], priority=2,
+                          shrink=lambda tokens: truncate_to_tokens(tasks_context["delta"], tokens)),
+            PromptSection("message", message, priority=3,
+                          shrink=lambda tokens: truncate_to_tokens(message, tokens)),
+        ]
+        prompt, report = self.prompt_budget.fit(lambda rendered: self._render_prompt(rendered, mode), sections)
+        # A shrunk task section keeps a prefix of the same lines, so the alias table still applies
+        report["aliases"] = tasks_context["aliases"]
+        if not tasks_context["full"]:
+            # The prompt has no list to fall back to; what the user would be shown is the current list
+            return prompt, self.context_builder.build(message, tasks)["text"], report
+        return prompt, report["sections"]["tasks"], report
+
+    def _render_prompt(self, sections: Dict[str, str], mode: str = "json") -> str:
+        message, tasks_context_clean = sections["message"], sections["tasks"]
+        summary = sections["summary"] or "None"
+        history = sections["history"] or "(This is the start of the conversation.)"
+        changes = f"\n        ### TASK CHANGES SINCE THE LIST WAS SENT:\n        {sections['task_changes']}\n" \
+            if sections.get("task_changes") else ""
+        if mode == "function":
+            # Tool signatures travel as function declarations; the reply is plain text
+            system_prompt = self._function_system_prompt
+            tool_instructions = FUNCTION_TOOL_INSTRUCTIONS
+        else:
+            system_prompt = self.system_prompt
+            title_field = (',\n             "chat_title": "A short 3-5 word title for this chat based on user intent '
+                           '(e.g. \'Shopping List\', \'Fixing Bug\')"') if self.model_titles else ""
+            tool_instructions = JSON_TOOL_INSTRUCTIONS.replace("{title_field}", title_field)
+        # Everything up to the task list stays the same across turns, so providers can reuse it
+        # as a cached prompt prefix
+        prompt = f"""
+        {system_prompt}
+
+        ### CORE INSTRUCTIONS:
+        1. Respond naturally to greetings, casual chat, and task-related messages.
+           Use the conversation so far to resolve follow-ups like "that one", "woh wala" or "delete that one too".
+        2. Be friendly, concise, and helpful. Use simple, human-like language (English or Roman Urdu).
+        3. **CRITICAL: NEVER SHOW TASK IDs TO THE USER.**
+           - When listing tasks, only show the **Title** and **Status** (Pending/Completed).
+           - Example: "1. Buy Milk (Pending)"
+           - Each task line starts with its short task ID (t1, t2, ...). Use it as `task_id` in tool calls,
+             but do NOT show it, or any UUID like 'b87587...', to the user.
+           - The task list below may be shortened to the tasks most relevant to the conversation.
+             If it ends with "...and N more", say how many more there are and that the user can say "more" to see the next page.
+           - "TASK CHANGES" lists tasks added, completed, reopened, renamed or deleted since the list was
+             taken, and the tasks relevant to the message. It overrides the list. Later turns of a
+             conversation only send these changes, not the list again.
+
+        {tool_instructions}
+
+        ### USER'S CURRENT TASKS:
+        {tasks_context_clean}
+
+        ### CONVERSATION SO FAR:
+        Summary of earlier messages:
+        {summary}
+
+        Recent messages:
+        {history}
+        {changes}
+        USER MESSAGE: "{message}"
+        """
+        return prompt
+
+    def _fallback_result(self, user_id: str, message: str, conversation_id: str, tasks_context_clean: str,
+                         is_pure_greeting: bool, has_task_verb: bool, snapshot: TaskSnapshot = None) -> Dict[str, Any]:
+        """Rule-based answer used when the model call fails."""
+        # Better fallback handling for task-related messages
+        # Parse the message to determine intent when AI fails (see FALLBACK_RULES)
+        parsed = parse_fallback(message)
+        intent = parsed["intent"]
+
+        # Define fallback responses and tool calls based on message content
+        fallback_response = "Hi 🙂 How can I help you?"
+        fallback_tool_calls = []
+
+        if intent == "add":
+            if "title" in parsed:
+                task_title = parsed["title"]
+                fallback_response = f"Added task: {task_title}"
+                fallback_tool_calls = [{
+                    "name": "add_task",
+                    "arguments": {
+                        "title": task_title,
+                        "user_id": user_id
+                    }
+                }]
+            else:
+                # If we can't extract title, ask for clarification
+                fallback_response = "I'd like to help you add a task. Could you please specify the task title?"
+
+        elif intent == "edit":
+            # "change X to Y", "rename X to Y", "update X to Y", "edit X to Y", "change X Y", "edit X Y"
+            if "target" in parsed:
+                task_identifier = parsed["target"]
+                new_title = parsed["new"]
+
+                task, status = self._resolve_tasks(user_id, [task_identifier], snapshot)[task_identifier]
+                if status == "FOUND":
+                    fallback_response = f"Theek hai, task '{task.title}' ko '{new_title}' kar diya hai. 🙂"
+                    fallback_tool_calls = [{
+                        "name": "update_task",
+                        "arguments": {
+                            "task_id": task.id,
+                            "title": new_title,
+                            "user_id": user_id
+                        }
+                    }]
+                elif status == "AMBIGUOUS":
+                    fallback_response = self._clarify(
+                        user_id, conversation_id, snapshot, "update_task", task_identifier, {"title": new_title},
+                        f"Mujhe multiple tasks mile hain '{task_identifier}' matching. Kisko update karun?")
+                else:
+                    fallback_response = f"Mujhe '{task_identifier}' naam ka koi task nahi mila jise update kar sakun."
+            else:
+                # If we detect intent but match fails (e.g. "Edit task market" without "to...")
+                fallback_response = "Aap kis task ko badalna chahte hain aur uska naya naam kya hoga? (e.g. 'Change milk to buy milk') 🙂"
+
+        elif intent == "delete":
+            if "target" in parsed:
+                task_identifier = parsed["target"]
+                task, status = self._resolve_tasks(user_id, [task_identifier], snapshot)[task_identifier]
+                if status == "FOUND":
+                    fallback_response = f"Theek hai, task '{task.title}' delete kar diya hai. 🙂"
+                    fallback_tool_calls = [{
+                        "name": "delete_task",
+                        "arguments": {
+                            "task_id": task.id,
+                            "user_id": user_id
+                        }
+                    }]
+                elif status == "AMBIGUOUS":
+                    fallback_response = self._clarify(
+                        user_id, conversation_id, snapshot, "delete_task", task_identifier, {},
+                        f"Mujhe multiple tasks mile hain '{task_identifier}' ke naam se. Aap please specify karenge?")
+                else:
+                    fallback_response = f"Maaf kijiyega, mujhe '{task_identifier}' naam ka koi task nahi mila."
+            else:
+                fallback_response = "Aap konsa task delete karna chahte hain? 🙂"
+
+        elif intent == "complete":
+            if "target" in parsed:
+                task_identifier = parsed["target"]
+                task, status = self._resolve_tasks(user_id, [task_identifier], snapshot)[task_identifier]
+                if status == "FOUND":
+                    fallback_response = f"Theek hai, task '{task.title}' complete kar diya hai. 🙂"
+                    fallback_tool_calls = [{
+                        "name": "complete_task",
+                        "arguments": {
+                            "task_id": task.id,
+                            "user_id": user_id
+                        }
+                    }]
+                elif status == "AMBIGUOUS":
+                    fallback_response = self._clarify(
+                        user_id, conversation_id, snapshot, "complete_task", task_identifier, {},
+                        "Multiple tasks mile hain matching your message. Aap please wazahat karenge?")
+                else:
+                    fallback_response = f"Mujhe '{task_identifier}' task nahi mila."
+            else:
+                fallback_response = "Aapne konsa kaam khatam kar liya hai? 🙂"
+
+        elif intent == "list":
+            fallback_response = f"Here are your tasks:\n{tasks_context_clean}"
+            fallback_tool_calls = [{
+                "name": "list_tasks",
+                "arguments": {
+                    "status": "all",
+                    "user_id": user_id
+                }
+            }]
 
+        else:
+            # Pure greeting or other message
             if is_pure_greeting and not has_task_verb:
-                return {
-                    "response": "Hi 🙂 How can I help you?",
-                    "tool_calls": [],
-                    "conversation_id": conversation_id
-                }
+                fallback_response = "Hi 🙂 How can I help you?"
+            else:
+                fallback_response = "I see you're asking about a task. Could you please clarify what you'd like to do? 🙂"
+
+
+        return {
+            "response": fallback_response,
+            "tool_calls": fallback_tool_calls,
+            "conversation_id": conversation_id,
+            "chat_title": generate_title(message)
+        }
+
+    def _structured_reply(self, turn: Dict[str, Any], raw_text: str, native_calls: List[Dict[str, Any]],
+                          parsed: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+        """
+        The model reply as {"response", "tool_calls"}, or None if it could not be
+        parsed. In function-calling mode that is the plain text plus the native
+        calls; in JSON mode, or when a function-calling model wrote the JSON
+        reply anyway, the JSON object in the text (`parsed` if already known).
+        Records the turn's mode, prompt size and parse outcome.
+        """
+        if turn["mode"] == "function" and (native_calls or raw_text.lstrip()[:1] not in ("{", "`")):
+            valid = [c for c in native_calls if isinstance(c.get("arguments", {}), dict)]
+            reply, failed = {"response": raw_text, "tool_calls": valid}, len(valid) < len(native_calls)
+        else:
+            reply = parsed if parsed is not None else parse_json_reply(raw_text)
+            failed = reply is None
+        self.reply_modes.record(turn["mode"], turn["prompt_tokens"], failed)
+        return reply
+
+    @staticmethod
+    def _normalize_tool_call(call: Any, user_id: str, aliases: Dict[str, str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Keep only known tools, map task aliases (t1, t2, ...) back to real task
+        IDs and inject user_id; None for anything else.
+        """
+        if not isinstance(call, dict) or call.get("name") not in TOOL_NAMES:
+            return None
+        if not isinstance(call.get("arguments"), dict):
+            call["arguments"] = {}
+        arguments = call["arguments"]
+        for key in ("task_id", "old_title"):
+            if key in arguments:
+                arguments[key] = resolve_alias(arguments[key], aliases)
+        arguments["user_id"] = user_id
+        return call
+
+    def _parse_model_output(self, raw_text: str, user_id: str, conversation_id: str, has_task_verb: bool,
+                            parsed: Dict[str, Any] = None, aliases: Dict[str, str] = None) -> Dict[str, Any]:
+        """
+        Extract the JSON reply from the model output (or take the already
+        `parsed` reply) and normalize its tool calls.
+        """
+        if parsed is None:
+            # Scans past markdown fences and prose; braces inside strings are not mistaken for the object's end
+            parsed = parse_json_reply(raw_text)
+        json_match = parsed is not None
+        result = parsed if json_match else {"response": raw_text, "tool_calls": []}
+
+        # Filter and inject user_id into tool calls
+        processed_tool_calls = []
+        for call in result.get("tool_calls") or []:
+            call = self._normalize_tool_call(call, user_id, aliases)
+            if call is not None:
+                processed_tool_calls.append(call)
+
+        response_text = result.get("response")
+        if not response_text or (isinstance(response_text, str) and not response_text.strip()):
+            response_text = raw_text if not json_match else "I've processed your request."
+
+        # Final check: if AI returned a generic greeting but task verb was present, override or warn?
+        # For now, trust the AI if it actually replied, but if it failed to return JSON, result["response"] might be empty.
+
+        if has_task_verb and response_text == "Hi 🙂 How can I help you?":
+             response_text = "I see you're asking about a task. Could you please clarify what you'd like to do? 🙂"
+
+        return {
+            "response": response_text,
+            "tool_calls": processed_tool_calls,
+            "conversation_id": conversation_id,
+            "chat_title": result.get("chat_title")
+        }
+
+    def _error_result(self, message: str, conversation_id: str, has_task_verb: bool) -> Dict[str, Any]:
+        fallback_msg = "Hi 🙂 How can I help you?"
+        if has_task_verb:
+            fallback_msg = "I see you're asking about a task. Could you please clarify what you'd like to do? 🙂"
+
+        return {
+            "response": fallback_msg,
+            "tool_calls": [],
+            "conversation_id": conversation_id,
+            "chat_title": generate_title(message)
+        }
+
+    def _prepare_turn(self, user_id: str, message: str, conversation_id: str,
+                      has_task_verb: bool, is_pure_greeting: bool):
+        """
+        Everything that happens before the model call. Returns (result, turn, snapshot):
+        `result` is a finished reply when no model call is needed (greeting,
+        cache hit, confident local intent); otherwise it is None and `turn`
+        holds the prompt and the state needed to finish the turn. `snapshot`
+        is the TaskSnapshot the reply was built from, or None when the tasks
+        were not read.
+        """
+        if is_pure_greeting and not has_task_verb:
+            return {
+                "response": "Hi 🙂 How can I help you?",
+                "tool_calls": [],
+                "conversation_id": conversation_id
+            }, None, None
+
+        # An answer to the question asked last turn ("the second one") runs the pending call directly
+        answered = self.clarifications.answer(user_id, conversation_id, message)
+        if answered is not None:
+            return answered, None, None
+
+        # Key on the task-set version read *before* building context
+        version = task_versions.get(user_id)
+        cache_key = self.response_cache.make_key(user_id, message, version)
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            cached["conversation_id"] = conversation_id
+            return cached, None, None
+
+        tasks = self._fetch_tasks(user_id)
+        snapshot = TaskSnapshot.from_dicts(user_id, version, tasks) if tasks is not None else None
+        if tasks is not None:
+            local = self.intent_engine.answer(user_id, message, tasks, conversation_id)
+            if local is not None:
+                if "clarify" in local:
+                    local["response"] = self.clarifications.ask(user_id, conversation_id, **local.pop("clarify"))
+                return local, None, snapshot
+
+        history = self._load_history(user_id, conversation_id, message)
+        tools = self._tools()
+        mode = "function" if tools else "json"
+        prompt, tasks_context_clean, budget_report = self._build_prompt(message, tasks, history, mode, user_id,
+                                                                        conversation_id)
+        return None, {
+            "snapshot": snapshot,
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "message": message,
+            "started": time.perf_counter(),
+            "prompt": prompt,
+            "prompt_tokens": budget_report["prompt_tokens"],
+            "trimmed": budget_report["trimmed"],
+            # Shown to the user by the fallback reply, so without aliases
+            "tasks_context_clean": strip_aliases(tasks_context_clean),
+            "aliases": budget_report["aliases"],
+            # Replies that could lean on earlier messages must not be replayed elsewhere
+            "cache_key": cache_key if not (history["recent"] or history["summary"]) else None,
+            "has_task_verb": has_task_verb,
+            "is_pure_greeting": is_pure_greeting,
+            "mode": mode,
+            "tools": tools
+        }, snapshot
+
+    def _record_usage(self, turn: Dict[str, Any], raw_text: str, usage=None) -> None:
+        """Record token counts and model latency for the turn; prefer the API's usage numbers when present."""
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        completion_tokens = getattr(usage, "candidates_token_count", None)
+        if not isinstance(prompt_tokens, int):
+            prompt_tokens = turn["prompt_tokens"]
+        if not isinstance(completion_tokens, int):
+            completion_tokens = estimate_tokens(raw_text)
+        duration_ms = (time.perf_counter() - turn["started"]) * 1000
+        self.token_metrics.record(turn["user_id"], turn["conversation_id"], prompt_tokens, completion_tokens,
+                                  turn["trimmed"], duration_ms)
+        logger.info(
+            f"AGENT_TOKENS - User: {turn['user_id']}, Conversation: {turn['conversation_id']}, "
+            f"Prompt: {prompt_tokens}, Completion: {completion_tokens}, "
+            f"Trimmed: {turn['trimmed'] or 'None'}, Duration: {duration_ms:.0f}ms"
+        )
+
+    def _finish_model_turn(self, turn: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+        """Post-process a reply parsed from the model output."""
+        if not result.get("chat_title"):
+            result["chat_title"] = generate_title(turn["message"])
+        if turn["cache_key"] is not None and self.response_cache.is_cacheable(result):
+            self.response_cache.put(turn["cache_key"], result)
+        return result
 
-            # Fetch current tasks to provide context
-            try:
-                tasks_result = self.task_tools.list_tasks(user_id)
-                tasks_context = "No tasks currently."
-                tasks_context_clean = "No tasks currently." # For user display
-                
-                if tasks_result.get("success") and tasks_result.get("tasks"):
-                    tasks_list = tasks_result["tasks"]
-                    # Format tasks for the AI to understand, but keeping ID internal only
-                    # The AI needs ID to perform actions.
-                    tasks_context = "\n".join([f"- ID: {t['id']} | Title: {t['title']} | Completed: {t['completed']}" for t in tasks_list])
-                    
-                    # Clean format for user display (Hidden IDs)
-                    tasks_context_clean = "\n".join([f"- {t['title']} ({'Completed' if t['completed'] else 'Pending'})" for t in tasks_list])
-            except:
-                tasks_context = "Could not fetch tasks."
-                tasks_context_clean = "Could not fetch tasks."
-
-            prompt = f"""
-            {self.system_prompt}
-
-            USER MESSAGE: "{message}"
-
-            ### USER'S CURRENT TASKS:
-            {tasks_context_clean}
-
-            ### CORE INSTRUCTIONS:
-            1. Respond naturally to greetings, casual chat, and task-related messages.
-            2. Be friendly, concise, and helpful. Use simple, human-like language (English or Roman Urdu).
-            3. **CRITICAL: NEVER SHOW TASK IDs TO THE USER.**
-               - When listing tasks, only show the **Title** and **Status** (Pending/Completed).
-               - Example: "1. Buy Milk (Pending)"
-               - Do NOT output the UUIDs like 'b87587...'.
-
-            4. Use the available tool functions (expressed as intents) ONLY when the user intends to manage tasks.
-            5. **Available Tools**:
-               - `list_tasks(status: "all" | "pending" | "completed")`
-               - `add_task(title: string)`
-               - `complete_task(task_id: string)`
-               - `delete_task(task_id: string)`
-               - `update_task(task_id: string, title: string)`
-
-            6. **OUTPUT FORMAT**: ALWAYS return a VALID JSON object. No markdown, no extra text.
-               {{
-                 "response": "Your natural language response here.",
-                 "tool_calls": [
-                    {{ "name": "tool_name", "arguments": {{ "arg1": "val1" }} }}
-                 ],
-                 "chat_title": "A short 3-5 word title for this chat based on user intent (e.g. 'Shopping List', 'Fixing Bug')"
-               }}
-            """
+    def process_message(self, user_id: str, message: str, conversation_id: str = None) -> Dict[str, Any]:
+        has_task_verb = False
+        try:
+            has_task_verb, is_pure_greeting = self._classify_message(message)
+            result, turn, _ = self._prepare_turn(user_id, message, conversation_id, has_task_verb, is_pure_greeting)
+            if result is not None:
+                return result
 
             try:
-                response = self.model.generate_content(prompt)
-                raw_text = response.text.strip()
+                response, raw_text = self._generate(turn["prompt"], turn["tools"])
+                self._record_usage(turn, raw_text, getattr(response, "usage_metadata", None))
+            except ModelsUnavailableError:
+                # Provider brownout: answer locally right away instead of waiting on a timeout
+                return self._fallback_result(user_id, message, conversation_id, turn["tasks_context_clean"],
+                                             is_pure_greeting, has_task_verb, turn["snapshot"])
             except Exception as e:
                 # Log the error appropriately
-                import logging
                 logging.error(f"Gemini generation error: {e}")
-
+                self._record_usage(turn, "")
                 # Better fallback handling for task-related messages
-                # Parse the message to determine intent when AI fails
-                message_lower = message.lower().strip()
+                return self._fallback_result(user_id, message, conversation_id, turn["tasks_context_clean"],
+                                             is_pure_greeting, has_task_verb, turn["snapshot"])
 
-                # Define fallback responses and tool calls based on message content
-                fallback_response = "Hi 🙂 How can I help you?"
-                fallback_tool_calls = []
-
-                def clean_fallback_title(title):
-                    if not title: return ""
-                    # Remove common filler prefixes iteratively
-                    prev_title = ""
-                    while title != prev_title:
-                        prev_title = title
-                        title = re.sub(r'^(?:to|my|a|the|task|tasks|called|named|as|is|with|label)\s+', '', title, flags=re.IGNORECASE).strip()
-                    return title.strip('"').strip("'").strip().strip('"').strip("'")
-
-                if "add" in message_lower or "create" in message_lower:
-                    match = re.search(r'(?:add|create).*?(?:task|:|called|named)\s+(.+)', message_lower, re.IGNORECASE)
-                    if match:
-                        task_title = clean_fallback_title(match.group(1))
-                        fallback_response = f"Added task: {task_title}"
-                        fallback_tool_calls = [{
-                            "name": "add_task",
-                            "arguments": {
-                                "title": task_title,
-                                "user_id": user_id
-                            }
-                        }]
-                    else:
-                        # If we can't extract title, ask for clarification
-                        fallback_response = "I'd like to help you add a task. Could you please specify the task title?"
-
-                elif re.search(r'\b(?:upd|edi|cha|ren)', message_lower):
-                    # Try to capture various ways users might express editing tasks:
-                    # "change X to Y", "rename X to Y", "update X to Y", "edit X to Y", "change X Y", "edit X Y"
-                    match = re.search(r'(?:upd|edi|cha|ren).*?(?:task|:|called|named)?\s+(.+?)\s+(?:to|as|with)\s+(.+)', message_lower, re.IGNORECASE) or \
-                           re.search(r'(?:upd|edi|cha|ren)\s+(.+?)\s+(?:to|as|with)\s+(.+)', message_lower, re.IGNORECASE) or \
-                           re.search(r'(?:upd|edi|cha|ren).*?(?:task|:|called|named)?\s+(.+?)\s+(?!to|as|with)(\w+.*)', message_lower, re.IGNORECASE) or \
-                           re.search(r'(?:upd|edi|cha|ren)\s+(.+?)\s+(?!to|as|with)(\w+.*)', message_lower, re.IGNORECASE)
-
-                    if match:
-                        task_identifier = clean_fallback_title(match.group(1))
-                        new_title = clean_fallback_title(match.group(2))
-
-                        from ..services.task_service import TaskService
-                        from sqlmodel import Session
-                        from ..database.session import engine
-                        db = Session(engine)
-                        try:
-                            task, status = TaskService.resolve_task(db, user_id, task_identifier)
-                            if status == "FOUND":
-                                fallback_response = f"Theek hai, task '{task.title}' ko '{new_title}' kar diya hai. 🙂"
-                                fallback_tool_calls = [{
-                                    "name": "update_task",
-                                    "arguments": {
-                                        "task_id": task.id,
-                                        "title": new_title,
-                                        "user_id": user_id
-                                    }
-                                }]
-                            elif status == "AMBIGUOUS":
-                                fallback_response = f"Mujhe multiple tasks mile hain '{task_identifier}' matching. Kisko update karun?"
-                            else:
-                                fallback_response = f"Mujhe '{task_identifier}' naam ka koi task nahi mila jise update kar sakun."
-                        finally:
-                            db.close()
-                    else:
-                        # If we detect intent but match fails (e.g. "Edit task market" without "to...")
-                        fallback_response = "Aap kis task ko badalna chahte hain aur uska naya naam kya hoga? (e.g. 'Change milk to buy milk') 🙂"
-
-                elif re.search(r'\b(?:del|rem)', message_lower):
-                    match = re.search(r'(?:del|rem).*?(?:task|:|called|named)?\s+(.+)', message_lower, re.IGNORECASE) or \
-                            re.search(r'(?:del|rem)\s+(?:task\s+)?(.+)', message_lower, re.IGNORECASE)
-
-                    if match:
-                        task_identifier = clean_fallback_title(match.group(1))
-                        from ..services.task_service import TaskService
-                        from sqlmodel import Session
-                        from ..database.session import engine
-                        
-                        db = Session(engine)
-                        try:
-                            task, status = TaskService.resolve_task(db, user_id, task_identifier)
-                            
-                            if status == "FOUND":
-                                fallback_response = f"Theek hai, task '{task.title}' delete kar diya hai. 🙂"
-                                fallback_tool_calls = [{
-                                    "name": "delete_task",
-                                    "arguments": {
-                                        "task_id": task.id,
-                                        "user_id": user_id
-                                    }
-                                }]
-                            elif status == "AMBIGUOUS":
-                                fallback_response = f"Mujhe multiple tasks mile hain '{task_identifier}' ke naam se. Aap please specify karenge?"
-                            else:
-                                fallback_response = f"Maaf kijiyega, mujhe '{task_identifier}' naam ka koi task nahi mila."
-                        finally:
-                            db.close()
-                    else:
-                        fallback_response = "Aap konsa task delete karna chahte hain? 🙂"
-
-                elif re.search(r'\b(?:comp|fin|don|mark.*?c|mark.*?d|as\s+done|mark.*?done)', message_lower):
-                    # Use a non-greedy match and lookahead to avoid capturing trailing filler words like "as done"
-                    # Fixed: More specific pattern to avoid matching words like "market" as "mark"
-                    match = re.search(r'(?:comp|fin|don|mark.*?c|mark.*?d|as\s+done|mark.*?done).*?(?:task|:|called|named)?\s+(.+?)(?:\s+as\s+done|\s+is\s+done|\s+done)?$', message_lower, re.IGNORECASE) or \
-                            re.search(r'(?:comp|fin|don|mark.*?c|mark.*?d|as\s+done|mark.*?done)\s+(.+?)\s*(?:task)?$', message_lower, re.IGNORECASE) or \
-                            re.search(r'mark.*?(?:task)?\s+(.+?)\s+as\s+done', message_lower, re.IGNORECASE)
-
-                    if match:
-                        task_identifier = clean_fallback_title(match.group(1))
-                        from ..services.task_service import TaskService
-                        from sqlmodel import Session
-                        from ..database.session import engine
-                        db = Session(engine)
-                        try:
-                            task, status = TaskService.resolve_task(db, user_id, task_identifier)
-                            if status == "FOUND":
-                                fallback_response = f"Theek hai, task '{task.title}' complete kar diya hai. 🙂"
-                                fallback_tool_calls = [{
-                                    "name": "complete_task",
-                                    "arguments": {
-                                        "task_id": task.id,
-                                        "user_id": user_id
-                                    }
-                                }]
-                            elif status == "AMBIGUOUS":
-                                fallback_response = "Multiple tasks mile hain matching your message. Aap please wazahat karenge?"
-                            else:
-                                fallback_response = f"Mujhe '{task_identifier}' task nahi mila."
-                        finally:
-                            db.close()
+            reply = self._structured_reply(turn, raw_text, function_calls(response) if turn["tools"] else [])
+            result = self._parse_model_output(raw_text, user_id, conversation_id, has_task_verb, parsed=reply,
+                                              aliases=turn["aliases"])
+            return self._finish_model_turn(turn, result)
+        except Exception as e:
+            logging.error(f"Error in process_message: {str(e)}")
+            return self._error_result(message, conversation_id, has_task_verb)
+
+    def stream_message(self, user_id: str, message: str, conversation_id: str = None) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of process_message.
+
+        Yields a {"type": "tasks", "snapshot": ...} event with the TaskSnapshot the
+        reply is built from (when the tasks were read; tool calls should be
+        resolved against it), {"type": "token", "text": ...} events with pieces of the reply text
+        as the model produces them and a {"type": "tool_call", "call": ...} event
+        for each tool call as soon as the model has finished writing it, then a
+        single {"type": "result", "result": ...} event carrying the same dict
+        process_message would have returned. The result's tool_calls start with
+        the calls already sent as events, in the same order.
+        """
+        has_task_verb = False
+        try:
+            has_task_verb, is_pure_greeting = self._classify_message(message)
+            result, turn, snapshot = self._prepare_turn(user_id, message, conversation_id, has_task_verb,
+                                                        is_pure_greeting)
+            if snapshot is not None:
+                yield {"type": "tasks", "snapshot": snapshot}
+            if result is not None:
+                yield {"type": "token", "text": result["response"]}
+                yield {"type": "result", "result": result}
+                return
+
+            extractor = ResponseTextExtractor()
+            parser = JSONReplyParser()
+            chunks, streamed, calls, native = [], [], [], []
+            usage = None
+            # In function-calling mode the text is plain unless the model wrote the JSON reply anyway
+            json_reply = True if turn["mode"] == "json" else None
+            try:
+                for chunk in self._generate_stream(turn["prompt"], turn["tools"]):
+                    text = response_text(chunk)
+                    chunks.append(text)
+                    # The final chunk carries the usage totals
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    completed = function_calls(chunk) if turn["tools"] else []
+                    native.extend(completed)
+                    if json_reply is None and text.strip():
+                        json_reply = text.lstrip()[0] in "{`"
+                    if json_reply:
+                        delta = extractor.feed(text)
+                        completed = completed + parser.feed(text)
                     else:
-                        fallback_response = "Aapne konsa kaam khatam kar liya hai? 🙂"
-
-                elif "list" in message_lower or "show" in message_lower or "all" in message_lower:
-                    fallback_response = f"Here are your tasks:\n{tasks_context_clean}"
-                    fallback_tool_calls = [{
-                        "name": "list_tasks",
-                        "arguments": {
-                            "status": "all",
-                            "user_id": user_id
-                        }
-                    }]
-
+                        delta = text
+                    if delta:
+                        streamed.append(delta)
+                        yield {"type": "token", "text": delta}
+                    for call in completed:
+                        if not isinstance(call.get("arguments", {}), dict):
+                            continue  # undecodable native arguments; counted as a parse failure
+                        call = self._normalize_tool_call(call, user_id, turn["aliases"])
+                        if call is not None:
+                            calls.append(call)
+                            yield {"type": "tool_call", "call": call}
+                raw_text = "".join(chunks).strip()
+                self._record_usage(turn, raw_text, usage)
+            except ModelsUnavailableError:
+                result = self._fallback_result(user_id, message, conversation_id, turn["tasks_context_clean"],
+                                               is_pure_greeting, has_task_verb, turn["snapshot"])
+            except Exception as e:
+                logging.error(f"Gemini streaming error: {e}")
+                self._record_usage(turn, "".join(chunks), usage)
+                if streamed or calls:
+                    # Part of the reply already reached the client, or tools are already running; keep what we have
+                    partial = {"response": "".join(streamed), "tool_calls": []}
+                    result = self._parse_model_output("".join(chunks).strip(), user_id, conversation_id,
+                                                      has_task_verb, parsed=partial, aliases=turn["aliases"])
                 else:
-                    # Pure greeting or other message
-                    if is_pure_greeting and not has_task_verb:
-                        fallback_response = "Hi 🙂 How can I help you?"
-                    else:
-                        fallback_response = "I see you're asking about a task. Could you please clarify what you'd like to do? 🙂"
-
-                # Fallback title generation from message text
-                fallback_title = " ".join(message.split()[:4])
-                if len(fallback_title) > 30:
-                    fallback_title = fallback_title[:30] + "..."
-
-                return {
-                    "response": fallback_response,
-                    "tool_calls": fallback_tool_calls,
-                    "conversation_id": conversation_id,
-                    "chat_title": fallback_title
-                }
-                
-            # Robust JSON extraction
-            import json
-            
-            # Clean text from potential markdown blocks
-            clean_text = raw_text
-            if "```json" in clean_text:
-                clean_text = clean_text.split("```json")[-1].split("```")[0].strip()
-            elif "```" in clean_text:
-                clean_text = clean_text.split("```")[-1].split("```")[0].strip()
-
-            json_match = re.search(r'\{.*\}', clean_text, re.DOTALL)
-            if json_match:
-                try:
-                    extracted_json = json_match.group(0)
-                    result = json.loads(extracted_json)
-                except Exception as e:
-                    import logging
-                    logging.error(f"JSON parse error: {str(e)}")
-                    result = {"response": raw_text, "tool_calls": []}
+                    result = self._fallback_result(user_id, message, conversation_id, turn["tasks_context_clean"],
+                                                   is_pure_greeting, has_task_verb, turn["snapshot"])
             else:
-                result = {"response": raw_text, "tool_calls": []}
-            
-            # Filter and inject user_id into tool calls
-            processed_tool_calls = []
-            for call in result.get("tool_calls", []):
-                if call.get("name") in ["add_task", "delete_task", "update_task", "complete_task", "list_tasks"]:
-                    if "arguments" not in call:
-                        call["arguments"] = {}
-                    call["arguments"]["user_id"] = user_id
-                    processed_tool_calls.append(call)
-            
-            response_text = result.get("response")
-            if not response_text or (isinstance(response_text, str) and not response_text.strip()):
-                response_text = raw_text if not json_match else "I've processed your request."
-            
-            # Final check: if AI returned a generic greeting but task verb was present, override or warn?
-            # For now, trust the AI if it actually replied, but if it failed to return JSON, result["response"] might be empty.
-            
-            if has_task_verb and response_text == "Hi 🙂 How can I help you?":
-                 response_text = "I see you're asking about a task. Could you please clarify what you'd like to do? 🙂"
-
-            return {
-                "response": response_text,
-                "tool_calls": processed_tool_calls,
-                "conversation_id": conversation_id,
-                "chat_title": result.get("chat_title")
-            }
+                reply = self._structured_reply(turn, raw_text, native, parsed=parser.value)
+                result = self._parse_model_output(raw_text, user_id, conversation_id, has_task_verb, parsed=reply,
+                                                  aliases=turn["aliases"])
+                result = self._finish_model_turn(turn, result)
+            if calls:
+                # Calls sent as events come first and exactly once
+                result["tool_calls"] = calls + result["tool_calls"][len(calls):]
+
+            if not streamed:
+                # Output was not the expected JSON (or we fell back): send the reply in one piece
+                yield {"type": "token", "text": result["response"]}
         except Exception as e:
-            import logging
-            logging.error(f"Error in process_message: {str(e)}")
-            fallback_msg = "Hi 🙂 How can I help you?"
-            if 'has_task_verb' in locals() and has_task_verb:
-                fallback_msg = "I see you're asking about a task. Could you please clarify what you'd like to do? 🙂"
-            # Fallback title generation from message text
-            fallback_title = " ".join(message.split()[:4])
-            if len(fallback_title) > 30:
-                fallback_title = fallback_title[:30] + "..."
+            logging.error(f"Error in stream_message: {str(e)}")
+            result = self._error_result(message, conversation_id, has_task_verb)
+            yield {"type": "token", "text": result["response"]}
 
-            return {
-                "response": fallback_msg,
-                "tool_calls": [],
-                "conversation_id": conversation_id,
-                "chat_title": fallback_title
-            }
+        yield {"type": "result", "result": result}
 
-    def generate_conversation_title(self, message: str) -> str:
+    def generate_conversation_title(self, message: str, use_model: bool = False) -> str:
+        if not use_model:
+            return generate_title(message)
         try:
             prompt = f"Generate a very short, concise title (MAX 4 words) for a chat that starts with this message: \"{message}\". Return ONLY the title text, no quotes."
             response = self.model.generate_content(prompt)
             if response and response.text:
                 title = response.text.strip().replace('"', '')
                 return title[:100]
-            return "New Task Chat"
+            return generate_title(message)
         except Exception as e:
             import logging
             logging.error(f"Error generating title: {str(e)}")
-            return "New Chat"
+            return generate_title(message)
@@ -0,0 +1,184 @@
+"""Local token estimation, prompt budget enforcement and per-turn token metrics"""
+
+import math
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Hard cap for the whole prompt sent to the model
+DEFAULT_PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "4000"))
+# Number of recent turns kept for the metrics summary
+DEFAULT_METRICS_WINDOW = int(os.getenv("TOKEN_METRICS_WINDOW", "500"))
+
+_PIECE = re.compile(r"[A-Za-z]+|\d+|\s+|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Offline approximation of a SentencePiece/BPE token count: roughly one
+    token per 4 letters of a word, one per 3 digits, one per punctuation mark
+    and one per non-ASCII character (emoji, Urdu script). Whitespace is free.
+    Close enough to budget prompts without a count_tokens network call.
+    """
+    if not text:
+        return 0
+    count = 0
+    for piece in _PIECE.findall(text):
+        first = piece[0]
+        if first.isspace():
+            continue
+        if first.isascii() and first.isalpha():
+            count += math.ceil(len(piece) / 4)
+        elif first.isdigit():
+            count += math.ceil(len(piece) / 3)
+        else:
+            count += 1
+    return count
+
+
+@dataclass
+class PromptSection:
+    """
+    A trimmable part of the prompt. Sections with a lower `priority` are
+    trimmed first. `shrink(tokens)` re-renders the section within a token
+    allowance; without it the section is dropped entirely.
+    """
+    name: str
+    text: str
+    priority: int
+    shrink: Optional[Callable[[int], str]] = None
+
+
+class PromptBudget:
+    """Keeps a rendered prompt under `max_tokens` by trimming sections in priority order."""
+
+    def __init__(self, max_tokens: int = DEFAULT_PROMPT_TOKEN_BUDGET):
+        self.max_tokens = max_tokens
+
+    def fit(self, render: Callable[[Dict[str, str]], str], sections: List[PromptSection]) -> Tuple[str, Dict[str, Any]]:
+        """
+        `render` builds the prompt from {section name: text}. Returns (prompt, report)
+        where report is {"prompt_tokens", "budget", "trimmed", "sections"}; "sections"
+        holds the final text of every section.
+        """
+        texts = {s.name: s.text for s in sections}
+        prompt = render(texts)
+        tokens = estimate_tokens(prompt)
+        trimmed = []
+        for section in sorted(sections, key=lambda s: s.priority):
+            if tokens <= self.max_tokens:
+                break
+            allowance = max(0, estimate_tokens(texts[section.name]) - (tokens - self.max_tokens))
+            texts[section.name] = section.shrink(allowance) if section.shrink else ""
+            trimmed.append(section.name)
+            prompt = render(texts)
+            tokens = estimate_tokens(prompt)
+        return prompt, {"prompt_tokens": tokens, "budget": self.max_tokens, "trimmed": trimmed, "sections": texts}
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """Cut `text` so that it fits in about `tokens` tokens, marking the cut."""
+    if estimate_tokens(text) <= tokens:
+        return text
+    cut = text[:max(0, tokens) * 4]
+    while cut and estimate_tokens(cut) > tokens:
+        cut = cut[:int(len(cut) * 0.9)]
+    return cut.rstrip() + " …"
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+class TokenMetrics:
+    """Rolling per-turn record of prompt/completion tokens, trimming and model latency."""
+
+    def __init__(self, window: int = DEFAULT_METRICS_WINDOW):
+        self._turns: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.total_turns = 0
+        self.trimmed_turns = 0
+
+    def record(self, user_id: str, conversation_id: Optional[str], prompt_tokens: int, completion_tokens: int,
+               trimmed: List[str], duration_ms: float) -> Dict[str, Any]:
+        turn = {
+            "user_id": user_id,
+            "conversation_id": conversation_id,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "trimmed": list(trimmed),
+            "duration_ms": round(duration_ms, 1)
+        }
+        with self._lock:
+            self._turns.append(turn)
+            self.total_turns += 1
+            if trimmed:
+                self.trimmed_turns += 1
+        return turn
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            turns = list(self._turns)
+
+        def summary(key):
+            values = [t[key] for t in turns]
+            return {
+                "mean": round(sum(values) / len(values), 1) if values else 0,
+                "p50": _percentile(values, 0.5),
+                "p99": _percentile(values, 0.99),
+                "max": max(values) if values else 0
+            }
+
+        return {
+            "turns": self.total_turns,
+            "trimmed_turns": self.trimmed_turns,
+            "prompt_tokens": summary("prompt_tokens"),
+            "completion_tokens": summary("completion_tokens"),
+            "duration_ms": summary("duration_ms"),
+            # Where to look first when chasing slow conversations
+            "slowest": sorted(turns, key=lambda t: t["duration_ms"], reverse=True)[:5]
+        }
+
+
+class ReplyModeMetrics:
+    """
+    Per reply mode ("json": tools and output format spelled out in the prompt,
+    "function": tools declared to the provider) prompt size and how often the
+    model's reply could not be parsed into a structured result.
+    """
+
+    MODES = ("json", "function")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._modes = {mode: {"turns": 0, "parse_failures": 0, "prompt_tokens": 0} for mode in self.MODES}
+
+    def record(self, mode: str, prompt_tokens: int, parse_failed: bool) -> None:
+        with self._lock:
+            entry = self._modes[mode]
+            entry["turns"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["parse_failures"] += int(parse_failed)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            modes = {mode: dict(entry) for mode, entry in self._modes.items()}
+        report = {}
+        for mode, entry in modes.items():
+            turns = entry["turns"]
+            report[mode] = {
+                "turns": turns,
+                "parse_failures": entry["parse_failures"],
+                "parse_failure_rate": round(entry["parse_failures"] / turns, 3) if turns else 0.0,
+                "mean_prompt_tokens": round(entry["prompt_tokens"] / turns, 1) if turns else 0
+            }
+        if report["json"]["turns"] and report["function"]["turns"]:
+            report["prompt_token_savings"] = round(
+                report["json"]["mean_prompt_tokens"] - report["function"]["mean_prompt_tokens"], 1)
+        return report
@@ -0,0 +1,95 @@
+"""Per-stage timings of chat turns, separating the critical path from work overlapped with it"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class TurnTimer:
+    """
+    Stage timings of one chat turn. Stages run with `stage(name)` are on the
+    turn's critical path. `background(name, awaitable)` and
+    `background_stage(name)` time work that overlaps with them (saving the
+    user's message while the model generates); it only costs the turn time where a critical stage has
+    to wait for it, which is timed as a stage of its own.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self._clock = clock
+        self._started = clock()
+        self.stages: Dict[str, float] = {}
+        self.background_stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = self._clock()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (self._clock() - started) * 1000
+
+    @contextmanager
+    def background_stage(self, name: str):
+        started = self._clock()
+        try:
+            yield
+        finally:
+            elapsed = (self._clock() - started) * 1000
+            self.background_stages[name] = self.background_stages.get(name, 0.0) + elapsed
+
+    async def background(self, name: str, awaitable: Awaitable) -> Any:
+        with self.background_stage(name):
+            return await awaitable
+
+    def report(self) -> Dict[str, Any]:
+        """{"total_ms", "critical_ms", "stages": {name: ms}, "background": {name: ms}}"""
+        return {
+            "total_ms": round((self._clock() - self._started) * 1000, 1),
+            "critical_ms": round(sum(self.stages.values()), 1),
+            "stages": {name: round(ms, 1) for name, ms in self.stages.items()},
+            "background": {name: round(ms, 1) for name, ms in self.background_stages.items()}
+        }
+
+
+class TurnTimings:
+    """Running averages of the turn reports, for the health endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self._total = 0.0
+        self._critical = 0.0
+        self._stages: Dict[str, float] = {}
+        self._background: Dict[str, float] = {}
+
+    def record(self, user_id: str, report: Dict[str, Any]) -> None:
+        with self._lock:
+            self.turns += 1
+            self._total += report["total_ms"]
+            self._critical += report["critical_ms"]
+            for name, ms in report["stages"].items():
+                self._stages[name] = self._stages.get(name, 0.0) + ms
+            for name, ms in report["background"].items():
+                self._background[name] = self._background.get(name, 0.0) + ms
+        stages = ", ".join(f"{name}={ms:.0f}ms" for name, ms in report["stages"].items())
+        background = ", ".join(f"{name}={ms:.0f}ms" for name, ms in report["background"].items())
+        logger.info(f"TURN_TIMINGS - User: {user_id}, Total: {report['total_ms']:.0f}ms, "
+                    f"Stages: {stages or 'None'}, Overlapped: {background or 'None'}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            turns = self.turns or 1
+            return {
+                "turns": self.turns,
+                "avg_total_ms": round(self._total / turns, 1),
+                "avg_critical_ms": round(self._critical / turns, 1),
+                "avg_stages_ms": {name: round(ms / turns, 1) for name, ms in self._stages.items()},
+                "avg_background_ms": {name: round(ms / turns, 1) for name, ms in self._background.items()}
+            }
+
+
+turn_timings = TurnTimings()
@@ -1,17 +1,25 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-from uuid import UUID
+from typing import Optional, List, Dict, Any, Awaitable, Tuple
+from uuid import UUID, uuid4
 from datetime import datetime
 from ...agents.todo_agent import TodoAgent
-from ...tools.task_tools import TaskTools
+from ...agents.registry import get_agent
+from ...agents.clarifications import ClarificationStore
+from ...agents.mailbox import mailbox
+from ...agents.schedule_extractor import apply_schedule
+from ...agents.turn_timings import TurnTimer, turn_timings
+from ...tools.tool_engine import tool_engine
+from ...services.task_service import TaskSnapshot
 from ...api.deps import verify_user_access
 from ...database.session import get_session
-from ...utils.validation import validate_task_title
 from ...utils.logging import log_agent_interaction, log_error
 from ...exceptions import ValidationErrorException, DatabaseOperationException
 from sqlmodel import Session, select, desc
+import asyncio
 import logging
+import json
 import os
 
 # Setup logger
@@ -54,238 +62,294 @@ class MessageRead(BaseModel):
 # Removed local get_db to use src.database.session.get_session
 
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(
-    user_id: str,
-    request: ChatRequest,
-    payload: dict = Depends(verify_user_access),
-    session: Session = Depends(get_session)
-):
+def _resolve_conversation(session: Session, user_id: str, request: ChatRequest):
     """
-    Main chat endpoint that processes natural language and returns AI response
-    along with any tool calls that need to be executed.
+    Validate the chat request and load the conversation it continues.
+    Returns None when a new conversation has to be created.
     """
-    try:
-        # Validate input
-        if not request.message or not request.message.strip():
-            raise ValidationErrorException("Message cannot be empty")
-
-        # Get database URL
-        database_url = os.getenv("DATABASE_URL")
-        if not database_url:
-            raise HTTPException(status_code=500, detail="DATABASE_URL not configured")
-
-        if request.conversation_id:
-            try:
-                conv_uuid = UUID(request.conversation_id)
-            except ValueError:
-                # Handle non-UUID temp IDs
-                conv_uuid = None
-        else:
+    # Validate input
+    if not request.message or not request.message.strip():
+        raise ValidationErrorException("Message cannot be empty")
+
+    if request.conversation_id:
+        try:
+            conv_uuid = UUID(request.conversation_id)
+        except ValueError:
+            # Handle non-UUID temp IDs
             conv_uuid = None
+    else:
+        conv_uuid = None
+
+    from ...models.conversation import Conversation
+
+    if not conv_uuid:
+        return None
+    conversation = session.get(Conversation, conv_uuid)
+    if not conversation or conversation.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
+
+
+def _open_turn(bind, user_id: str, request: ChatRequest) -> Tuple[UUID, bool]:
+    """
+    Validate the chat request and pick the conversation the turn belongs to,
+    on a session of its own (the routes run it on a worker thread).
+    Returns (conversation id, is_new); a new conversation gets its id here and
+    is only written by _save_user_message.
+    """
+    with Session(bind) as session:
+        conversation = _resolve_conversation(session, user_id, request)
+        if conversation is None:
+            return uuid4(), True
+        return conversation.id, False
 
-        from ...models.conversation import Conversation
-        from ...models.message import Message as DBMessage
 
-        # Ensure conversation exists or create one if requested/needed
-        if conv_uuid:
-            conversation = session.get(Conversation, conv_uuid)
-            if not conversation or conversation.user_id != user_id:
-                raise HTTPException(status_code=404, detail="Conversation not found")
-        else:
-            conversation = Conversation(user_id=user_id)
-            session.add(conversation)
-            session.commit()
-            session.refresh(conversation)
-            conv_uuid = conversation.id
+def _save_user_message(bind, user_id: str, conv_uuid: UUID, is_new: bool, message: str) -> None:
+    """
+    Create the conversation if it is new and save the user's message, in one
+    commit on a session of its own (it runs alongside the request's session).
+    """
+    from ...models.conversation import Conversation
+    from ...models.message import Message as DBMessage
 
-        # Initialize the agent
-        agent = TodoAgent(database_url=database_url)
+    with Session(bind) as session:
+        if is_new:
+            session.add(Conversation(id=conv_uuid, user_id=user_id))
+            session.flush()
 
         # Save user message
         user_msg = DBMessage(
             user_id=user_id,
             conversation_id=conv_uuid,
             role="user",
-            content=request.message
+            content=message
         )
         session.add(user_msg)
         session.commit()
 
-        # Process the user message with the agent
-        result = agent.process_message(
-            user_id=user_id,
-            message=request.message,
-            conversation_id=str(conv_uuid)
-        )
 
-        # Update conversation title if new and agent provided one
-        if not conversation.title and result.get("chat_title"):
-            conversation.title = result.get("chat_title")
-            session.add(conversation)
-            session.commit()
-
-        # EXECUTE TOOLS FIRST
-        from ...services.task_service import TaskService
-        from ...models.task import TaskUpdate
-
-        execution_errors = []
-
-        for tool_call in result.get("tool_calls", []):
-            name = tool_call.get("name")
-            args = tool_call.get("arguments", {})
-
-            try:
-                if name == "add_task":
-                    # Validate task title before creating
-                    title = args.get("title")
-                    is_valid, msg = validate_task_title(title) if title else (False, "Task title is required")
-                    if not is_valid:
-                        error_msg = f"add_task failed: {msg}"
-                        logger.warning(error_msg)
-                        execution_errors.append(error_msg)
-                        continue
-
-                    TaskService.create_task(
-                        session=session,
-                        user_id=user_id,
-                        title=title,
-                        description=args.get("description")
-                    )
-                elif name == "delete_task":
-                    task_id = args.get("task_id") or args.get("title")
-                    if not task_id:
-                        error_msg = "delete_task failed: Task ID or title is required"
-                        logger.warning(error_msg)
-                        execution_errors.append(error_msg)
-                        continue
-
-                    task, status = TaskService.resolve_task(session, user_id, task_id)
-                    if status == "FOUND":
-                        TaskService.delete_task(
-                            session=session,
-                            user_id=user_id,
-                            task_id=task.id
-                        )
-                    else:
-                        error_msg = f"delete_task failed: Task '{task_id}' not found ({status})"
-                        logger.warning(error_msg)
-                        execution_errors.append(error_msg)
-
-                elif name == "complete_task":
-                    task_id = args.get("task_id") or args.get("title")
-                    if not task_id:
-                        error_msg = "complete_task failed: Task ID or title is required"
-                        logger.warning(error_msg)
-                        execution_errors.append(error_msg)
-                        continue
-
-                    task, status = TaskService.resolve_task(session, user_id, task_id)
-                    if status == "FOUND":
-                        TaskService.complete_task(
-                            session=session,
-                            user_id=user_id,
-                            task_id=task.id
-                        )
-                    else:
-                         error_msg = f"complete_task failed: Task '{task_id}' not found ({status})"
-                         logger.warning(error_msg)
-                         execution_errors.append(error_msg)
-
-                elif name == "update_task":
-                    task_id = args.get("task_id") or args.get("old_title") or args.get("title")
-                    new_title = args.get("new_title") or args.get("title")
-
-                    if not task_id:
-                        error_msg = "update_task failed: Task ID or title is required"
-                        logger.warning(error_msg)
-                        execution_errors.append(error_msg)
-                        continue
-
-                    if not new_title:
-                        error_msg = "update_task failed: New title is required"
-                        logger.warning(error_msg)
-                        execution_errors.append(error_msg)
-                        continue
-
-                    # Validate new title
-                    is_valid, msg = validate_task_title(new_title)
-                    if not is_valid:
-                        error_msg = f"update_task failed: {msg}"
-                        logger.warning(error_msg)
-                        execution_errors.append(error_msg)
-                        continue
-
-                    task, status = TaskService.resolve_task(session, user_id, task_id)
-                    if status == "FOUND":
-                        # Construct update payload dynamically to avoid resetting fields to None
-                        update_payload = {}
-                        if new_title:
-                            update_payload["title"] = new_title
-                        if "description" in args:
-                            update_payload["description"] = args["description"]
-                        if "completed" in args:
-                            update_payload["completed"] = args["completed"]
-
-                        task_update = TaskUpdate(**update_payload)
-
-                        TaskService.update_task(
-                            session=session,
-                            user_id=user_id,
-                            task_id=task.id,
-                            task_update=task_update
-                        )
-                    else:
-                        error_msg = f"update_task failed: Task '{task_id}' not found ({status})"
-                        logger.warning(error_msg)
-                        execution_errors.append(error_msg)
-
-                elif name == "list_tasks":
-                    # This tool call is mainly a signal for the UI to refresh or for the agent's context
-                    # in the NEXT turn. For now, it doesn't return data to the user in this response
-                    # because the response text was already generated.
-                    TaskService.get_user_tasks(session=session, user_id=user_id, status=args.get("status", "all"))
-
-                logger.info(f"Successfully executed tool: {name} for user {user_id}")
-            except Exception as tool_err:
-                error_msg = f"Error executing {name}: {str(tool_err)}"
-                logger.error(error_msg)
-                execution_errors.append(error_msg)
-
-        # Explicitly commit all changes made by tools
-        session.commit()
+async def _run_agent_turn(agent: TodoAgent, session: Session, user_id: str, conv_uuid: UUID, message: str,
+                          state: Dict[str, Any], timer: TurnTimer = None):
+    """
+    Stream the agent's turn and yield the reply text as it arrives. Tool
+    calls the model finishes writing mid-stream are buffered, with due dates
+    and priorities in `message` attached (see apply_schedule). The adds the
+    reply starts with (phase 0, which no other call has to run before) are
+    executed as one batch on a worker thread as soon as the model moves on to
+    another call or to the reply text; _finish_turn runs the rest as one
+    phased batch. Fills `state` with the final result, the snapshot the agent
+    built the reply from, the buffered calls and the early batch ("early",
+    a future of its results, or None).
+    """
+    timer = timer or TurnTimer()
+    state.update({"result": None, "snapshot": None, "buffered": [], "early": None})
+
+    closed = False
+
+    def run_early():
+        # Only the leading run of adds, once the first other call or the reply text ends it
+        nonlocal closed
+        if not closed and state["buffered"]:
+            calls = list(state["buffered"])
+            state["early"] = asyncio.ensure_future(timer.background("early_tools", asyncio.to_thread(
+                _execute_in_own_session, session.get_bind(), user_id, calls, state["snapshot"])))
+        closed = True
+
+    events = agent.astream_message(user_id, message, str(conv_uuid)).__aiter__()
+    # Task and history reads plus prompt building, up to the agent's first event
+    with timer.stage("context"):
+        event = await anext(events, None)
+    with timer.stage("generation"):
+        while event is not None:
+            if event["type"] == "token":
+                run_early()
+                yield event["text"]
+            elif event["type"] == "tasks":
+                state["snapshot"] = event["snapshot"]
+            elif event["type"] == "tool_call":
+                if tool_engine.phase(event["call"]["name"]) != 0:
+                    run_early()
+                state["buffered"].append(apply_schedule([event["call"]], message)[0])
+            else:
+                state["result"] = event["result"]
+            event = await anext(events, None)
+
+
+def _execute_in_own_session(bind, user_id: str, calls: List[Dict[str, Any]],
+                            snapshot: TaskSnapshot = None) -> List[Dict[str, Any]]:
+    """tool_engine.execute on a session of its own, for running on a worker thread."""
+    with Session(bind) as session:
+        return tool_engine.execute(session, user_id, calls, snapshot)
+
+
+def _pending_arguments(call: Dict[str, Any]) -> Dict[str, Any]:
+    """The arguments a clarified call keeps once its task is picked (everything but the task reference)."""
+    arguments = call.get("arguments") or {}
+    if call.get("name") != "update_task":
+        return {}
+    # "title" is the new title only when the task was named by task_id/old_title (see ToolEngine)
+    new_title = arguments.get("new_title") or \
+        (arguments.get("title") if arguments.get("task_id") or arguments.get("old_title") else None)
+    kept = {"title": new_title} if new_title else {}
+    kept.update({k: arguments[k] for k in ("due_date", "priority") if arguments.get(k)})
+    return kept
+
+
+def _finish_turn(session: Session, user_id: str, conv_uuid: UUID, message: str, result: Dict[str, Any],
+                 buffered: List[Dict[str, Any]] = None, snapshot: TaskSnapshot = None,
+                 clarifications: ClarificationStore = None, executed: List[Dict[str, Any]] = None) -> str:
+    """
+    Apply the agent's result: execute tool calls, then set the conversation
+    title and save the assistant message in one commit, and log the
+    interaction. Returns the final reply text. Blocking; the async routes
+    run it on a worker thread (see _finish_turn_in_own_session).
+    `buffered` are the calls streamed before the result (see _run_agent_turn),
+    which the result's tool_calls start with, and `executed` the results of
+    the first of them, already run mid-stream; `snapshot` is the turn's task
+    snapshot the calls are resolved against. A call naming several tasks is
+    turned into a question in `clarifications`, so the user's answer ("the
+    second one") is resolved locally on the next message.
+    """
+    from ...models.conversation import Conversation
+    from ...models.message import Message as DBMessage
 
-        # Update response text if there were errors
-        final_response_text = result.get("response", "I processed your request.")
-        if execution_errors:
-            final_response_text += "\n\n(Note: Some actions encountered errors: " + "; ".join(execution_errors) + ")"
+    # EXECUTE TOOLS FIRST as one batch: the calls streamed before the result, then the rest,
+    # less those the early batch already ran.
+    # Due dates and priorities are read here rather than in the agent, so cached replies never carry
+    # a date resolved on another day; streamed calls get them again for the reply's tool_calls.
+    buffered = list(buffered or [])
+    executed = list(executed or [])
+    apply_schedule(result.get("tool_calls", []), message)
+    calls = buffered + result.get("tool_calls", [])[len(buffered):]
+    execution_errors = []
+    question = None
+    if calls:
+        results = executed
+        if calls[len(executed):]:
+            results = executed + tool_engine.execute(session, user_id, calls[len(executed):], snapshot)
+        for call, outcome in zip(calls, results):
+            ambiguous = outcome.get("ambiguous")
+            if question is None and clarifications is not None and ambiguous and len(ambiguous["candidates"]) > 1:
+                # Only one question per conversation can be pending
+                question = clarifications.ask(user_id, str(conv_uuid), call["name"], ambiguous["target"],
+                                              _pending_arguments(call), ambiguous["candidates"])
+            elif outcome["error"]:
+                execution_errors.append(outcome["error"])
+
+    # Update response text if there were errors
+    final_response_text = result.get("response", "I processed your request.")
+    if question:
+        final_response_text += "\n\n" + question
+    if execution_errors:
+        final_response_text += "\n\n(Note: Some actions encountered errors: " + "; ".join(execution_errors) + ")"
+
+    # Update conversation title if new and agent provided one
+    conversation = session.get(Conversation, conv_uuid)
+    if conversation and not conversation.title and result.get("chat_title"):
+        conversation.title = result.get("chat_title")
+        session.add(conversation)
+
+    # Save assistant response AFTER tools are executed
+    assistant_msg = DBMessage(
+        user_id=user_id,
+        conversation_id=conv_uuid,
+        role="assistant",
+        content=final_response_text
+    )
+    session.add(assistant_msg)
+    session.commit()
 
-        # Save assistant response AFTER tools are executed
-        assistant_msg = DBMessage(
-            user_id=user_id,
-            conversation_id=conv_uuid,
-            role="assistant",
-            content=final_response_text
-        )
-        session.add(assistant_msg)
-        session.commit()
+    # Log the agent interaction
+    log_agent_interaction(
+        logger=logger,
+        user_id=user_id,
+        conversation_id=str(conv_uuid),
+        input_text=message,
+        response_text=final_response_text,
+        tools_used=[tc.get("name") for tc in result.get("tool_calls", [])]
+    )
 
-        # Log the agent interaction
-        log_agent_interaction(
-            logger=logger,
-            user_id=user_id,
-            conversation_id=str(conv_uuid),
-            input_text=request.message,
-            response_text=final_response_text,
-            tools_used=[tc.get("name") for tc in result.get("tool_calls", [])]
-        )
+    return final_response_text
+
+
+def _finish_turn_in_own_session(bind, *args) -> str:
+    """_finish_turn on a session of its own, for running on a worker thread (Sessions are not thread-safe)."""
+    with Session(bind) as session:
+        return _finish_turn(session, *args)
+
+
+async def _run_turn(agent: TodoAgent, session: Session, user_id: str, request: ChatRequest,
+                    state: Dict[str, Any], opened: Tuple[UUID, bool] = None):
+    """
+    One chat turn, yielding the reply text as it arrives and leaving the
+    response payload in state["payload"]. `opened` is the _open_turn result
+    when the caller already validated the request.
+
+    Only the agent (context reads and the model call) is on the critical path:
+    the conversation and user message are saved on a worker thread while the
+    agent generates, and the turn waits for that write only before executing
+    its tool calls and saving the reply (also on a worker thread), which needs
+    the conversation row. Stage timings are recorded in `turn_timings`.
+    """
+    timer = TurnTimer()
+    with timer.stage("validate"):
+        conv_uuid, is_new = opened or await asyncio.to_thread(_open_turn, session.get_bind(), user_id, request)
+    persisted = asyncio.ensure_future(timer.background("persist", asyncio.to_thread(
+        _save_user_message, session.get_bind(), user_id, conv_uuid, is_new, request.message)))
+    try:
+        async for text in _run_agent_turn(agent, session, user_id, conv_uuid, request.message, state, timer):
+            yield text
+        result = state["result"]
+
+        with timer.stage("persist_wait"):
+            await persisted
+        executed = None
+        if state["early"] is not None:
+            with timer.stage("early_tools_wait"):
+                executed = await state["early"]
+        with timer.stage("finish"):
+            final_response_text = await asyncio.to_thread(
+                _finish_turn_in_own_session, session.get_bind(), user_id, conv_uuid, request.message, result,
+                state["buffered"], state["snapshot"], agent.clarifications, executed)
+    finally:
+        pending = [task for task in (persisted, state.get("early")) if task is not None and not task.done()]
+        if pending:
+            # The agent failed: let the writes finish rather than abandon them mid-commit
+            await asyncio.wait(pending)
+
+    turn_timings.record(user_id, timer.report())
+    state["payload"] = {
+        "conversation_id": str(conv_uuid),
+        "response": final_response_text,
+        "tool_calls": result.get("tool_calls", [])
+    }
+
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(
+    user_id: str,
+    request: ChatRequest,
+    payload: dict = Depends(verify_user_access),
+    session: Session = Depends(get_session),
+    agent: TodoAgent = Depends(get_agent)
+):
+    """
+    Main chat endpoint that processes natural language and returns AI response
+    along with any tool calls that need to be executed.
+    """
+    async def turn():
+        # Process the user message with the agent (off the event loop), then its tool calls as one batch
+        state = {}
+        async for _ in _run_turn(agent, session, user_id, request, state):
+            pass
+        return state["payload"]
+
+    try:
+        # One user's turns run in order; a duplicate of an in-flight message shares its result
+        payload = await mailbox.run(user_id, request.conversation_id, request.message, turn)
 
         # Format the response
-        response = ChatResponse(
-            conversation_id=str(conv_uuid),
-            response=final_response_text,
-            tool_calls=result.get("tool_calls", [])
-        )
+        response = ChatResponse(**payload)
 
         return response
     except ValidationErrorException as ve:
@@ -297,6 +361,74 @@ async def chat_endpoint(
         log_error(logger, e, "chat_endpoint", user_id)
         raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
 
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(
+    user_id: str,
+    request: ChatRequest,
+    payload: dict = Depends(verify_user_access),
+    session: Session = Depends(get_session),
+    agent: TodoAgent = Depends(get_agent)
+):
+    """
+    Streaming variant of the chat endpoint using Server-Sent Events.
+
+    Emits `token` events with pieces of the reply as the model writes it, then a
+    single `done` event with the final response, executed tool calls and the
+    conversation id (or an `error` event). The assistant message is saved once
+    the stream completes.
+    """
+    try:
+        # Reject bad requests with a status code before the stream starts
+        opened = await asyncio.to_thread(_open_turn, session.get_bind(), user_id, request)
+    except ValidationErrorException as ve:
+        logger.error(f"Validation error in chat stream endpoint: {ve.message}")
+        raise HTTPException(status_code=ve.status_code, detail=ve.message)
+    except HTTPException:
+        raise
+    except Exception as e:
+        log_error(logger, e, "chat_stream_endpoint", user_id)
+        raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
+
+    async def event_stream():
+        # Everything that claims the mailbox happens inside the generator, so a
+        # stream that never starts cannot leave a turn or a user lock behind
+        key = mailbox.key(user_id, request.conversation_id, request.message)
+        try:
+            shared = mailbox.join(key)
+            if shared is not None:
+                # Duplicate of an in-flight message: replay the first copy's reply
+                payload = await asyncio.shield(shared)
+                yield _sse("token", {"text": payload["response"]})
+                yield _sse("done", payload)
+                return
+
+            async with mailbox.claim(key) as future:
+                async with mailbox.serialized(user_id):
+                    state = {}
+                    async for text in _run_turn(agent, session, user_id, request, state, opened):
+                        yield _sse("token", {"text": text})
+                    payload = state["payload"]
+                future.set_result(payload)
+            yield _sse("done", payload)
+        except Exception as e:
+            log_error(logger, e, "chat_stream_endpoint", user_id)
+            yield _sse("error", {"detail": f"Error processing chat: {str(e)}"})
+        finally:
+            session.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/conversations", response_model=List[ConversationRead])
 async def list_conversations(
     user_id: str,
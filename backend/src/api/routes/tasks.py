@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel
 from sqlmodel import Session
-from typing import List
+from typing import Any, Dict, List, Optional
 import logging
 from src.database.session import get_session
 from src.api.deps import verify_user_access
 from src.models.task import Task, TaskCreate, TaskRead, TaskUpdate
 from src.services.task_service import TaskService
+from src.tools.tool_engine import tool_engine
 from src.utils.validation import validate_task_title
 from src.utils.logging import log_error, log_task_operation
 from src.exceptions import ValidationErrorException, TaskNotFoundException, TaskAccessDeniedException
@@ -14,6 +16,27 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+
+class TaskBatchCall(BaseModel):
+    name: str
+    arguments: Dict[str, Any] = {}
+
+
+class TaskBatchRequest(BaseModel):
+    calls: List[TaskBatchCall]
+
+
+class TaskBatchResult(BaseModel):
+    name: Optional[str] = None
+    success: bool
+    error: Optional[str] = None
+    task_id: Optional[str] = None
+
+
+class TaskBatchResponse(BaseModel):
+    results: List[TaskBatchResult]
+
+
 @router.post("/tasks", response_model=TaskRead, status_code=status.HTTP_201_CREATED)
 async def create_task(
     task_data: TaskCreate,
@@ -62,6 +85,28 @@ async def create_task(
         raise HTTPException(status_code=500, detail=f"Failed to create task: {str(e)}")
 
 
+@router.post("/tasks/batch", response_model=TaskBatchResponse)
+async def run_task_batch(
+    batch: TaskBatchRequest,
+    payload: dict = Depends(verify_user_access),
+    session: Session = Depends(get_session)
+):
+    """
+    Run several task tool calls (add_task, update_task, complete_task,
+    delete_task, list_tasks) in one transaction, as the chat agent does.
+    Each call gets its own result; invalid calls do not stop the others.
+    """
+    # Get user_id from the verified JWT token (now verified against URL param)
+    user_id = payload.get("userId") or payload.get("sub")
+
+    try:
+        results = tool_engine.execute(session, user_id, [call.model_dump() for call in batch.calls])
+        return {"results": results}
+    except Exception as e:
+        log_error(logger, e, "run_task_batch", user_id)
+        raise HTTPException(status_code=500, detail=f"Failed to run task batch: {str(e)}")
+
+
 @router.get("/tasks", response_model=List[TaskRead])
 async def get_user_tasks(
     payload: dict = Depends(verify_user_access),
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 import os
 from fastapi.middleware.cors import CORSMiddleware
@@ -6,18 +7,36 @@ from src.api.routes import auth
 from src.api.routes import user
 from src.api.routes import tasks
 from src.database.session import engine
-from src.models import *  # Import all models to register them with SQLModel
+# Import all models to register them with SQLModel
+# (a wildcard import would shadow the `user` route module with src.models.user)
+from src.models import task as task_model, user as user_model, conversation as conversation_model, message as message_model
 from sqlmodel import SQLModel
+from src.agents.registry import registry
+from src.agents.mailbox import mailbox
+from src.agents.turn_timings import turn_timings
+from src.tools.tool_engine import tool_engine
 from src.utils.logging import setup_logger
 
 # Configure logging
 logger = setup_logger()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create database tables
+    SQLModel.metadata.create_all(engine)
+    # Resolve the Gemini model once and share one agent across all chat requests
+    await registry.start(engine)
+    yield
+    await registry.stop()
+
+
 # Create FastAPI app instance
 app = FastAPI(
     title="Todo AI Chatbot API",
     description="API for the AI-powered Todo Chatbot application",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -67,13 +86,6 @@ async def log_requests(request: Request, call_next):
 
     return response
 
-# Create database tables
-@app.on_event("startup")
-def on_startup():
-    # Ensure all models are registered with SQLModel metadata
-    from src.models import User, Task
-    SQLModel.metadata.create_all(engine)
-
 # Include API routes
 app.include_router(chat.router, prefix="/api/{user_id}", tags=["chat"])
 app.include_router(auth.router, prefix="/api", tags=["auth"])
@@ -88,3 +100,9 @@ def read_root():
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/health/agent")
+def agent_health():
+    """Chat agent runtime counters (active model, LLM executor load, response cache hits/misses, chat mailbox, tools)."""
+    return {**registry.get_agent().stats(), "mailbox": mailbox.stats(), "tool_engine": tool_engine.stats(),
+            "turn_timings": turn_timings.stats()}
+
@@ -1,10 +1,13 @@
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index
 from datetime import datetime
 import uuid
 
 
 class Message(SQLModel, table=True):
     __tablename__ = "messages"
+    # Recent-history reads: WHERE conversation_id = ? ORDER BY created_at DESC LIMIT n
+    __table_args__ = (Index("ix_messages_conversation_created", "conversation_id", "created_at"),)
     
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     user_id: str = Field(index=True)
@@ -26,6 +26,27 @@ class MessageService:
         ).order_by(Message.created_at.asc())
         return session.exec(query).all()
 
+    def get_recent_messages(self, session: Session, user_id: str, conversation_id: uuid.UUID, limit: int) -> List[Message]:
+        """Get the last `limit` messages of a conversation, oldest first (served by ix_messages_conversation_created)"""
+        query = select(Message).where(
+            Message.conversation_id == conversation_id,
+            Message.user_id == user_id
+        ).order_by(Message.created_at.desc()).limit(limit)
+        return list(reversed(session.exec(query).all()))
+
+    def get_messages_between(self, session: Session, user_id: str, conversation_id: uuid.UUID,
+                             after=None, before=None) -> List[Message]:
+        """Get the messages of a conversation created strictly between `after` and `before`, oldest first"""
+        query = select(Message).where(
+            Message.conversation_id == conversation_id,
+            Message.user_id == user_id
+        )
+        if after is not None:
+            query = query.where(Message.created_at > after)
+        if before is not None:
+            query = query.where(Message.created_at < before)
+        return session.exec(query.order_by(Message.created_at.asc())).all()
+
     def get_message_by_id(self, session: Session, user_id: str, message_id: uuid.UUID) -> Optional[Message]:
         """Get a specific message by ID for a user"""
         query = select(Message).where(
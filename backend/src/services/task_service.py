@@ -1,6 +1,81 @@
-from typing import List, Optional
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from sqlalchemy import delete, event, or_, update
+from sqlalchemy.orm import Session as ORMSession
 from sqlmodel import Session, select, func
-from ..models.task import Task, TaskBase
+from ..models.task import Task, TaskBase, generate_task_id
+
+
+class TaskVersionTracker:
+    """
+    Per-user version counter for the task set, bumped when a mutation made
+    through TaskService is committed. Caches keyed on the version (e.g. the
+    agent's response cache) become unreachable as soon as the user's tasks
+    change. Bumping before the commit would let a read in between cache the
+    old list under the new version; a rolled-back write bumps nothing.
+
+    Counters are process-local; entries cached elsewhere should still carry a TTL.
+    """
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> int:
+        return self._versions.get(user_id, 0)
+
+    def bump(self, user_id: str) -> int:
+        with self._lock:
+            version = self._versions.get(user_id, 0) + 1
+            self._versions[user_id] = version
+            return version
+
+    @staticmethod
+    def bump_on_commit(session: Session, user_id: str) -> None:
+        """Bump `user_id`'s version once `session` commits (see the session listeners below)."""
+        session.info.setdefault(_PENDING_BUMPS, set()).add(user_id)
+
+
+task_versions = TaskVersionTracker()
+_PENDING_BUMPS = "task_version_bumps"
+
+
+@event.listens_for(ORMSession, "after_commit")
+def _bump_committed_versions(session) -> None:
+    for user_id in session.info.pop(_PENDING_BUMPS, ()):
+        task_versions.bump(user_id)
+
+
+@event.listens_for(ORMSession, "after_soft_rollback")
+def _drop_rolled_back_versions(session, previous_transaction) -> None:
+    # A savepoint rollback keeps the outer transaction's bumps (an extra bump is harmless)
+    if not previous_transaction.nested:
+        session.info.pop(_PENDING_BUMPS, None)
+
+
+class SnapshotTask(NamedTuple):
+    id: str
+    title: str
+    completed: bool
+
+
+@dataclass(frozen=True)
+class TaskSnapshot:
+    """
+    A user's tasks as read once for a chat turn, with the task-set version
+    read just before. Tool calls of the same turn resolve task identifiers
+    against it in memory (see TaskService.resolve_tasks); writes still check
+    that the task exists, so a stale entry fails instead of acting on the
+    wrong row.
+    """
+    user_id: str
+    version: int
+    tasks: Tuple[SnapshotTask, ...]
+
+    @classmethod
+    def from_dicts(cls, user_id: str, version: int, tasks: List[Dict[str, Any]]) -> "TaskSnapshot":
+        return cls(user_id, version, tuple(SnapshotTask(str(t["id"]), t["title"], bool(t["completed"])) for t in tasks))
 
 
 class TaskService:
@@ -31,9 +106,27 @@ class TaskService:
 
         task = Task(**task_data)
         session.add(task)
+        task_versions.bump_on_commit(session, user_id)
         # session.commit() is now handled by the caller
         return task
 
+    @staticmethod
+    def create_tasks(session: Session, user_id: str, items: List[Dict]) -> List[Task]:
+        """Create several tasks (dicts with "title" and optional "description", "due_date", "priority") in one flush"""
+        tasks = [Task(
+            id=generate_task_id(),
+            user_id=user_id,
+            title=item["title"],
+            description=item.get("description"),
+            due_date=item.get("due_date"),
+            priority=item.get("priority"),
+            completed=False
+        ) for item in items]
+        session.add_all(tasks)
+        task_versions.bump_on_commit(session, user_id)
+        # session.commit() is handled by the caller
+        return tasks
+
     @staticmethod
     def get_user_tasks(session: Session, user_id: str, status: Optional[str] = None) -> List[Task]:
         """Get all tasks for a user, optionally filtered by status"""
@@ -61,6 +154,7 @@ class TaskService:
             return False
 
         session.delete(task)
+        task_versions.bump_on_commit(session, user_id)
         # session.commit() is now handled by the caller
         return True
 
@@ -74,9 +168,33 @@ class TaskService:
         task.completed = True
         task.updated_at = func.now()
         session.add(task)
+        task_versions.bump_on_commit(session, user_id)
         # session.commit() is now handled by the caller
         return task
 
+    @staticmethod
+    def complete_tasks(session: Session, user_id: str, task_ids: List[str]) -> List[str]:
+        """Mark several tasks as completed with one UPDATE. Returns the IDs of the tasks that still existed."""
+        if not task_ids:
+            return []
+        statement = update(Task).where(Task.user_id == user_id, Task.id.in_(set(task_ids))) \
+            .values(completed=True, updated_at=func.now()).returning(Task.id)
+        changed = list(session.execute(statement, execution_options={"synchronize_session": "fetch"}).scalars())
+        task_versions.bump_on_commit(session, user_id)
+        # session.commit() is handled by the caller
+        return changed
+
+    @staticmethod
+    def delete_tasks(session: Session, user_id: str, task_ids: List[str]) -> List[str]:
+        """Delete several tasks with one DELETE. Returns the IDs of the tasks that still existed."""
+        if not task_ids:
+            return []
+        statement = delete(Task).where(Task.user_id == user_id, Task.id.in_(set(task_ids))).returning(Task.id)
+        deleted = list(session.execute(statement, execution_options={"synchronize_session": "fetch"}).scalars())
+        task_versions.bump_on_commit(session, user_id)
+        # session.commit() is handled by the caller
+        return deleted
+
     @staticmethod
     def toggle_completion(session: Session, task_id: str, user_id: str) -> Optional[Task]:
         """Toggle the completion status of a task"""
@@ -89,6 +207,7 @@ class TaskService:
         task.completed = not task.completed
         task.updated_at = func.now()
         session.add(task)
+        task_versions.bump_on_commit(session, user_id)
         # session.commit() is now handled by the caller
         return task
 
@@ -109,6 +228,7 @@ class TaskService:
 
         task.updated_at = func.now()
         session.add(task)
+        task_versions.bump_on_commit(session, user_id)
         # session.commit() is now handled by the caller
         return task
 
@@ -145,40 +265,75 @@ class TaskService:
         Resolve a task by ID or Title.
         Returns (task, status) where status is 'FOUND', 'AMBIGUOUS', or 'NOT_FOUND'.
         """
-        if not identifier:
-            return None, "NOT_FOUND"
+        return TaskService.resolve_tasks(session, user_id, [identifier])[identifier]
 
+    @staticmethod
+    def resolve_tasks(session: Session, user_id: str, identifiers: List[str],
+                      snapshot: TaskSnapshot = None) -> Dict[str, Tuple[Optional[Task], str]]:
+        """
+        Resolve several tasks by ID or Title with one query.
+        Returns {identifier: (task, status)} with the same rules as resolve_task:
+        ID, then exact title (case-insensitive), then unique partial title.
+        With a `snapshot` of the user's tasks, identifiers are matched in memory
+        and only those it does not know (e.g. tasks added since) are queried;
+        the tasks returned for snapshot matches are SnapshotTask entries.
+        """
         # Normalization: Trim whitespace and strip surrounding quotes/brackets
-        identifier = identifier.strip().strip('"').strip("'").strip('[]').strip('()').strip('{}').strip()
-        
-        if not identifier:
+        normalized = {}
+        for identifier in identifiers:
+            needle = (identifier or "").strip().strip('"').strip("'").strip('[]').strip('()').strip('{}').strip()
+            normalized[identifier] = needle
+
+        resolved = {}
+        if snapshot is not None and snapshot.user_id == user_id:
+            for identifier, needle in normalized.items():
+                match = TaskService._match(needle, snapshot.tasks)
+                if match[1] != "NOT_FOUND" or not needle:
+                    resolved[identifier] = match
+            normalized = {i: needle for i, needle in normalized.items() if i not in resolved}
+
+        needles = {needle for needle in normalized.values() if needle}
+        candidates = []
+        if needles:
+            # IDs are 32 chars long (without hyphens) in this project
+            ids = [needle for needle in needles if len(needle) >= 30]
+            conditions = [Task.title.ilike(f"%{TaskService._escape_like(needle)}%", escape="\\") for needle in needles]
+            if ids:
+                conditions.append(Task.id.in_(ids))
+            statement = select(Task).where(Task.user_id == user_id, or_(*conditions))
+            candidates = session.exec(statement).all()
+
+        for identifier, needle in normalized.items():
+            resolved[identifier] = TaskService._match(needle, candidates)
+        return resolved
+
+    @staticmethod
+    def _escape_like(text: str) -> str:
+        return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    @staticmethod
+    def _match(needle: str, candidates: List[Task]) -> Tuple[Optional[Task], str]:
+        if not needle:
             return None, "NOT_FOUND"
-        # IDs are 32 chars long (without hyphens) in this project
-        if len(identifier) >= 30:
-            task = TaskService.get_task_by_id(session, user_id, identifier)
-            if task:
-                return task, "FOUND"
+        # 1. Try ID match
+        if len(needle) >= 30:
+            for task in candidates:
+                if task.id == needle:
+                    return task, "FOUND"
 
         # 2. Try Exact Title match
-        statement = select(Task).where(
-            Task.user_id == user_id,
-            Task.title.ilike(identifier)
-        )
-        exact_matches = session.exec(statement).all()
+        lowered = needle.lower()
+        exact_matches = [t for t in candidates if t.title.lower() == lowered]
         if len(exact_matches) == 1:
             return exact_matches[0], "FOUND"
         elif len(exact_matches) > 1:
             return None, "AMBIGUOUS"
 
         # 3. Try Partial Title match
-        statement = select(Task).where(
-            Task.user_id == user_id,
-            Task.title.ilike(f"%{identifier}%")
-        )
-        partial_matches = session.exec(statement).all()
+        partial_matches = [t for t in candidates if lowered in t.title.lower()]
         if len(partial_matches) == 1:
             return partial_matches[0], "FOUND"
         elif len(partial_matches) > 1:
             return None, "AMBIGUOUS"
 
-        return None, "NOT_FOUND"
\ No newline at end of file
+        return None, "NOT_FOUND"
@@ -8,10 +8,14 @@ import uuid
 
 
 class TaskTools:
-    def __init__(self, database_url: str):
-        self.engine = create_engine(database_url)
-        # Create tables if they don't exist
-        SQLModel.metadata.create_all(self.engine)
+    def __init__(self, database_url: str = None, engine=None):
+        if engine is not None:
+            # Shared engine (e.g. from the agent registry); tables are created at startup
+            self.engine = engine
+        else:
+            self.engine = create_engine(database_url)
+            # Create tables if they don't exist
+            SQLModel.metadata.create_all(self.engine)
         self.task_service = TaskService()
         self.conversation_service = ConversationService()
         self.message_service = MessageService()
@@ -54,7 +58,8 @@ class TaskTools:
                     "id": str(task.id),
                     "title": task.title,
                     "description": task.description,
-                    "completed": task.completed
+                    "completed": task.completed,
+                    "updated_at": task.updated_at.isoformat() if task.updated_at else None
                 })
             
             status_display = "all" if status == "all" else status
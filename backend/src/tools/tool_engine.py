@@ -0,0 +1,275 @@
+"""Registered task tools executed in validated, batched transactions (used by chat and REST)"""
+
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlmodel import Session
+
+from ..agents.intent_engine import ambiguous_candidates
+from ..agents.schedule_extractor import PRIORITIES
+from ..models.task import TaskUpdate
+from ..services.task_service import TaskService, TaskSnapshot
+from ..utils.validation import validate_task_title
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ToolSpec:
+    """
+    A tool the engine can run. `validate(args)` returns (normalized args, error)
+    without touching the database. When `target` is set, that argument names
+    the task the call acts on and is resolved to a Task before `apply`.
+    `apply(session, user_id, items)` runs every call of this tool in the batch
+    at once; each item is {"args", "task", "result"}, and `apply` sets the
+    item's result error when the write finds the task gone. Tools run in
+    `phase` order, so tasks added by a batch can be referred to by later calls.
+    """
+    name: str
+    validate: Callable[[Dict[str, Any]], Tuple[Dict[str, Any], Optional[str]]]
+    apply: Callable[[Session, str, List[Dict[str, Any]]], None]
+    target: Optional[str] = None
+    phase: int = 1
+
+
+def _task_reference(name: str, *keys: str):
+    def validate(args):
+        identifier = next((args.get(k) for k in keys if args.get(k)), None)
+        if not identifier:
+            return args, f"{name} failed: Task ID or title is required"
+        return {**args, "target": identifier}, None
+    return validate
+
+
+def _validate_schedule(name, args):
+    """Parse "due_date" (ISO string, as set by schedule_extractor) and check "priority"."""
+    due_date, priority = args.get("due_date"), args.get("priority")
+    if isinstance(due_date, str):
+        try:
+            args = {**args, "due_date": datetime.fromisoformat(due_date)}
+        except ValueError:
+            return args, f"{name} failed: Invalid due date '{due_date}'"
+    if priority is not None and priority not in PRIORITIES:
+        return args, f"{name} failed: Priority must be one of {', '.join(PRIORITIES)}"
+    return args, None
+
+
+def _validate_add(args):
+    title = args.get("title")
+    is_valid, msg = validate_task_title(title) if title else (False, "Task title is required")
+    if not is_valid:
+        return args, f"add_task failed: {msg}"
+    return _validate_schedule("add_task", args)
+
+
+def _validate_update(args):
+    args, error = _task_reference("update_task", "task_id", "old_title", "title")(args)
+    if error:
+        return args, error
+    # "title" is the new title unless it is what names the task
+    new_title = args.get("new_title") or (args.get("title") if args.get("task_id") or args.get("old_title") else None)
+    if not new_title:
+        if args.get("due_date") or args.get("priority"):
+            # Only the schedule changes
+            return _validate_schedule("update_task", {**args, "new_title": None})
+        return args, "update_task failed: New title is required"
+    is_valid, msg = validate_task_title(new_title)
+    if not is_valid:
+        return args, f"update_task failed: {msg}"
+    return _validate_schedule("update_task", {**args, "new_title": new_title})
+
+
+def _apply_add(session, user_id, items):
+    tasks = TaskService.create_tasks(session, user_id, [item["args"] for item in items])
+    # Flush so later phases can resolve the new tasks by title
+    session.flush()
+    for item, task in zip(items, tasks):
+        item["result"]["task_id"] = task.id
+
+
+def _gone(name, item):
+    # The task was resolved (possibly from the turn's snapshot) but no longer exists
+    item["result"].update(error=f"{name} failed: Task '{item['args']['target']}' no longer exists", task_id=None)
+
+
+def _apply_update(session, user_id, items):
+    for item in items:
+        args = item["args"]
+        # Construct update payload dynamically to avoid resetting fields to None
+        update_payload = {"title": args["new_title"]} if args["new_title"] else {}
+        if "description" in args:
+            update_payload["description"] = args["description"]
+        if "completed" in args:
+            update_payload["completed"] = args["completed"]
+        for key in ("due_date", "priority"):
+            if args.get(key) is not None:
+                update_payload[key] = args[key]
+        updated = TaskService.update_task(session=session, user_id=user_id, task_id=item["task"].id,
+                                          task_update=TaskUpdate(**update_payload))
+        if updated is None:
+            _gone("update_task", item)
+
+
+def _apply_complete(session, user_id, items):
+    changed = set(TaskService.complete_tasks(session, user_id, [item["task"].id for item in items]))
+    for item in items:
+        if item["task"].id not in changed:
+            _gone("complete_task", item)
+
+
+def _apply_delete(session, user_id, items):
+    deleted = set(TaskService.delete_tasks(session, user_id, [item["task"].id for item in items]))
+    for item in items:
+        if item["task"].id not in deleted:
+            _gone("delete_task", item)
+
+
+def _apply_list(session, user_id, items):
+    # A signal for the UI to refresh; the reply text was already written from the task context
+    pass
+
+
+TASK_TOOLS = [
+    ToolSpec("add_task", _validate_add, _apply_add, phase=0),
+    ToolSpec("update_task", _validate_update, _apply_update, target="target", phase=1),
+    ToolSpec("complete_task", _task_reference("complete_task", "task_id", "title"), _apply_complete,
+             target="target", phase=1),
+    ToolSpec("delete_task", _task_reference("delete_task", "task_id", "title"), _apply_delete,
+             target="target", phase=2),
+    ToolSpec("list_tasks", lambda args: (args, None), _apply_list, phase=1),
+]
+
+
+class ToolEngine:
+    """
+    Dispatch table of tools. `execute` validates every call of a batch up
+    front, groups the valid ones by tool, applies each group with one bulk
+    statement where the tool allows it and commits the batch as one
+    transaction. A database error rolls the whole batch back.
+    """
+
+    def __init__(self, tools: List[ToolSpec] = None):
+        self._tools: Dict[str, ToolSpec] = {}
+        for spec in tools if tools is not None else TASK_TOOLS:
+            self.register(spec)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.calls = 0
+        self.failed_calls = 0
+        self.rollbacks = 0
+
+    def register(self, spec: ToolSpec) -> None:
+        self._tools[spec.name] = spec
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._tools)
+
+    def phase(self, name: str) -> Optional[int]:
+        """The phase `name` runs in, or None for an unknown tool."""
+        spec = self._tools.get(name)
+        return spec.phase if spec is not None else None
+
+    def execute(self, session: Session, user_id: str, calls: List[Dict[str, Any]],
+                snapshot: TaskSnapshot = None) -> List[Dict[str, Any]]:
+        """
+        Run `calls` ([{"name", "arguments"}]) for `user_id` and commit them.
+        `snapshot` is the task list the calls were written against; task
+        identifiers are resolved against it before falling back to the database.
+        Returns one result per call, in order: {"name", "success", "error", "task_id"}.
+        A call whose task identifier matches several tasks also gets
+        "ambiguous": {"target", "candidates"}, so the caller can ask which one
+        was meant (see ClarificationStore).
+        """
+        results = [{"name": call.get("name"), "success": False, "error": None, "task_id": None} for call in calls]
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for call, result in zip(calls, results):
+            spec = self._tools.get(call.get("name"))
+            if spec is None:
+                result["error"] = f"Unknown tool: {call.get('name')}"
+                continue
+            args, error = spec.validate(dict(call.get("arguments") or {}))
+            if error:
+                result["error"] = error
+                continue
+            groups.setdefault(spec.name, []).append({"args": args, "task": None, "result": result})
+
+        applied = []
+        try:
+            specs = [self._tools[name] for name in groups]
+            for phase in sorted({spec.phase for spec in specs}):
+                in_phase = [spec for spec in specs if spec.phase == phase]
+                # One lookup for every task named in this phase
+                self._resolve(session, user_id, [(spec, groups[spec.name]) for spec in in_phase], snapshot)
+                for spec in in_phase:
+                    items = [item for item in groups[spec.name] if item["result"]["error"] is None]
+                    if items:
+                        spec.apply(session, user_id, items)
+                        applied.extend(item for item in items if item["result"]["error"] is None)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            for item in (item for items in groups.values() for item in items):
+                if item["result"]["error"] is None:
+                    item["result"].update(error=f"Error executing {item['result']['name']}: {str(e)}",
+                                          task_id=None)
+            logger.error(f"TOOL_ENGINE - Batch for user {user_id} rolled back: {str(e)}")
+            applied = []
+            with self._lock:
+                self.rollbacks += 1
+
+        for item in applied:
+            item["result"]["success"] = True
+        failed = [r for r in results if not r["success"]]
+        for result in failed:
+            logger.warning(result["error"])
+        with self._lock:
+            self.batches += 1
+            self.calls += len(calls)
+            self.failed_calls += len(failed)
+        logger.info(f"TOOL_ENGINE - User: {user_id}, Calls: {len(calls)}, Failed: {len(failed)}")
+        return results
+
+    def _resolve(self, session: Session, user_id: str, groups: List[Tuple[ToolSpec, List[Dict[str, Any]]]],
+                 snapshot: TaskSnapshot = None) -> None:
+        """Attach the target task to each item; items whose task is not found get an error."""
+        targets = [item["args"][spec.target] for spec, items in groups if spec.target for item in items]
+        if not targets:
+            return
+        resolved = TaskService.resolve_tasks(session, user_id, targets, snapshot)
+        tasks = None
+        for spec, items in groups:
+            if spec.target is None:
+                continue
+            for item in items:
+                identifier = item["args"][spec.target]
+                task, status = resolved[identifier]
+                if status == "FOUND":
+                    item["task"] = task
+                    item["result"]["task_id"] = task.id
+                    continue
+                item["result"]["error"] = f"{spec.name} failed: Task '{identifier}' not found ({status})"
+                if status == "AMBIGUOUS":
+                    if tasks is None:
+                        tasks = self._task_dicts(session, user_id, snapshot)
+                    item["result"]["ambiguous"] = {"target": identifier,
+                                                   "candidates": ambiguous_candidates(identifier, tasks)}
+
+    @staticmethod
+    def _task_dicts(session: Session, user_id: str, snapshot: TaskSnapshot = None) -> List[Dict[str, Any]]:
+        """The user's tasks as {"id", "title", "completed"}, from the snapshot when there is one."""
+        if snapshot is not None and snapshot.user_id == user_id:
+            return [t._asdict() for t in snapshot.tasks]
+        return [{"id": t.id, "title": t.title, "completed": t.completed}
+                for t in TaskService.get_user_tasks(session, user_id)]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"batches": self.batches, "calls": self.calls, "failed_calls": self.failed_calls,
+                    "rollbacks": self.rollbacks}
+
+
+tool_engine = ToolEngine()
@@ -0,0 +1,56 @@
+import asyncio
+from src.agents import registry as registry_module
+from src.agents.registry import AgentRegistry
+from .test_utils import StubModel, make_engine
+
+
+def test_registry_shares_one_agent_and_engine(monkeypatch):
+    """
+    The registry resolves the model once and hands out the same agent,
+    bound to the application's engine, on every call.
+    """
+    probes = []
+
+    def fake_resolve(candidates, provider=None):
+        probes.append(candidates)
+        return StubModel(), "stub-model"
+
+    monkeypatch.setattr(registry_module, "resolve_working_model", fake_resolve)
+    engine = make_engine()
+    registry = AgentRegistry(reprobe_interval=0)
+
+    async def scenario():
+        await registry.start(engine)
+        first = registry.get_agent()
+        second = registry.get_agent()
+        await registry.stop()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert first is second
+    assert first.task_tools.engine is engine
+    assert first.model_name == "stub-model"
+    assert len(probes) == 1
+
+
+def test_registry_reprobe_swaps_model(monkeypatch):
+    """
+    A background re-probe that finds a different working model swaps it
+    into the shared agent in place.
+    """
+    models = iter([(StubModel(), "model-a"), (StubModel(), "model-b")])
+    monkeypatch.setattr(registry_module, "resolve_working_model", lambda candidates, provider=None: next(models))
+    registry = AgentRegistry(reprobe_interval=0)
+
+    async def scenario():
+        await registry.start(make_engine())
+        agent = registry.get_agent()
+        name = await registry.reprobe()
+        return agent, name
+
+    agent, name = asyncio.run(scenario())
+
+    assert name == "model-b"
+    assert registry.get_agent() is agent
+    assert agent.model_name == "model-b"
@@ -0,0 +1,137 @@
+import asyncio
+import time
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session, select
+from src.main import app
+from src.database.session import get_session
+from src.agents.registry import get_agent
+from src.agents.todo_agent import TodoAgent
+from src.agents.llm_executor import LLMExecutor
+from src.agents.turn_timings import TurnTimings
+from src.api.routes import chat as chat_routes
+from src.models.message import Message
+from .test_utils import create_test_token, StubModel, make_engine
+
+LLM_DELAY = 1.0
+PENDING_CHATS = 4
+
+
+@pytest.fixture(name="session")
+def session_fixture(tmp_path):
+    # A file database with a real pool: turns finish on worker threads at the same time, which
+    # one shared in-memory connection (StaticPool) cannot take
+    engine = make_engine(tmp_path / "chat.db")
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="slow_agent")
+def slow_agent_fixture():
+    executor = LLMExecutor(max_concurrency=PENDING_CHATS)
+    agent = TodoAgent(
+        engine=make_engine(),
+        model=StubModel(delay=LLM_DELAY),
+        model_name="stub-slow",
+        llm_executor=executor
+    )
+    yield agent
+    executor.shutdown()
+
+
+def test_task_crud_latency_flat_while_llm_calls_pending(session: Session, slow_agent: TodoAgent):
+    """
+    While several slow (stubbed) LLM calls are in flight, /tasks requests
+    keep being served without waiting for them.
+    """
+    app.dependency_overrides[get_session] = lambda: session
+    app.dependency_overrides[get_agent] = lambda: slow_agent
+
+    user_id = "test_user_concurrency"
+    headers = {"Authorization": f"Bearer {create_test_token(user_id)}"}
+
+    async def timed_list(client):
+        start = time.perf_counter()
+        response = await client.get(f"/api/{user_id}/tasks", headers=headers)
+        assert response.status_code == 200
+        return time.perf_counter() - start
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            created = await client.post(f"/api/{user_id}/tasks", json={"title": "Buy milk"}, headers=headers)
+            assert created.status_code == 201
+
+            idle = [await timed_list(client) for _ in range(5)]
+
+            # One chat per user: turns of a single user are serialized
+            chats = [
+                asyncio.create_task(client.post(
+                    f"/api/{user_id}_{i}/chat",
+                    json={"message": f"please update the plan {i}"},
+                    headers={"Authorization": f"Bearer {create_test_token(f'{user_id}_{i}')}"}
+                ))
+                for i in range(PENDING_CHATS)
+            ]
+            # Wait until every chat request is blocked in the (slow) model call
+            deadline = time.perf_counter() + LLM_DELAY / 2
+            while slow_agent.llm_executor.stats()["pending"] < PENDING_CHATS and time.perf_counter() < deadline:
+                await asyncio.sleep(0.01)
+            assert slow_agent.llm_executor.stats()["pending"] == PENDING_CHATS
+
+            busy = [await timed_list(client) for _ in range(5)]
+            still_pending = slow_agent.llm_executor.stats()["pending"]
+
+            chat_responses = await asyncio.gather(*chats)
+            return idle, busy, still_pending, chat_responses
+
+    try:
+        idle, busy, still_pending, chat_responses = asyncio.run(scenario())
+    finally:
+        app.dependency_overrides.clear()
+
+    # CRUD was measured while every LLM call was still pending...
+    assert still_pending == PENDING_CHATS
+    # ...and none of those requests waited on a model call
+    assert max(busy) < LLM_DELAY / 2
+    assert max(busy) < max(idle) + 0.1
+    assert all(r.status_code == 200 for r in chat_responses)
+
+
+def test_user_message_write_overlaps_the_model_call(monkeypatch):
+    """A slow write of the user's message does not add to the turn: only the model call is on the critical path."""
+    write_delay = 0.3
+    engine = make_engine()
+
+    def slow_user_insert(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO messages") and "user" in parameters:
+            time.sleep(write_delay)
+    event.listen(engine, "before_cursor_execute", slow_user_insert)
+
+    timings = TurnTimings()
+    monkeypatch.setattr(chat_routes, "turn_timings", timings)
+    session = Session(engine)
+    agent = TodoAgent(engine=make_engine(), model=StubModel(delay=LLM_DELAY / 2), model_name="stub-slow")
+    app.dependency_overrides[get_session] = lambda: session
+    app.dependency_overrides[get_agent] = lambda: agent
+    user_id = "test_user_overlap"
+    try:
+        started = time.perf_counter()
+        response = TestClient(app).post(f"/api/{user_id}/chat", json={"message": "please update the plan"},
+                                        headers={"Authorization": f"Bearer {create_test_token(user_id)}"})
+        elapsed = time.perf_counter() - started
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert elapsed < LLM_DELAY / 2 + write_delay
+    stats = timings.stats()
+    assert stats["avg_background_ms"]["persist"] >= write_delay * 1000
+    assert stats["avg_stages_ms"]["persist_wait"] < 50
+    assert stats["avg_stages_ms"]["generation"] >= LLM_DELAY / 2 * 1000
+    # The conversation and both messages were still saved, in order
+    roles = [m.role for m in session.exec(select(Message).order_by(Message.created_at)).all()]
+    assert roles == ["user", "assistant"]
+    session.close()
@@ -0,0 +1,121 @@
+import asyncio
+import httpx
+import pytest
+from sqlmodel import Session, select
+from src.main import app
+from src.database.session import get_session
+from src.agents.registry import get_agent
+from src.agents.todo_agent import TodoAgent
+from src.agents.llm_executor import LLMExecutor
+from src.agents.mailbox import ChatMailbox
+from src.models.task import Task
+from .test_utils import create_test_token, StubModel, make_engine
+
+ADD_REPLY = '{"response": "Add kar diya ✅", "tool_calls": [{"name": "add_task", "arguments": {"title": "Plan the offsite"}}], "chat_title": "Offsite"}'
+
+
+@pytest.fixture(name="engine")
+def engine_fixture():
+    return make_engine()
+
+
+def test_identical_inflight_messages_share_one_turn(engine):
+    """A double-submitted message runs the model and its tool calls once."""
+    model = StubModel(reply=ADD_REPLY, delay=0.3)
+    executor = LLMExecutor(max_concurrency=4)
+    agent = TodoAgent(engine=engine, model=model, model_name="stub", llm_executor=executor)
+
+    session = Session(engine)
+    app.dependency_overrides[get_session] = lambda: session
+    app.dependency_overrides[get_agent] = lambda: agent
+
+    user_id = "test_user_mailbox"
+    headers = {"Authorization": f"Bearer {create_test_token(user_id)}"}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            send = lambda: client.post(f"/api/{user_id}/chat", json={"message": "please organise the offsite plan"}, headers=headers)
+            return await asyncio.gather(send(), send())
+
+    try:
+        first, second = asyncio.run(scenario())
+    finally:
+        app.dependency_overrides.clear()
+        executor.shutdown()
+
+    assert first.status_code == 200 and second.status_code == 200
+    assert first.json() == second.json()
+    assert len(model.prompts) == 1
+    assert len(session.exec(select(Task).where(Task.user_id == user_id)).all()) == 1
+    session.close()
+
+
+def test_turns_of_one_user_run_in_order():
+    mailbox = ChatMailbox()
+    events = []
+
+    def turn(name):
+        async def run():
+            events.append(f"start {name}")
+            await asyncio.sleep(0.05)
+            events.append(f"end {name}")
+            return name
+        return run
+
+    async def scenario():
+        return await asyncio.gather(
+            mailbox.run("u1", "c1", "add milk", turn("a")),
+            mailbox.run("u1", "c1", "add eggs", turn("b")),
+            mailbox.run("u1", "c1", "Add   MILK", turn("dup")),
+        )
+
+    results = asyncio.run(scenario())
+
+    # The third message normalizes to the first and shares its result
+    assert results == ["a", "b", "a"]
+    assert events == ["start a", "end a", "start b", "end b"]
+    assert mailbox.stats() == {"turns": 2, "coalesced": 1, "in_flight": 0, "users_waiting": 0}
+
+
+def test_waiters_receive_the_owner_error():
+    mailbox = ChatMailbox()
+
+    async def failing():
+        await asyncio.sleep(0.02)
+        raise RuntimeError("model down")
+
+    async def scenario():
+        return await asyncio.gather(
+            mailbox.run("u1", None, "hello", failing),
+            mailbox.run("u1", None, "hello", failing),
+            return_exceptions=True
+        )
+
+    first, second = asyncio.run(scenario())
+    assert isinstance(first, RuntimeError) and isinstance(second, RuntimeError)
+    assert mailbox.stats()["in_flight"] == 0
+
+
+def test_waiters_rerun_the_turn_when_the_owner_is_cancelled():
+    mailbox = ChatMailbox()
+    runs = []
+
+    async def turn():
+        runs.append("run")
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def scenario():
+        owner = asyncio.ensure_future(mailbox.run("u1", "c1", "add milk", turn))
+        await asyncio.sleep(0.01)
+        duplicate = asyncio.ensure_future(mailbox.run("u1", "c1", "add milk", turn))
+        await asyncio.sleep(0.01)
+        # The first client disconnects mid-turn
+        owner.cancel()
+        return owner, await duplicate
+
+    owner, result = asyncio.run(scenario())
+    assert owner.cancelled() and result == "done"
+    assert runs == ["run", "run"]
+    assert mailbox.stats()["in_flight"] == 0
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import pytest
+import threading
+from uuid import uuid4
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+from src.main import app
+from src.api.routes import chat as chat_routes
+from src.api.routes.chat import _run_agent_turn
+from src.database.session import get_session
+from src.agents.registry import get_agent
+from src.agents.todo_agent import TodoAgent
+from src.agents.stream_parser import JSONReplyParser, ResponseTextExtractor, parse_json_reply
+from src.models.message import Message
+from src.models.task import Task
+from src.tools.tool_engine import tool_engine
+from .test_utils import create_test_token, StubModel, make_engine
+
+
+@pytest.fixture(name="session")
+def session_fixture(tmp_path):
+    # A file database with a real pool: the turn writes on several worker threads at once
+    engine = make_engine(tmp_path / "chat.db")
+    with Session(engine) as session:
+        yield session
+
+
+def parse_events(body: str):
+    events = []
+    for frame in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in frame.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_response_text_extractor_handles_split_chunks():
+    """
+    The "response" value is decoded incrementally, including escapes split across chunks.
+    """
+    raw = '```json\n{"response": "Milk add kar \\"diya\\"\\n\\ud83d\\ude42", "tool_calls": []}\n```'
+    extractor = ResponseTextExtractor()
+    pieces = [extractor.feed(raw[i:i + 3]) for i in range(0, len(raw), 3)]
+    assert "".join(pieces) == 'Milk add kar "diya"\n🙂'
+    assert extractor.done
+    assert len([p for p in pieces if p]) > 1
+
+
+def test_json_reply_parser_emits_tool_calls_as_they_complete():
+    raw = ('Sure! ```json\n{"tool_calls": [{"name": "add_task", "arguments": {"title": "fix {braces} \\"now\\""}}, '
+           '{"name": "list_tasks", "arguments": {}}], "response": "Done } {"}\n```')
+    parser = JSONReplyParser()
+    emitted = []
+    for i in range(0, len(raw), 4):
+        for call in parser.feed(raw[i:i + 4]):
+            # Each call is complete before the response text has arrived
+            emitted.append((call["name"], parser.done))
+    assert emitted == [("add_task", False), ("list_tasks", False)]
+    assert parser.value["response"] == "Done } {"
+    assert parser.value["tool_calls"][0]["arguments"]["title"] == 'fix {braces} "now"'
+
+
+def test_parse_json_reply_skips_prose_and_stray_braces():
+    assert parse_json_reply('I think {this} is it: {"response": "hi", "tool_calls": []} and }') == {
+        "response": "hi", "tool_calls": []
+    }
+    assert parse_json_reply("no json here") is None
+
+
+def test_stream_message_sends_tool_calls_before_the_reply_ends():
+    model = StubModel('{"tool_calls": [{"name": "add_task", "arguments": {"title": "Buy milk"}}], '
+                      '"response": "Milk list mein add kar diya hai, aur kuch chahiye?"}')
+    agent = TodoAgent(database_url="sqlite://", model=model, model_name="stub")
+    events = list(agent.stream_message("user_early_tools", "please put milk on my shopping list"))
+
+    kinds = [event["type"] for event in events]
+    assert kinds.index("tool_call") < kinds.index("token")
+    assert events[kinds.index("tool_call")]["call"] == {
+        "name": "add_task", "arguments": {"title": "Buy milk", "user_id": "user_early_tools"}
+    }
+    assert events[-1]["result"]["tool_calls"] == [events[kinds.index("tool_call")]["call"]]
+
+
+def test_chat_stream_sends_tokens_then_done(session: Session):
+    """
+    The streaming endpoint emits token events before the final done event,
+    executes the tool calls and persists the assistant message.
+    """
+    user_id = "test_user_stream"
+    reply = json.dumps({
+        "response": "Theek hai, milk add kar diya hai. 🙂",
+        "tool_calls": [{"name": "add_task", "arguments": {"title": "milk"}}],
+        "chat_title": "Shopping"
+    })
+    agent = TodoAgent(engine=session.get_bind(), model=StubModel(reply=reply), model_name="stub")
+
+    app.dependency_overrides[get_session] = lambda: session
+    app.dependency_overrides[get_agent] = lambda: agent
+    try:
+        client = TestClient(app)
+        response = client.post(
+            f"/api/{user_id}/chat/stream",
+            json={"message": "doodh lana hai, yaad rakhna"},
+            headers={"Authorization": f"Bearer {create_test_token(user_id)}"}
+        )
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = parse_events(response.text)
+    kinds = [kind for kind, _ in events]
+    assert kinds[-1] == "done"
+    assert kinds.count("token") > 1
+    assert "".join(data["text"] for kind, data in events if kind == "token") == "Theek hai, milk add kar diya hai. 🙂"
+
+    done = events[-1][1]
+    assert done["response"] == "Theek hai, milk add kar diya hai. 🙂"
+    assert [call["name"] for call in done["tool_calls"]] == ["add_task"]
+
+    tasks = session.exec(select(Task).where(Task.user_id == user_id)).all()
+    assert [t.title for t in tasks] == ["milk"]
+    messages = session.exec(select(Message).where(Message.user_id == user_id).order_by(Message.created_at)).all()
+    assert [m.role for m in messages] == ["user", "assistant"]
+    assert str(messages[0].conversation_id) == done["conversation_id"]
+
+
+def test_streamed_tool_calls_run_in_phase_batches(session: Session):
+    user_id = "test_user_stream_batch"
+    reply = json.dumps({
+        "tool_calls": [{"name": "add_task", "arguments": {"title": "milk"}},
+                       {"name": "add_task", "arguments": {"title": "eggs"}},
+                       {"name": "complete_task", "arguments": {"task_id": "milk"}}],
+        "response": "Theek hai, milk aur eggs add kar diye. 🙂"
+    })
+    agent = TodoAgent(engine=session.get_bind(), model=StubModel(reply=reply), model_name="stub")
+    before = tool_engine.stats()
+
+    app.dependency_overrides[get_session] = lambda: session
+    app.dependency_overrides[get_agent] = lambda: agent
+    try:
+        response = TestClient(app).post(
+            f"/api/{user_id}/chat/stream",
+            json={"message": "milk aur eggs likh lo, milk le aaya hoon"},
+            headers={"Authorization": f"Bearer {create_test_token(user_id)}"}
+        )
+    finally:
+        app.dependency_overrides.clear()
+
+    assert parse_events(response.text)[-1][0] == "done"
+    after = tool_engine.stats()
+    # The leading adds as one batch mid-stream, then the complete
+    assert (after["batches"] - before["batches"], after["calls"] - before["calls"]) == (2, 3)
+    tasks = session.exec(select(Task).where(Task.user_id == user_id)).all()
+    assert sorted((t.title, t.completed) for t in tasks) == [("eggs", False), ("milk", True)]
+
+
+class PausedAgent:
+    """Streams two adds and the start of the reply, then waits for `resume` before finishing."""
+
+    def __init__(self):
+        self.resume = asyncio.Event()
+        self.calls = [{"name": "add_task", "arguments": {"title": title}} for title in ("milk", "eggs")]
+
+    async def astream_message(self, user_id, message, conversation_id=None):
+        yield {"type": "tasks", "snapshot": None}
+        for call in self.calls:
+            yield {"type": "tool_call", "call": call}
+        yield {"type": "token", "text": "Theek hai"}
+        await self.resume.wait()
+        yield {"type": "result", "result": {"response": "Theek hai", "tool_calls": self.calls}}
+
+
+def test_leading_adds_run_while_the_reply_is_still_streaming(session: Session):
+    user_id = "test_user_early_adds"
+    agent = PausedAgent()
+
+    async def turn():
+        state = {}
+        async for _ in _run_agent_turn(agent, session, user_id, uuid4(), "milk aur eggs", state):
+            # The reply has started: the adds are already being written
+            await state["early"]
+            with Session(session.get_bind()) as other:
+                written = sorted(t.title for t in other.exec(select(Task).where(Task.user_id == user_id)))
+            agent.resume.set()
+        return state, written
+
+    state, written = asyncio.run(turn())
+    assert written == ["eggs", "milk"]
+    assert [r["success"] for r in state["early"].result()] == [True, True]
+
+
+def test_stream_validates_the_request_once_off_the_event_loop(session: Session, monkeypatch):
+    user_id = "test_user_stream_open"
+    agent = TodoAgent(engine=session.get_bind(), model=StubModel(), model_name="stub")
+    opened = []
+    open_turn = chat_routes._open_turn
+
+    def counting_open_turn(*args):
+        opened.append(threading.current_thread() is threading.main_thread())
+        return open_turn(*args)
+
+    monkeypatch.setattr(chat_routes, "_open_turn", counting_open_turn)
+    app.dependency_overrides[get_session] = lambda: session
+    app.dependency_overrides[get_agent] = lambda: agent
+    headers = {"Authorization": f"Bearer {create_test_token(user_id)}"}
+    try:
+        client = TestClient(app)
+        response = client.post(f"/api/{user_id}/chat/stream", json={"message": "hello there"}, headers=headers)
+        missing = client.post(f"/api/{user_id}/chat/stream",
+                              json={"message": "hello", "conversation_id": str(uuid4())}, headers=headers)
+    finally:
+        app.dependency_overrides.clear()
+
+    assert parse_events(response.text)[-1][0] == "done"
+    assert missing.status_code == 404
+    # Once per request, each on a worker thread
+    assert opened == [False, False]
@@ -0,0 +1,153 @@
+import json
+from datetime import datetime
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+from src.main import app
+from src.database.session import get_session
+from src.agents.clarifications import ClarificationStore
+from src.agents.registry import get_agent
+from src.agents.todo_agent import TodoAgent
+from src.services.task_service import TaskService
+from .test_utils import StubModel, create_test_token, make_engine
+
+CANDIDATES = [
+    {"id": "a" * 32, "title": "Buy milk", "completed": False},
+    {"id": "b" * 32, "title": "Milk shake recipe", "completed": False},
+    {"id": "c" * 32, "title": "Return milk bottles", "completed": True},
+]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def ask(store, action="delete_task", arguments=None):
+    return store.ask("u1", "c1", action, "milk", arguments or {}, CANDIDATES)
+
+
+def test_question_lists_numbered_candidates():
+    question = ask(ClarificationStore())
+    assert "Kisko delete karun?" in question
+    assert "1. Buy milk (Pending)" in question and "3. Return milk bottles (Completed)" in question
+
+
+def test_answers_resolve_by_ordinal_number_or_title():
+    store = ClarificationStore()
+    for answer, expected in [("the second one", "b"), ("pehla wala", "a"), ("3", "c"), ("#2", "b"),
+                             ("aakhri", "c"), ("number 1", "a"), ("shake", "b"), ("Buy milk", "a")]:
+        ask(store)
+        result = store.answer("u1", "c1", answer)
+        assert result["tool_calls"][0]["arguments"]["task_id"] == expected * 32, answer
+
+    # "one" and "do" are numbers on their own and filler after another word
+    for answer, expected in [("one", "a"), ("number one", "a"), ("do", "b"), ("number do", "b"), ("ek", "a"),
+                             ("doosra kar do", "b"), ("teesra wala kar do", "c"), ("the last one", "c")]:
+        ask(store)
+        result = store.answer("u1", "c1", answer)
+        assert result["tool_calls"][0]["arguments"]["task_id"] == expected * 32, answer
+    ask(store)
+    assert store.answer("u1", "c1", "that one") is None
+
+    ask(store, "update_task", {"title": "Buy oat milk"})
+    result = store.answer("u1", "c1", "doosra")
+    assert result["tool_calls"] == [{"name": "update_task", "arguments": {
+        "title": "Buy oat milk", "task_id": "b" * 32, "user_id": "u1"}}]
+    assert result["response"] == "Theek hai, task 'Milk shake recipe' ko 'Buy oat milk' kar diya hai. 🙂"
+
+
+def test_unrelated_cancelled_and_expired_answers():
+    clock = Clock()
+    store = ClarificationStore(ttl_seconds=60, clock=clock)
+
+    ask(store)
+    assert store.answer("u1", "c1", "what is the weather") is None
+    # Consumed: the next message is a normal one
+    assert store.answer("u1", "c1", "2") is None
+
+    ask(store)
+    assert store.answer("u1", "c1", "rehne do")["tool_calls"] == []
+
+    ask(store)
+    assert store.answer("u1", "other", "2") is None
+    clock.now += 61
+    assert store.answer("u1", "c1", "2") is None
+    assert store.stats() == {"pending": 0, "asked": 3, "resolved": 0, "cancelled": 1, "abandoned": 1,
+                             "expired": 1}
+
+
+def test_agent_resolves_the_follow_up_without_the_model():
+    model = StubModel('{"response": "Kaunsa?", "tool_calls": []}')
+    agent = TodoAgent(database_url="sqlite://", model=model, model_name="stub")
+    session = agent.task_tools.get_db_session()
+    for title in ("Buy milk", "Milk shake recipe"):
+        TaskService.create_task(session, "user_clarify", title)
+    session.commit()
+    milk_shake = next(t.id for t in TaskService.get_user_tasks(session, "user_clarify") if t.title.startswith("Milk"))
+    session.close()
+
+    question = agent.process_message("user_clarify", "delete milk", "conv1")
+    assert "1. Buy milk" in question["response"] and question["tool_calls"] == []
+
+    result = agent.process_message("user_clarify", "the second one", "conv1")
+    assert result["tool_calls"] == [{"name": "delete_task", "arguments": {"task_id": milk_shake,
+                                                                        "user_id": "user_clarify"}}]
+    assert model.prompts == []
+    assert agent.stats()["clarifications"]["resolved"] == 1
+
+
+def ask_then_answer(tmp_path, user_id, call, message, answer):
+    """Two chat turns over "Write report" and "Send report": the model's `call` names "report", then `answer`."""
+    # A file database: the route writes on worker threads, each with a session of its own
+    engine = make_engine(tmp_path / "chat.db")
+    model = StubModel(json.dumps({"response": "Theek hai.", "tool_calls": [call]}))
+    agent = TodoAgent(engine=engine, model=model, model_name="stub")
+    session = Session(engine)
+    for title in ("Write report", "Send report"):
+        TaskService.create_task(session, user_id, title)
+    session.commit()
+
+    app.dependency_overrides[get_session] = lambda: session
+    app.dependency_overrides[get_agent] = lambda: agent
+    headers = {"Authorization": f"Bearer {create_test_token(user_id)}"}
+    try:
+        client = TestClient(app)
+        first = client.post(f"/api/{user_id}/chat", json={"message": message}, headers=headers).json()
+        assert "Kisko" in first["response"] and "not found" not in first["response"]
+        calls = len(model.prompts)
+
+        second = client.post(f"/api/{user_id}/chat", json={"message": answer,
+                                                            "conversation_id": first["conversation_id"]},
+                             headers=headers).json()
+    finally:
+        app.dependency_overrides.clear()
+
+    assert len(model.prompts) == calls
+    tasks = {t.title: t for t in TaskService.get_user_tasks(session, user_id)}
+    session.close()
+    return second, tasks
+
+
+def test_ambiguous_model_call_is_asked_and_answered_locally(tmp_path):
+    second, tasks = ask_then_answer(tmp_path, "user_clarify_model", {"name": "delete_task",
+                                    "arguments": {"task_id": "report"}},
+                                    "woh report wala kaam hata do yaar", "the second one")
+
+    assert second["response"] == "Theek hai, task 'Send report' delete kar diya hai. 🙂"
+    assert list(tasks) == ["Write report"]
+
+
+def test_clarified_schedule_update_keeps_the_title(tmp_path):
+    second, tasks = ask_then_answer(tmp_path, "user_clarify_due", {"name": "update_task", "arguments": {
+                                    "task_id": "report", "due_date": "2026-10-20T23:59:00"}},
+                                    "report ki date badal do", "doosra")
+
+    assert second["tool_calls"][0]["arguments"] == {"due_date": "2026-10-20T23:59:00",
+                                                    "task_id": tasks["Send report"].id,
+                                                    "user_id": "user_clarify_due"}
+    assert second["response"] == "Theek hai, task 'Send report' (20 Oct) update kar diya hai. 🙂"
+    assert sorted(tasks) == ["Send report", "Write report"]
+    assert tasks["Send report"].due_date == datetime(2026, 10, 20, 23, 59)
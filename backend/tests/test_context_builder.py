@@ -0,0 +1,105 @@
+from src.agents.context_builder import TaskContextBuilder, paginate, resolve_alias, strip_aliases
+from src.agents.intent_engine import IntentEngine
+from src.agents.todo_agent import TodoAgent
+from src.services.task_service import TaskService
+from sqlmodel import Session
+from .test_utils import StubModel, make_engine
+
+
+def make_tasks(n_pending, n_completed):
+    tasks = []
+    for i in range(n_pending + n_completed):
+        tasks.append({
+            "id": f"{i:032d}",
+            "title": f"Errand number {i}",
+            "completed": i >= n_pending,
+            "updated_at": f"2026-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}"
+        })
+    return tasks
+
+
+def test_relevant_task_ranked_first_and_rest_aggregated():
+    tasks = make_tasks(10, 1240) + [{"id": "x" * 32, "title": "Buy milk", "completed": True, "updated_at": "2020-01-01"}]
+    context = TaskContextBuilder(max_tasks=5).build("did I buy the milk?", tasks)
+
+    lines = context["text"].splitlines()
+    assert lines[0] == "- Buy milk (Completed)"
+    # Pending tasks come before the remaining completed ones
+    assert all("(Pending)" in line for line in lines[1:5])
+    assert lines[-1] == "- ...and 6 more pending and 1,240 more completed tasks not shown"
+
+
+def test_token_budget_bounds_context():
+    tasks = make_tasks(500, 0)
+    context = TaskContextBuilder(max_tasks=1000, token_budget=100).build("hello", tasks)
+    assert 0 < len(context["included"]) < 500
+    assert context["tokens"] <= 100 + 20  # budget + aggregate line
+    assert context["omitted_pending"] == 500 - len(context["included"])
+
+
+def test_small_lists_are_not_truncated():
+    tasks = make_tasks(2, 1)
+    context = TaskContextBuilder().build("hi", tasks)
+    assert len(context["included"]) == 3
+    assert "not shown" not in context["text"]
+
+
+def test_paginate_clamps_pages():
+    tasks = make_tasks(45, 0)
+    assert paginate(tasks, 3, 20)[1:] == (3, 3)
+    assert len(paginate(tasks, 3, 20)[0]) == 5
+    assert paginate(tasks, 9, 20)[1] == 3
+
+
+def test_list_intent_pages_through_full_set():
+    engine = IntentEngine(page_size=20)
+    tasks = make_tasks(45, 0)
+
+    first = engine.answer("u1", "show my tasks", tasks)
+    assert "1. Errand number 0" in first["response"]
+    assert "21. Errand number 20" not in first["response"]
+    assert "Page 1/3" in first["response"]
+
+    second = engine.answer("u1", "more", tasks)
+    assert "21. Errand number 20" in second["response"]
+    assert "Page 2/3" in second["response"]
+
+    third = engine.answer("u1", "aur dikhao", tasks)
+    assert "45. Errand number 44" in third["response"]
+    assert "'more'" not in third["response"]
+
+    assert "Page 2/3" in engine.answer("u1", "page 2", tasks)["response"]
+
+
+def test_aliases_replace_ids_and_map_back():
+    tasks = make_tasks(30, 0) + [{"id": "f" * 32, "title": "Buy milk", "completed": False, "updated_at": "2020-01-01"}]
+    context = TaskContextBuilder().build("buy milk", tasks, aliases=True)
+
+    assert context["text"].splitlines()[0] == "- t1: Buy milk (Pending)"
+    assert "f" * 32 not in context["text"]
+    assert context["aliases"]["t1"] == "f" * 32
+    assert resolve_alias(" [T1] ", context["aliases"]) == "f" * 32
+    assert resolve_alias("t99", context["aliases"]) == "t99"
+    assert resolve_alias("Buy milk", context["aliases"]) == "Buy milk"
+    assert strip_aliases(context["text"]).splitlines()[0] == "- Buy milk (Pending)"
+
+    # A tighter budget keeps a prefix of the same table
+    small = TaskContextBuilder().build("buy milk", tasks, token_budget=60, aliases=True)
+    assert small["aliases"].items() <= context["aliases"].items()
+
+
+def test_agent_maps_alias_in_tool_call_to_real_id():
+    engine = make_engine()
+    with Session(engine) as session:
+        milk = TaskService.create_task(session, "u_alias", "Buy milk")
+        TaskService.create_task(session, "u_alias", "Call the plumber")
+        session.commit()
+        milk_id = milk.id
+
+    model = StubModel('{"tool_calls": [{"name": "complete_task", "arguments": {"task_id": "t1"}}], "response": "Ho gaya"}')
+    agent = TodoAgent(engine=engine, model=model, model_name="stub")
+    result = agent.process_message("u_alias", "can you sort out the milk thing for me")
+
+    assert "- t1: Buy milk (Pending)" in model.prompts[0]
+    assert milk_id not in model.prompts[0]
+    assert result["tool_calls"][0]["arguments"]["task_id"] == milk_id
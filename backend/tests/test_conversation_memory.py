@@ -0,0 +1,88 @@
+import json
+from datetime import datetime, timedelta
+from sqlmodel import Session
+from src.agents.conversation_memory import ConversationMemory
+from src.agents.todo_agent import TodoAgent
+from src.agents.token_budget import estimate_tokens
+from src.models.conversation import Conversation
+from src.models.message import Message
+from .test_utils import StubModel, make_engine
+
+START = datetime(2026, 1, 1, 9, 0, 0)
+
+
+def add_messages(session, conversation, start, count):
+    for i in range(start, start + count):
+        role = "user" if i % 2 == 0 else "assistant"
+        session.add(Message(user_id="u1", conversation_id=conversation.id, role=role,
+                            content=f"message {i} about groceries and errands",
+                            created_at=START + timedelta(seconds=i)))
+    session.commit()
+
+
+def new_conversation(session):
+    conversation = Conversation(user_id="u1")
+    session.add(conversation)
+    session.commit()
+    session.refresh(conversation)
+    return conversation
+
+
+def test_window_and_incremental_summary():
+    engine = make_engine()
+    memory = ConversationMemory(window=4)
+    with Session(engine) as session:
+        conversation = new_conversation(session)
+        add_messages(session, conversation, 0, 11)  # message 10 is the turn being answered
+
+        context = memory.load(session, "u1", str(conversation.id), current_message="message 10 about groceries and errands")
+        assert [m["content"].split()[1] for m in context["recent"]] == ["6", "7", "8", "9"]
+        assert context["summary"].splitlines()[0] == "User: message 0 about groceries and errands"
+        assert context["summary"].splitlines()[-1] == "Assistant: message 5 about groceries and errands"
+
+        add_messages(session, conversation, 11, 2)
+        context = memory.load(session, "u1", str(conversation.id), current_message="message 12 about groceries and errands")
+        state = json.loads(session.get(Conversation, conversation.id).context_data)
+        # Only the two messages that slid out of the window were folded in
+        assert state["folded"] == 8
+        assert context["summary"].splitlines()[-1] == "Assistant: message 7 about groceries and errands"
+
+
+def test_summary_is_bounded():
+    engine = make_engine()
+    memory = ConversationMemory(window=4, summary_max_chars=300)
+    with Session(engine) as session:
+        conversation = new_conversation(session)
+        add_messages(session, conversation, 0, 200)
+        context = memory.load(session, "u1", str(conversation.id))
+        assert len(context["summary"]) <= 300
+        assert "message 195" in context["summary"]
+
+
+def test_other_users_and_unknown_conversations_get_no_history():
+    engine = make_engine()
+    memory = ConversationMemory()
+    with Session(engine) as session:
+        conversation = new_conversation(session)
+        add_messages(session, conversation, 0, 4)
+        assert memory.load(session, "someone_else", str(conversation.id))["recent"] == []
+        assert memory.load(session, "u1", "temp-123")["recent"] == []
+
+
+def test_prompt_size_constant_as_conversation_grows():
+    engine = make_engine()
+    model = StubModel()
+    agent = TodoAgent(engine=engine, model=model, model_name="stub")
+    sizes = []
+    with Session(engine) as session:
+        conversation = new_conversation(session)
+        total = 0
+        for count in (200, 400):
+            add_messages(session, conversation, total, count - total)
+            total = count
+            agent.process_message("u1", "woh wala bhi hata do yaar", str(conversation.id))
+            sizes.append(estimate_tokens(model.prompts[-1]))
+
+    assert "Recent messages:" in model.prompts[-1]
+    assert "message 399 about groceries" in model.prompts[-1]
+    assert abs(sizes[1] - sizes[0]) < 0.05 * sizes[0]
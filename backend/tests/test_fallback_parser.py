@@ -0,0 +1,61 @@
+import json
+import os
+import time
+from src.agents.fallback_parser import benchmark, format_benchmark, long_messages, parse_fallback
+from src.agents.title_generator import strip_filler
+from src.agents.todo_agent import TodoAgent
+from src.services.task_service import TaskSnapshot
+from .test_utils import StubModel
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "fallback_corpus.json")
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_corpus_parses():
+    for case in load_corpus():
+        expected = {k: v for k, v in case.items() if k != "message"}
+        assert parse_fallback(case["message"]) == expected, case["message"]
+
+
+def test_rules_keep_the_old_branch_order():
+    assert parse_fallback("add a task called buy eggs") == {"intent": "add", "title": "buy eggs"}
+    assert parse_fallback("create task: pay rent") == {"intent": "add", "title": "pay rent"}
+    assert parse_fallback("please delete the milk task") == {"intent": "delete", "target": "milk"}
+    assert parse_fallback("mark milk done") == {"intent": "complete", "target": "milk"}
+    assert parse_fallback("rename milk as doodh") == {"intent": "edit", "target": "milk", "new": "doodh"}
+    # "market" is not "mark"
+    assert parse_fallback("market road") == {"intent": "chat"}
+    assert parse_fallback("show me everything") == {"intent": "list"}
+
+
+def test_strip_filler_takes_a_run_of_filler_in_one_pass():
+    assert strip_filler('  to my task called "water the plants" ') == "water the plants"
+    assert strip_filler("the") == "the"
+
+
+def test_long_messages_parse_in_linear_time():
+    for message in long_messages(2000):
+        started = time.perf_counter()
+        parse_fallback(message)
+        assert time.perf_counter() - started < 0.05, message[:20]
+
+
+def test_benchmark_reports_every_message():
+    messages = [case["message"] for case in load_corpus()]
+    report = benchmark(messages, repeat=1)
+    assert report["n"] == len(messages) and report["rows"][0]["intent"] == "edit"
+    assert "mean" in format_benchmark(report)
+
+
+def test_agent_fallback_uses_the_rule_table():
+    agent = TodoAgent(database_url="sqlite://", model=StubModel(), model_name="stub")
+    snapshot = TaskSnapshot.from_dicts("u1", 1, [{"id": "m" * 32, "title": "Market", "completed": False}])
+    result = agent._fallback_result("u1", "Edit task market to supermarket", "c1", "", False, True, snapshot)
+    assert result["tool_calls"] == [{"name": "update_task", "arguments": {
+        "task_id": "m" * 32, "title": "supermarket", "user_id": "u1"}}]
+    result = agent._fallback_result("u1", "Edit task market", "c1", "", False, True, snapshot)
+    assert result["tool_calls"] == [] and "naya naam" in result["response"]
@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+from src.agents.providers import OpenAICompatibleProvider, StubLLM, StubProvider, TOOL_DECLARATIONS
+from src.agents.todo_agent import TodoAgent
+from .test_utils import StubModel
+
+ADD_MILK = {"response": "Milk add kar diya 🙂", "tool_calls": [{"name": "add_task", "arguments": {"title": "Milk"}}]}
+MESSAGE = "please put milk on the list for me"
+
+
+def make_agent(model, function_calling=True):
+    return TodoAgent(database_url="sqlite://", model=model, model_name="stub", provider=StubProvider(),
+                     function_calling=function_calling)
+
+
+def test_function_mode_returns_structured_calls():
+    agent = make_agent(StubLLM(ADD_MILK))
+    result = agent.process_message("user_fc", MESSAGE)
+
+    assert result["response"] == "Milk add kar diya 🙂"
+    assert result["tool_calls"] == [{"name": "add_task", "arguments": {"title": "Milk", "user_id": "user_fc"}}]
+    stats = agent.reply_modes.stats()["function"]
+    assert (stats["turns"], stats["parse_failures"]) == (1, 0)
+
+
+def test_function_mode_prompt_is_smaller():
+    json_agent = make_agent(StubLLM(ADD_MILK), function_calling=False)
+    function_agent = make_agent(StubLLM(ADD_MILK))
+    json_prompt = json_agent._build_prompt(MESSAGE, [], mode="json")[0]
+    function_prompt = function_agent._build_prompt(MESSAGE, [], mode="function")[0]
+
+    assert "OUTPUT FORMAT" in json_prompt and "OUTPUT FORMAT" not in function_prompt
+    assert "TOOL CALLS USAGE" not in function_prompt
+
+    # Both modes on one agent: the health stats report the measured savings
+    agent = make_agent(StubLLM(ADD_MILK))
+    agent.process_message("user_fc", MESSAGE)
+    agent.function_calling = False
+    agent.process_message("user_fc", MESSAGE + " too")
+    assert agent.stats()["reply_modes"]["prompt_token_savings"] > 50
+
+
+def test_function_mode_streams_plain_text_and_calls():
+    agent = make_agent(StubLLM(ADD_MILK))
+    events = list(agent.stream_message("user_fc", MESSAGE))
+
+    text = "".join(e["text"] for e in events if e["type"] == "token")
+    assert text == "Milk add kar diya 🙂"
+    assert [e["call"]["name"] for e in events if e["type"] == "tool_call"] == ["add_task"]
+    assert events[-1]["result"]["tool_calls"][0]["arguments"]["title"] == "Milk"
+
+
+def test_function_mode_falls_back_to_json_text():
+    # A model that ignores the declared tools and writes the JSON reply
+    model = StubModel('```json\n{"tool_calls": [{"name": "complete_task", "arguments": {"task_id": "Milk"}}], '
+                      '"response": "Done"}\n```')
+    agent = make_agent(model)
+    result = agent.process_message("user_fc", MESSAGE)
+
+    assert result["response"] == "Done"
+    assert result["tool_calls"][0]["name"] == "complete_task"
+    assert agent.reply_modes.stats()["function"]["parse_failures"] == 0
+
+
+def test_json_mode_counts_parse_failures():
+    agent = make_agent(StubModel('{"response": "half a reply'), function_calling=False)
+    agent.process_message("user_fc", MESSAGE)
+    assert agent.reply_modes.stats()["json"]["parse_failures"] == 1
+
+
+def test_openai_compatible_model_returns_native_calls():
+    def tool_call(index, name=None, arguments=None):
+        return SimpleNamespace(index=index, function=SimpleNamespace(name=name, arguments=arguments))
+
+    def chunk(content=None, tool_calls=None):
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content, tool_calls=tool_calls))])
+
+    class Completions:
+        def create(self, **kwargs):
+            self.kwargs = kwargs
+            if kwargs["stream"]:
+                return iter([
+                    chunk(tool_calls=[tool_call(0, "add_task", '{"ti')]),
+                    chunk(tool_calls=[tool_call(0, None, 'tle": "Milk"}')]),
+                    chunk(content="Theek hai"),
+                ])
+            message = SimpleNamespace(content=None, tool_calls=[
+                SimpleNamespace(function=SimpleNamespace(name="list_tasks", arguments='{"status": "all"}')),
+                SimpleNamespace(function=SimpleNamespace(name="add_task", arguments='{"title": ')),
+            ])
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    completions = Completions()
+    provider = OpenAICompatibleProvider(candidates=["local"], client=SimpleNamespace(
+        chat=SimpleNamespace(completions=completions), models=SimpleNamespace(list=lambda: [])))
+    tools = provider.declare_tools(TOOL_DECLARATIONS)
+    model = provider.get_model("local")
+
+    response = model.generate_content("hi", tools=tools)
+    assert completions.kwargs["tools"][0] == {"type": "function", "function": TOOL_DECLARATIONS[0]}
+    assert response.tool_calls == [
+        {"name": "list_tasks", "arguments": {"status": "all"}},
+        {"name": "add_task", "arguments": None}
+    ]
+
+    chunks = list(model.generate_content("hi", stream=True, tools=tools))
+    assert [c.text for c in chunks] == ["Theek hai", ""]
+    assert chunks[-1].tool_calls == [{"name": "add_task", "arguments": {"title": "Milk"}}]
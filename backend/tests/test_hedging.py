@@ -0,0 +1,125 @@
+import time
+from concurrent.futures import Future
+import pytest
+from src.agents.hedging import Hedger
+from src.agents.model_health import ModelHealthTracker, CLOSED, HALF_OPEN
+from src.agents.todo_agent import TodoAgent
+from .test_utils import StubModel, make_engine
+
+
+def slow(value, seconds):
+    def attempt():
+        time.sleep(seconds)
+        return value
+    return attempt
+
+
+def test_hedge_fires_and_wins_when_primary_is_slow():
+    hedger = Hedger(default_delay=0.05)
+    started = time.perf_counter()
+    result, hedged = hedger.call(slow("primary", 1.0), lambda: slow("backup", 0.01))
+    assert (result, hedged) == ("backup", True)
+    assert time.perf_counter() - started < 0.5
+    assert hedger.stats()["hedges_fired"] == 1
+    assert hedger.stats()["hedges_won"] == 1
+    hedger.shutdown()
+
+
+def test_no_hedge_when_primary_is_fast():
+    hedger = Hedger(default_delay=0.5)
+    backups = []
+    result, hedged = hedger.call(slow("primary", 0.01), lambda: backups.append(1))
+    assert (result, hedged) == ("primary", False)
+    assert backups == []
+    assert hedger.stats()["hedges_fired"] == 0
+    hedger.shutdown()
+
+
+def test_backup_answer_used_when_primary_fails_after_hedging():
+    def failing():
+        time.sleep(0.2)
+        raise TimeoutError("primary timed out")
+
+    hedger = Hedger(default_delay=0.05)
+    assert hedger.call(failing, lambda: slow("backup", 0.3)) == ("backup", True)
+    with pytest.raises(TimeoutError):
+        hedger.call(failing, lambda: None)
+    hedger.shutdown()
+
+
+def test_delay_follows_latency_percentile():
+    hedger = Hedger(percentile=0.95, min_delay=0.0, max_delay=10)
+    for i in range(1, 101):
+        hedger.observe(i / 100)
+    assert hedger.delay() == pytest.approx(0.96)
+    hedger.shutdown()
+
+
+def test_agent_hedges_to_next_candidate():
+    engine = make_engine()
+    primary = StubModel(reply='{"response": "slow", "tool_calls": []}', delay=1.0)
+    backup = StubModel(reply='{"response": "fast", "tool_calls": []}')
+    agent = TodoAgent(engine=engine, model=primary, model_name="primary", candidates=["primary", "backup"],
+                      hedger=Hedger(default_delay=0.05))
+    agent._models["backup"] = backup
+
+    started = time.perf_counter()
+    result = agent.process_message("u1", "kuch mazedaar batao yaar")
+    assert result["response"] == "fast"
+    assert time.perf_counter() - started < 0.5
+    assert agent.stats()["hedging"]["hedges_won"] == 1
+    agent.hedger.shutdown()
+
+
+def test_losing_attempt_is_reported():
+    # A loser still queued is cancelled and reported without a result
+    lost = []
+    Hedger._lose(Future(), True, lambda *a: lost.append(a))
+    assert lost == [(True, None)]
+
+    # A loser already running is reported with its result when it finishes
+    hedger = Hedger(default_delay=0.05)
+    lost = []
+    assert hedger.call(slow("primary", 0.3), lambda: slow("backup", 0.01), lambda *a: lost.append(a)) == \
+        ("backup", True)
+    time.sleep(0.4)
+    assert lost == [(False, "primary")]
+    hedger.shutdown()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_half_open_probe_that_loses_the_hedge_lets_the_breaker_recover():
+    engine = make_engine()
+    clock = FakeClock()
+    health = ModelHealthTracker(["primary", "backup"], failure_threshold=1, backoff_seconds=1, clock=clock)
+    primary = StubModel(reply='{"response": "primary", "tool_calls": []}', delay=0.2)
+    backup = StubModel(reply='{"response": "backup", "tool_calls": []}', delay=0.5)
+    agent = TodoAgent(engine=engine, model=primary, model_name="primary", candidates=["primary", "backup"],
+                      model_health=health, hedger=Hedger(default_delay=0.05))
+    agent._models["backup"] = backup
+    health.record_failure("backup", 1.0, TimeoutError())
+    clock.now += 5
+
+    # The hedge goes to the half-open backup, which opens its stream after the primary has won
+    events = list(agent.stream_message("u1", "kuch mazedaar batao yaar"))
+    assert events[-1]["result"]["response"] == "primary"
+    assert health.state("backup") == HALF_OPEN
+    time.sleep(0.6)
+    assert health.state("backup") == CLOSED
+    assert health.acquire(exclude={"primary"}) == "backup"
+
+    # A probe cancelled before it ran gives its slot back
+    health.record_failure("backup", 1.0, TimeoutError())
+    clock.now += 5
+    assert health.acquire(exclude={"primary"}) == "backup"
+    assert health.acquire(exclude={"primary"}) is None
+    agent._lost_attempt({False: "primary", True: "backup"}, True, True, None)
+    assert health.acquire(exclude={"primary"}) == "backup"
+    agent.hedger.shutdown()
@@ -0,0 +1,110 @@
+import itertools
+import pytest
+from src.agents.intent_classifier import (
+    IntentClassifier, load_log_examples, label_from_reply, legacy_fallback_intent, evaluate
+)
+from src.agents.intent_engine import IntentEngine
+
+ITEMS = ["buy milk", "call mom", "pay bills", "doodh", "gym jana", "read book", "fix bike", "water plants"]
+NEW = ["call dad", "buy eggs", "sabzi lana", "clean room"]
+TEMPLATES = {
+    "add": ["add {x}", "{x} add kar do", "remind me to {x}", "add task {x}", "{x} bhi add karo"],
+    "delete": ["delete {x}", "{x} mita do", "{x} wala task hata do", "remove {x}", "{x} delete kar do"],
+    "complete": ["complete {x}", "{x} ho gaya", "mark {x} as done", "{x} complete kar do", "finish {x}"],
+    "edit": ["edit {x} to {y}", "{x} ko {y} kar do", "rename {x} to {y}", "change {x} to {y}"],
+    "list": ["show my tasks", "mere tasks dikhao", "list tasks", "kya kya tasks hain", "show pending tasks"],
+    "chat": ["hello kaise ho", "aaj mausam kaisa hai", "thank you so much", "tum kaun ho",
+             "mujhe thori motivation chahiye", "what can you do", "good night", "kya haal hai"],
+}
+
+
+def corpus():
+    examples = []
+    for intent, templates in TEMPLATES.items():
+        for template, x, y in itertools.product(templates, ITEMS, NEW):
+            examples.append((template.format(x=x, y=y), intent))
+    return sorted(set(examples))
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return IntentClassifier.train(corpus(), dims=2 ** 12, epochs=15)
+
+
+@pytest.mark.parametrize("message,intent", [
+    ("add fix the sink", "add"),
+    ("fix the sink add kar do", "add"),
+    ("delete fix the sink", "delete"),
+    ("fix the sink ho gaya", "complete"),
+    ("mere tasks dikhao", "list"),
+])
+def test_predicts_intent_for_unseen_titles(classifier, message, intent):
+    parsed = classifier.predict(message)
+    assert parsed is not None
+    assert parsed["intent"] == intent
+
+
+def test_chat_is_not_a_command(classifier):
+    assert classifier.predict("hello kaise ho") is None
+
+
+def test_tags_slot_spans(classifier):
+    parsed = classifier.predict("edit call mom to buy eggs")
+    assert parsed["slots"] == {"target": "call mom", "new": "buy eggs"}
+
+
+def test_artifact_round_trip(classifier, tmp_path):
+    path = tmp_path / "intent.npz"
+    classifier.save(str(path))
+    loaded = IntentClassifier.load(str(path))
+    assert loaded.meta == classifier.meta
+    assert loaded.predict("delete water plants") == classifier.predict("delete water plants")
+
+
+def test_engine_uses_classifier_when_rules_do_not_match(classifier):
+    tasks = [{"id": "a" * 32, "title": "Water plants", "completed": False}]
+    message = "water plants wala kaam hata do yaar"
+    assert IntentEngine().parse(message) is None
+
+    result = IntentEngine(classifier=classifier).answer("u1", message, tasks)
+    assert result is not None
+    assert result["tool_calls"] == [{"name": "delete_task", "arguments": {"task_id": "a" * 32, "user_id": "u1"}}]
+
+
+def test_loads_examples_from_interaction_log(tmp_path):
+    log = tmp_path / "app.log"
+    log.write_text(
+        "2026-01-01 10:00:00 - src.api.routes.chat - INFO - AGENT_INTERACTION - User: u1, Conversation: c1, "
+        "Input: add milk..., Response: Theek hai..., Tools: ['add_task']\n"
+        "2026-01-01 10:00:01 - src.api.routes.chat - INFO - AGENT_INTERACTION - User: u1, Conversation: c1, "
+        "Input: hello..., Response: Assalam o alaikum!..., Tools: None\n"
+        "unrelated line\n"
+    )
+    assert load_log_examples(str(log)) == [("add milk", "add"), ("hello", "chat")]
+
+
+def test_reply_labels():
+    assert label_from_reply("Theek hai, task 'Buy milk' delete kar diya hai. 🙂") == "delete"
+    assert label_from_reply("Theek hai, task 'Buy milk' ko 'Buy eggs' kar diya hai. 🙂") == "edit"
+    assert label_from_reply("Assalam o alaikum!") is None
+
+
+def test_report_compares_against_legacy_regexes(classifier):
+    held_out = [("fix the sink mita do", "delete"), ("hello kaise ho", "chat"), ("add fix the sink", "add")]
+    report = evaluate(classifier, held_out)
+    assert set(report) == {"classifier", "intent_engine", "legacy_fallback"}
+    assert report["classifier"]["accuracy"] >= report["legacy_fallback"]["accuracy"]
+    assert legacy_fallback_intent("fix the sink mita do") == "chat"
+
+
+def test_accuracy_on_held_out_titles(classifier):
+    # Every template again, over titles the classifier was not trained on. Measured when this was added
+    # (105 messages): classifier 1.000, intent_engine 0.810, legacy_fallback 0.781
+    held_out = sorted({(template.format(x=x, y=y), intent) for intent, templates in TEMPLATES.items()
+                       for template, x, y in itertools.product(templates, ["fix the sink", "book tickets",
+                                                                            "dawai lena", "email boss"],
+                                                               ["wash car", "pay rent"])})
+    report = evaluate(classifier, held_out)
+    assert report["classifier"]["accuracy"] >= 0.95
+    assert report["classifier"]["accuracy"] > report["intent_engine"]["accuracy"]
+    assert report["classifier"]["accuracy"] > report["legacy_fallback"]["accuracy"]
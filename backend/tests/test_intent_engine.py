@@ -0,0 +1,111 @@
+import pytest
+from src.agents.intent_engine import IntentEngine, match_tasks
+
+TASKS = [
+    {"id": "a" * 32, "title": "Buy milk", "completed": False},
+    {"id": "b" * 32, "title": "Call mom", "completed": False},
+    {"id": "c" * 32, "title": "Pay bills", "completed": True},
+    {"id": "d" * 32, "title": "Milk shake recipe", "completed": False},
+]
+
+
+@pytest.fixture
+def engine():
+    return IntentEngine()
+
+
+@pytest.mark.parametrize("message,intent", [
+    ("add milk", "add"),
+    ("Add task: buy eggs", "add"),
+    ("remind me to call the plumber", "add"),
+    ("doodh ka task add kar do", "add"),
+    ("doodh list mein daal do", "add"),
+    ("delete call mom", "delete"),
+    ("call mom mita do", "delete"),
+    ("pay bills wala task hata do", "delete"),
+    ("mark call mom as done", "complete"),
+    ("complete call mom", "complete"),
+    ("call mom wala task khatam", "complete"),
+    ("call mom task ho gaya", "complete"),
+    ("call mom complete kar do", "complete"),
+    ("edit call mom to call dad", "edit"),
+    ("call mom ka naam call dad rakh do", "edit"),
+    ("call mom ko rename karke call dad kar do", "edit"),
+    ("new task: water plants", "add"),
+    ("show my tasks", "list"),
+    ("mere tasks dikhao", "list"),
+    ("kya kya tasks hain", "list"),
+])
+def test_parse_recognizes_english_and_roman_urdu(engine, message, intent):
+    parsed = engine.parse(message)
+    assert parsed is not None
+    assert parsed["intent"] == intent
+
+
+@pytest.mark.parametrize("message", [
+    "what should I add to my list?",
+    "how do I finish my project faster",
+    "Buy groceries at market",
+    "hello there, how are you doing today my friend",
+    # "ko ... kar do" is an ordinary request, not a rename
+    "ammi ko call kar do",
+    "report ko urgent kar do",
+    "milk ko fridge mein rakh do",
+    # "new" alone is part of the title, not an add verb
+    "new york trip",
+    # Without a task marker these are about the world, not the task list
+    "chai mein cheeni dal do",
+    "doodh add kar do",
+    "milk khatam ho gaya",
+    "call mom ho gaya",
+])
+def test_parse_leaves_chatty_input_to_the_model(engine, message):
+    assert engine.parse(message) is None
+
+
+def test_answer_builds_tool_calls_and_roman_urdu_reply(engine):
+    result = engine.answer("u1", "call mom mita do", TASKS, "conv")
+    assert result["tool_calls"] == [{"name": "delete_task", "arguments": {"task_id": "b" * 32, "user_id": "u1"}}]
+    assert result["response"] == "Theek hai, task 'Call mom' delete kar diya hai. 🙂"
+    assert result["conversation_id"] == "conv"
+
+    result = engine.answer("u1", "edit call mom to call dad", TASKS)
+    assert result["tool_calls"][0]["arguments"] == {"task_id": "b" * 32, "title": "call dad", "user_id": "u1"}
+
+    result = engine.answer("u1", "add milk, eggs and bread", TASKS)
+    assert [c["arguments"]["title"] for c in result["tool_calls"]] == ["milk", "eggs", "bread"]
+
+
+def test_answer_leaves_unmarked_statements_to_the_model(engine):
+    # "Buy milk" exists, but the milk running out does not complete it
+    assert engine.answer("u1", "milk khatam ho gaya", TASKS) is None
+    assert engine.answer("u1", "chai mein cheeni dal do", TASKS) is None
+    result = engine.answer("u1", "buy milk wala task ho gaya", TASKS)
+    assert result["tool_calls"] == [{"name": "complete_task", "arguments": {"task_id": "a" * 32, "user_id": "u1"}}]
+
+
+def test_answer_lists_filtered_tasks(engine):
+    result = engine.answer("u1", "show pending tasks", TASKS)
+    assert result["tool_calls"][0]["arguments"]["status"] == "pending"
+    assert "Pay bills" not in result["response"]
+    assert "3 pending tasks" in result["response"]
+
+
+def test_answer_defers_weak_targets_and_asks_about_ambiguous_ones(engine):
+    # "all" only appears inside "call"
+    assert engine.answer("u1", "all done", TASKS) is None
+    # unknown task
+    assert engine.answer("u1", "complete laundry", TASKS) is None
+    # "milk" matches two tasks: the pending call and its candidates come back instead of tool calls
+    result = engine.answer("u1", "delete milk", TASKS)
+    assert result["tool_calls"] == []
+    assert result["clarify"]["action"] == "delete_task"
+    assert [t["title"] for t in result["clarify"]["candidates"]] == ["Buy milk", "Milk shake recipe"]
+    assert engine.stats() == {"handled": 1, "deferred": 2, "classified": 0}
+
+
+def test_match_tasks_mirrors_resolve_task_rules():
+    assert match_tasks("buy milk", TASKS) == (TASKS[0], "FOUND")
+    assert match_tasks("c" * 32, TASKS) == (TASKS[2], "FOUND")
+    assert match_tasks("milk", TASKS) == (None, "AMBIGUOUS")
+    assert match_tasks("laundry", TASKS) == (None, "NOT_FOUND")
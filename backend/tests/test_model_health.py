@@ -0,0 +1,94 @@
+import time
+from src.agents.model_health import ModelHealthTracker, retry_after_seconds, CLOSED, OPEN
+from src.agents.todo_agent import TodoAgent
+from .test_utils import make_engine
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class RateLimited(Exception):
+    code = 429
+
+    def __init__(self, retry_after):
+        super().__init__("429 Resource has been exhausted")
+        self.retry_after = retry_after
+
+
+class FailingModel:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        self.calls += 1
+        raise TimeoutError("Deadline exceeded")
+
+
+def test_breaker_opens_after_repeated_failures_and_recovers():
+    clock = FakeClock()
+    tracker = ModelHealthTracker(["a"], failure_threshold=3, backoff_seconds=10, clock=clock)
+    for _ in range(3):
+        assert tracker.acquire() == "a"
+        tracker.record_failure("a", 5.0, TimeoutError())
+    assert tracker.state("a") == OPEN
+    assert tracker.acquire() is None
+    assert tracker.stats()["short_circuited"] == 1
+
+    # Backoff is 10s with +/-50% jitter
+    clock.now += 15.1
+    assert tracker.acquire() == "a"       # the single half-open probe
+    assert tracker.acquire() is None      # others still short-circuit meanwhile
+    tracker.record_success("a", 0.2)
+    assert tracker.state("a") == CLOSED
+    assert tracker.acquire() == "a"
+
+
+def test_rate_limit_opens_immediately_and_honours_retry_after():
+    clock = FakeClock()
+    tracker = ModelHealthTracker(["a", "b"], backoff_seconds=1, clock=clock)
+    tracker.record_failure("a", 0.1, RateLimited(retry_after=30))
+    assert tracker.state("a") == OPEN
+    assert tracker.ordered() == ["b"]
+    clock.now += 29
+    assert tracker.ordered() == ["b"]
+    clock.now += 1.5
+    assert "a" in tracker.ordered()
+
+
+def test_retry_after_parsing():
+    assert retry_after_seconds(RateLimited(retry_after="12")) == 12.0
+    assert retry_after_seconds(Exception("429 Quota exceeded. Please retry in 7.5s.")) == 7.5
+    assert retry_after_seconds(Exception("boom")) is None
+
+
+def test_orders_candidates_by_health_then_latency():
+    tracker = ModelHealthTracker(["primary", "secondary"], clock=FakeClock())
+    tracker.record_success("primary", 2.0)
+    tracker.record_success("secondary", 0.3)
+    assert tracker.ordered() == ["secondary", "primary"]
+    tracker.record_failure("secondary", 0.3)
+    tracker.record_failure("secondary", 0.3)
+    assert tracker.ordered() == ["primary", "secondary"]
+
+
+def test_agent_short_circuits_to_fallback_while_breaker_open():
+    engine = make_engine()
+    model = FailingModel()
+    agent = TodoAgent(engine=engine, model=model, model_name="stub",
+                      model_health=ModelHealthTracker(["stub"], failure_threshold=3, backoff_seconds=60))
+
+    for _ in range(3):
+        agent.process_message("u1", "kuch mazedaar batao yaar")
+    assert model.calls == 3
+
+    started = time.perf_counter()
+    result = agent.process_message("u1", "kuch aur batao yaar")
+    assert time.perf_counter() - started < 0.5
+    assert model.calls == 3
+    assert result["response"]
+    assert agent.stats()["model_health"]["models"]["stub"]["state"] == OPEN
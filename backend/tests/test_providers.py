@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+import pytest
+from src.agents.providers import OpenAICompatibleProvider, StubProvider, create_provider
+from src.agents.todo_agent import TodoAgent
+from .test_utils import make_engine
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if kwargs["stream"]:
+            return iter([
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content='{"response": '))]),
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None))]),
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content='"local"}'))]),
+            ])
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content='{"response": "local", "tool_calls": []}'))],
+            usage=SimpleNamespace(prompt_tokens=120, completion_tokens=9)
+        )
+
+
+class FakeClient:
+    base_url = "http://localhost:8080/v1"
+
+    def __init__(self, served):
+        self.chat = SimpleNamespace(completions=FakeCompletions())
+        self.models = SimpleNamespace(list=lambda: [SimpleNamespace(id=m) for m in served])
+
+
+def test_openai_compatible_model_maps_responses():
+    client = FakeClient(["qwen2.5-1.5b"])
+    provider = OpenAICompatibleProvider(candidates=["qwen2.5-1.5b"], client=client)
+    model = provider.get_model("qwen2.5-1.5b")
+
+    response = model.generate_content("hi", request_options={"timeout": 5})
+    assert response.text == '{"response": "local", "tool_calls": []}'
+    assert response.usage_metadata.prompt_token_count == 120
+    assert client.chat.completions.calls[0]["timeout"] == 5
+    assert client.chat.completions.calls[0]["messages"] == [{"role": "user", "content": "hi"}]
+
+    chunks = [c.text for c in model.generate_content("hi", stream=True)]
+    assert chunks == ['{"response": ', '"local"}']
+
+
+def test_openai_compatible_resolve_skips_models_not_served():
+    provider = OpenAICompatibleProvider(candidates=["big-model", "small-model"], client=FakeClient(["small-model"]))
+    _, name = provider.resolve()
+    assert name == "small-model"
+
+
+def test_agent_runs_on_any_provider():
+    provider = OpenAICompatibleProvider(candidates=["local"], client=FakeClient(["local"]))
+    agent = TodoAgent(engine=make_engine(), provider=provider)
+    assert agent.model_name == "local"
+    assert agent.process_message("u1", "kuch mazedaar batao yaar")["response"] == "local"
+    assert agent.stats()["provider"] == "openai"
+
+    stub_agent = TodoAgent(engine=make_engine(), provider=StubProvider())
+    assert stub_agent.process_message("u1", "kuch mazedaar batao yaar")["response"] == "Theek hai 🙂"
+
+
+def test_provider_selected_by_configuration(monkeypatch):
+    monkeypatch.setenv("LLM_PROVIDER", "stub")
+    assert isinstance(create_provider(), StubProvider)
+    with pytest.raises(ValueError):
+        create_provider("mystery")
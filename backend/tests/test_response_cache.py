@@ -0,0 +1,94 @@
+import json
+from sqlmodel import Session
+from src.agents.todo_agent import TodoAgent
+from src.agents.response_cache import ResponseCache
+from src.services.task_service import TaskService, task_versions
+from .test_utils import StubModel, make_engine
+
+
+def make_agent(reply: str):
+    engine = make_engine()
+    model = StubModel(reply=reply)
+    return TodoAgent(engine=engine, model=model, model_name="stub"), model, engine
+
+
+LIST_REPLY = json.dumps({
+    "response": "Aapke paas 1 task hai: 1. Milk (Pending)",
+    "tool_calls": [{"name": "list_tasks", "arguments": {"status": "all"}}]
+})
+
+
+def test_repeat_message_hits_cache_until_tasks_change():
+    """
+    A repeated read-only message skips the model until a TaskService mutation
+    bumps the user's task-set version.
+    """
+    agent, model, engine = make_agent(LIST_REPLY)
+    user_id = "cache_user"
+
+    first = agent.process_message(user_id, "Aaj kya karna hai mujhe?", "conv-1")
+    second = agent.process_message(user_id, "  aaj KYA karna hai mujhe ", "conv-2")
+
+    assert len(model.prompts) == 1
+    assert second["response"] == first["response"]
+    assert second["conversation_id"] == "conv-2"
+    assert agent.response_cache.stats()["hits"] == 1
+    assert agent.response_cache.stats()["misses"] == 1
+
+    with Session(engine) as session:
+        TaskService.create_task(session, user_id, "Milk")
+        session.commit()
+
+    agent.process_message(user_id, "aaj kya karna hai mujhe", "conv-1")
+    assert len(model.prompts) == 2
+    assert agent.response_cache.stats()["misses"] == 2
+
+
+def test_mutating_replies_are_not_cached():
+    """
+    Replies that carry add/delete/update/complete calls are always sent to the model.
+    """
+    reply = json.dumps({
+        "response": "Milk add kar diya. 🙂",
+        "tool_calls": [{"name": "add_task", "arguments": {"title": "milk"}}]
+    })
+    agent, model, _ = make_agent(reply)
+
+    agent.process_message("cache_user_2", "doodh lana hai, yaad rakhna")
+    agent.process_message("cache_user_2", "doodh lana hai, yaad rakhna")
+
+    assert len(model.prompts) == 2
+    assert agent.response_cache.stats()["size"] == 0
+
+
+def test_cache_is_bounded_and_expires():
+    cache = ResponseCache(max_entries=2, ttl_seconds=0)
+    result = {"response": "ok", "tool_calls": []}
+    for i in range(3):
+        cache.put(cache.make_key("u", f"msg {i}", 0), result)
+
+    assert cache.stats()["size"] == 2
+    # ttl of zero: everything is already stale
+    assert cache.get(cache.make_key("u", "msg 2", 0)) is None
+
+
+def test_task_version_moves_only_when_a_write_commits():
+    engine = make_engine()
+    user_id = "user_version_commit"
+    with Session(engine) as session:
+        start = task_versions.get(user_id)
+        task = TaskService.create_task(session, user_id, "Milk")
+        # A read between the write and its commit still sees the old version
+        assert task_versions.get(user_id) == start
+        session.commit()
+        assert task_versions.get(user_id) == start + 1
+
+        TaskService.delete_task(session, user_id, task.id)
+        session.rollback()
+        session.commit()
+        assert task_versions.get(user_id) == start + 1
+
+        TaskService.complete_tasks(session, user_id, [task.id])
+        TaskService.create_task(session, user_id, "Eggs")
+        session.commit()
+        assert task_versions.get(user_id) == start + 2
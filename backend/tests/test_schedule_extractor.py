@@ -0,0 +1,135 @@
+from datetime import datetime
+
+import pytest
+from sqlmodel import Session, select
+from src.agents.intent_engine import IntentEngine
+from src.agents.schedule_extractor import Schedule, apply_schedule, describe, extract_schedule
+from src.models.task import Task
+from src.services.task_service import TaskService
+from src.tools.tool_engine import ToolEngine
+from .test_utils import make_engine
+
+# Saturday morning
+NOW = datetime(2026, 10, 17, 10, 0)
+
+
+@pytest.mark.parametrize("text,title,due", [
+    # Relative days, English and Roman Urdu
+    ("call mom today", "call mom", datetime(2026, 10, 17, 23, 59)),
+    ("call mom tomorrow", "call mom", datetime(2026, 10, 18, 23, 59)),
+    ("kal tak assignment jama karna", "assignment jama karna", datetime(2026, 10, 18, 23, 59)),
+    ("pay rent day after tomorrow", "pay rent", datetime(2026, 10, 19, 23, 59)),
+    ("parson bank jana", "bank jana", datetime(2026, 10, 19, 23, 59)),
+    ("tonight movie", "movie", datetime(2026, 10, 17, 21, 0)),
+    ("agle hafte report", "report", datetime(2026, 10, 19, 23, 59)),
+    ("plan trip next month", "plan trip", datetime(2026, 11, 1, 23, 59)),
+    ("in 3 days renew license", "renew license", datetime(2026, 10, 20, 23, 59)),
+    ("2 din baad bill", "bill", datetime(2026, 10, 19, 23, 59)),
+    ("call mom in 2 hours", "call mom", datetime(2026, 10, 17, 12, 0)),
+    ("30 minute baad chai", "chai", datetime(2026, 10, 17, 10, 30)),
+    # Weekdays: the next occurrence, today included unless "next"
+    ("submit report by friday", "submit report", datetime(2026, 10, 23, 23, 59)),
+    ("pay bill juma ko", "pay bill", datetime(2026, 10, 23, 23, 59)),
+    ("peer ko meeting", "meeting", datetime(2026, 10, 19, 23, 59)),
+    ("clean house saturday", "clean house", datetime(2026, 10, 17, 23, 59)),
+    ("clean house next saturday", "clean house", datetime(2026, 10, 24, 23, 59)),
+    # Absolute dates; without a year a passed date means next year
+    ("exam 2026-11-05", "exam", datetime(2026, 11, 5, 23, 59)),
+    ("pay rent on 1/11", "pay rent", datetime(2026, 11, 1, 23, 59)),
+    ("meeting 20 oct 3pm", "meeting", datetime(2026, 10, 20, 15, 0)),
+    ("dentist oct 20th", "dentist", datetime(2026, 10, 20, 23, 59)),
+    ("exam may 5th", "exam", datetime(2027, 5, 5, 23, 59)),
+    ("exam 5 may", "exam", datetime(2027, 5, 5, 23, 59)),
+    ("exam may 5, 2027", "exam", datetime(2027, 5, 5, 23, 59)),
+    ("renew passport 5 march", "renew passport", datetime(2027, 3, 5, 23, 59)),
+    # Times, with a.m./p.m. read from the part of the day
+    ("call mom kal subah 9 baje", "call mom", datetime(2026, 10, 18, 9, 0)),
+    ("parson shaam 7 baje gym", "gym", datetime(2026, 10, 19, 19, 0)),
+    ("raat 11 baje dawa", "dawa", datetime(2026, 10, 17, 23, 0)),
+    ("sawa 9 baje class", "class", datetime(2026, 10, 18, 9, 15)),
+    ("sarhe 4 baje meeting", "meeting", datetime(2026, 10, 17, 16, 30)),
+    ("paune 5 baje chai", "chai", datetime(2026, 10, 17, 16, 45)),
+    ("call ali at 9:30 pm", "call ali", datetime(2026, 10, 17, 21, 30)),
+    ("doctor appointment tomorrow at 5", "doctor appointment", datetime(2026, 10, 18, 17, 0)),
+    ("noon lunch with sara", "lunch with sara", datetime(2026, 10, 17, 12, 0)),
+    # A time alone that already passed today means tomorrow
+    ("workout 7am", "workout", datetime(2026, 10, 18, 7, 0)),
+    ("call at 8", "call", datetime(2026, 10, 18, 8, 0)),
+])
+def test_due_dates(text, title, due):
+    schedule = extract_schedule(text, NOW)
+    assert (schedule.title, schedule.due_date) == (title, due)
+
+
+@pytest.mark.parametrize("text,title,priority", [
+    ("submit report urgent", "submit report", "high"),
+    ("ASAP: fix the leak", "fix the leak", "high"),
+    ("zaroori doctor ko call karna", "doctor ko call karna", "high"),
+    ("exam prep (high priority)", "exam prep", "high"),
+    ("kam zaroori: clean garage", "clean garage", "low"),
+    ("sort photos, not urgent", "sort photos", "low"),
+    ("read book fursat mein", "read book", "low"),
+    ("water plants priority: medium", "water plants", "medium"),
+])
+def test_priorities(text, title, priority):
+    schedule = extract_schedule(text, NOW)
+    assert (schedule.title, schedule.priority, schedule.due_date) == (title, priority, None)
+
+
+def test_plain_titles_are_left_alone():
+    for text in ("buy milk", "bring important documents", "read the calendar app docs", "urgent",
+                 "read may 5 chapters"):
+        assert extract_schedule(text, NOW) == Schedule(text)
+    schedule = extract_schedule("kal tak assignment zaroori", NOW)
+    assert (schedule.title, schedule.due_date, schedule.priority) == \
+        ("assignment", datetime(2026, 10, 18, 23, 59), "high")
+
+
+def test_apply_schedule_reads_titles_then_the_message():
+    calls = [{"name": "add_task", "arguments": {"title": "call mom kal 5 baje"}},
+             {"name": "add_task", "arguments": {"title": "buy milk"}},
+             {"name": "update_task", "arguments": {"task_id": "bread", "new_title": "buy bread"}},
+             {"name": "delete_task", "arguments": {"task_id": "eggs"}}]
+    apply_schedule(calls, "call mom kal 5 baje, milk urgent, bread rename, eggs hata do", NOW)
+
+    assert calls[0]["arguments"] == {"title": "call mom", "due_date": "2026-10-18T17:00:00"}
+    # The model dropped the schedule words from this title; they come from the message
+    assert calls[1]["arguments"]["due_date"] == "2026-10-18T17:00:00"
+    # A rename keeps its due date: the date in the message is for something else
+    assert calls[2]["arguments"] == {"task_id": "bread", "new_title": "buy bread"}
+    assert calls[3]["arguments"] == {"task_id": "eggs"}
+    # Applying again changes nothing, and values the model set are kept
+    before = [dict(c["arguments"]) for c in calls]
+    apply_schedule(calls, "call mom kal 5 baje, milk urgent, bread rename, eggs hata do", NOW)
+    assert [c["arguments"] for c in calls] == before
+    calls = [{"name": "add_task", "arguments": {"title": "gym", "priority": "low"}}]
+    assert apply_schedule(calls, "gym urgent", NOW)[0]["arguments"]["priority"] == "low"
+
+    assert describe({"due_date": "2026-10-18T17:00:00", "priority": "high"}) == " (18 Oct 17:00, high priority)"
+    assert describe({"due_date": "2026-10-18T23:59:00"}) == " (18 Oct)"
+
+
+def test_scheduled_calls_are_saved():
+    engine = make_engine()
+    with Session(engine) as session:
+        TaskService.create_task(session, "u1", "Milk")
+        session.commit()
+        calls = apply_schedule([{"name": "add_task", "arguments": {"title": "call mom kal subah 9 baje zaroori"}},
+                                {"name": "update_task", "arguments": {"task_id": "Milk", "new_title": "Milk juma ko"}},
+                                {"name": "add_task", "arguments": {"title": "x", "priority": "someday"}},
+                                {"name": "add_task", "arguments": {"title": "y", "due_date": "soon"}}], now=NOW)
+        results = ToolEngine().execute(session, "u1", calls)
+
+        assert [r["success"] for r in results] == [True, True, False, False]
+        assert results[2]["error"] == "add_task failed: Priority must be one of high, medium, low"
+        assert results[3]["error"] == "add_task failed: Invalid due date 'soon'"
+        tasks = {t.title: t for t in session.exec(select(Task).where(Task.user_id == "u1")).all()}
+        assert (tasks["call mom"].due_date, tasks["call mom"].priority) == (datetime(2026, 10, 18, 9, 0), "high")
+        assert tasks["Milk"].due_date == datetime(2026, 10, 23, 23, 59)
+
+
+def test_intent_engine_replies_with_the_clean_title():
+    result = IntentEngine(clock=lambda: NOW).answer("u1", "kal subah 9 baje doctor ko call karna task add kar do", [])
+    assert result["tool_calls"][0]["arguments"] == {"title": "doctor ko call karna", "user_id": "u1",
+                                                    "due_date": "2026-10-18T09:00:00"}
+    assert result["response"] == "Theek hai, 'doctor ko call karna' (18 Oct 09:00) add kar diya hai. 🙂"
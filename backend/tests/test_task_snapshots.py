@@ -0,0 +1,128 @@
+from sqlalchemy import text
+from src.agents.context_builder import TaskContextBuilder
+from src.agents.task_snapshots import TaskSnapshots
+from src.agents.token_budget import estimate_tokens
+from src.agents.todo_agent import TodoAgent
+from src.services.task_service import TaskService
+from .test_utils import StubModel
+
+
+def make_tasks(n):
+    return [{"id": f"id{i}", "title": f"Project task number {i}", "completed": False} for i in range(n)]
+
+
+def turn(snapshots, message, tasks, builder=TaskContextBuilder()):
+    return snapshots.context("u1", "c1", message, tasks, lambda: builder.build(message, tasks, aliases=True))
+
+
+def test_later_turns_send_a_delta_instead_of_the_list():
+    snapshots = TaskSnapshots()
+    tasks = make_tasks(30)
+    first = turn(snapshots, "hello", tasks)
+    assert first["full"] and first["delta"] == "" and first["aliases"]["t1"] == "id0"
+
+    same = turn(snapshots, "thanks", tasks)
+    assert not same["full"] and same["text"].startswith("(30 tasks were listed earlier") and same["delta"] == ""
+
+    tasks = [dict(t) for t in tasks[1:]]
+    tasks[0]["completed"] = True
+    tasks.append({"id": "new", "title": "Buy eggs", "completed": False})
+    changed = turn(snapshots, "what changed", tasks)
+
+    assert changed["text"] == same["text"]
+    assert changed["delta"].splitlines() == [
+        "- completed: t2: Project task number 1",
+        "- added: t31: Buy eggs (Pending)",
+        "- deleted: t1: Project task number 0",
+    ]
+    assert changed["aliases"]["t31"] == "new" and changed["aliases"]["t2"] == "id1"
+    assert estimate_tokens(changed["delta"]) < estimate_tokens(first["text"]) / 5
+    stats = snapshots.stats()
+    assert stats["delta_turns"] == 2 and stats["saved_tokens"] > estimate_tokens(first["text"])
+
+
+def test_large_delta_resyncs():
+    snapshots = TaskSnapshots(max_delta_lines=3)
+    tasks = make_tasks(10)
+    turn(snapshots, "hello", tasks)
+    tasks = tasks + [{"id": f"n{i}", "title": f"Fresh {i}", "completed": False} for i in range(4)]
+    resynced = turn(snapshots, "hello again", tasks)
+
+    assert resynced["resync"] and resynced["delta"] == ""
+    assert "Fresh 3" in resynced["text"]
+    assert snapshots.stats()["resyncs"] == 1
+
+
+def test_delta_turns_surface_tasks_relevant_to_the_new_message():
+    snapshots = TaskSnapshots()
+    tasks = [{"id": "plumber", "title": "Call the plumber", "completed": False}] + make_tasks(30) + \
+        [{"id": "rent", "title": "Pay the rent", "completed": False}]
+    builder = TaskContextBuilder(max_tasks=10)
+    first = turn(snapshots, "hello", tasks, builder)
+    assert "Pay the rent" not in first["text"] and "- t1: Call the plumber (Pending)" in first["text"]
+
+    # Whether or not the shortened list had them, under the alias they were listed with
+    later = turn(snapshots, "did I pay the rent", tasks, builder)
+    assert later["delta"] == "- relevant: t11: Pay the rent (Pending)"
+    assert later["aliases"]["t11"] == "rent"
+    later = turn(snapshots, "the plumber", tasks, builder)
+    assert later["delta"] == "- relevant: t1: Call the plumber (Pending)"
+
+
+def test_delta_turns_leave_the_list_out_of_the_prompt():
+    model = StubModel('{"response": "Theek hai", "tool_calls": []}')
+    agent = TodoAgent(database_url="sqlite://", model=model, model_name="stub")
+    tasks = make_tasks(30)
+    first = agent._build_prompt("hello", tasks, None, "json", "u1", "c1")[0]
+    tasks.append({"id": "new", "title": "Buy eggs", "completed": False})
+    prompt, clean, report = agent._build_prompt("and eggs?", tasks, None, "json", "u1", "c1")
+
+    prefix = first[:first.index("### USER'S CURRENT TASKS")]
+    assert prompt.startswith(prefix)
+    assert "Project task number 0" not in prompt
+    assert "### TASK CHANGES SINCE THE LIST WAS SENT:" in prompt and "added: t31: Buy eggs" in prompt
+    assert estimate_tokens(prompt) < estimate_tokens(first)
+    assert report["aliases"]["t31"] == "new"
+    # The fallback reply shows the current list
+    assert "- Buy eggs (Pending)" in clean
+    assert agent.stats()["task_snapshots"]["delta_turns"] == 1
+
+
+def test_shrunk_snapshot_keeps_its_aliases():
+    model = StubModel('{"response": "Theek hai", "tool_calls": []}')
+    agent = TodoAgent(database_url="sqlite://", model=model, model_name="stub")
+    fruits = ["apple", "banana", "cherry", "grape", "lemon", "mango", "melon", "orange", "peach", "pear"]
+    tasks = [{"id": f"id_{i:02d}", "title": f"item {fruits[i % 10]} {i}", "completed": False} for i in range(40)]
+    tasks.append({"id": "jam", "title": "item jam errand", "completed": False})
+    first = agent._build_prompt("hello", tasks, None, "json", "u1", "c1")[0]
+
+    # A new conversation is over budget and ranks "item jam errand" first; the snapshot's lines are trimmed
+    agent.prompt_budget.max_tokens = estimate_tokens(first) - 60
+    prompt, _, report = agent._build_prompt("jam errand", tasks, None, "json", "u1", "c2")
+
+    assert "tasks" in report["trimmed"]
+    section = report["sections"]["tasks"]
+    assert section.endswith("not shown") and len(section) < len(first)
+    by_id = {t["id"]: t["title"] for t in tasks}
+    labelled = [line[2:].split(": ", 1) for line in section.splitlines() if not line.startswith("- ...")]
+    assert labelled
+    for alias, rest in labelled:
+        assert rest == f"{by_id[report['aliases'][alias]]} (Pending)"
+
+
+def test_writes_from_another_process_are_diffed():
+    model = StubModel('{"response": "Theek hai", "tool_calls": []}')
+    agent = TodoAgent(database_url="sqlite://", model=model, model_name="stub")
+    session = agent.task_tools.get_db_session()
+    for title in ("Buy milk", "Call mom"):
+        TaskService.create_task(session, "u_snap", title)
+    session.commit()
+    agent.process_message("u_snap", "what should I focus on today?", "c1")
+
+    # Another worker completes a task: this process's task-set version does not move
+    session.exec(text("UPDATE tasks SET completed = 1 WHERE title = 'Call mom'"))
+    session.commit()
+    session.close()
+    agent.process_message("u_snap", "anything left?", "c1")
+
+    assert len(model.prompts) == 2 and "- completed: t1: Call mom" in model.prompts[-1]
@@ -0,0 +1,61 @@
+import json
+import os
+import time
+from src.agents.title_generator import compare, format_comparison, generate_title, strip_filler
+from src.agents.todo_agent import TodoAgent
+from .test_utils import StubModel
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "title_corpus.json")
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_titles_name_topic_and_objects():
+    assert generate_title("add milk and eggs to my shopping list") == "Shopping: milk, eggs"
+    assert generate_title("delete the dentist appointment") == "Remove: dentist appointment"
+    assert generate_title("show my pending tasks") == "Pending tasks"
+    assert generate_title("Hi") == "Quick Chat"
+    assert generate_title("") == "New Chat"
+
+
+def test_long_messages_stay_short():
+    title = generate_title("buy apples, bananas, oranges, mangoes, grapes and strawberries for the weekend party")
+    assert title.startswith("Shopping: apples, bananas")
+    assert len(title) <= 40
+
+
+def test_strip_filler_matches_fallback_parser_vocabulary():
+    assert strip_filler('a task called "water the plants"') == "water the plants"
+    assert strip_filler("to my list") == "list"
+
+
+def test_corpus_quality_does_not_regress():
+    report = compare(load_corpus())
+    # The misses are listed in the message so a regression shows which titles changed
+    assert report["local"]["accuracy"] >= 0.9, format_comparison(report)
+    assert report["local"]["accuracy"] > report["legacy"]["accuracy"]
+
+
+def test_generation_is_cheap():
+    messages = [case["message"] for case in load_corpus()]
+    start = time.perf_counter()
+    for _ in range(20):
+        for message in messages:
+            generate_title(message)
+    per_title = (time.perf_counter() - start) / (20 * len(messages))
+    # Tens of microseconds in practice; the bound only guards against an accidental model call
+    assert per_title < 0.005
+
+
+def test_agent_titles_locally_when_model_omits_title():
+    model = StubModel('{"response": "Add kar diya ✅", "tool_calls": []}')
+    agent = TodoAgent(database_url="sqlite://", model=model, model_name="stub", model_titles=False)
+    result = agent.process_message("user_titles", "please organise my shopping: milk and bread")
+
+    assert result["chat_title"] == "Shopping: milk, bread"
+    assert '"chat_title"' not in model.prompts[0]
+    assert agent.generate_conversation_title("pay the rent") == "Bills: rent"
+    assert len(model.prompts) == 1
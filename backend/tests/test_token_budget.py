@@ -0,0 +1,53 @@
+from sqlmodel import Session
+from src.agents.todo_agent import TodoAgent
+from src.agents.token_budget import PromptBudget, PromptSection, estimate_tokens, truncate_to_tokens
+from src.services.task_service import TaskService
+from .test_utils import StubModel, make_engine
+
+
+def test_estimate_tokens_is_local_and_monotonic():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("buy milk") == 2
+    assert estimate_tokens("internationalization") == 5
+    assert estimate_tokens("Theek hai 🙂") < estimate_tokens("Theek hai 🙂 " * 10)
+
+
+def test_fit_trims_lowest_priority_first():
+    sections = [
+        PromptSection("history", "old chat " * 200, priority=0),
+        PromptSection("tasks", "task line " * 100, priority=1,
+                      shrink=lambda tokens: truncate_to_tokens("task line " * 100, tokens)),
+        PromptSection("message", "hello", priority=2),
+    ]
+    render = lambda s: f"SYSTEM\n{s['history']}\n{s['tasks']}\n{s['message']}"
+
+    prompt, report = PromptBudget(max_tokens=250).fit(render, sections)
+    assert report["trimmed"] == ["history"]
+    assert report["prompt_tokens"] <= 250
+    assert prompt.endswith("hello")
+
+    prompt, report = PromptBudget(max_tokens=60).fit(render, sections)
+    assert report["trimmed"] == ["history", "tasks"]
+    assert report["prompt_tokens"] <= 60
+    assert report["sections"]["tasks"].endswith("…")
+
+
+def test_agent_enforces_budget_and_records_metrics():
+    engine = make_engine()
+    with Session(engine) as session:
+        for i in range(300):
+            TaskService.create_task(session, "u1", f"Errand number {i} for the weekend")
+        session.commit()
+
+    model = StubModel()
+    agent = TodoAgent(engine=engine, model=model, model_name="stub", prompt_budget=PromptBudget(max_tokens=1800))
+    agent.process_message("u1", "mujhe weekend ke baare mein kuch batao yaar")
+
+    assert estimate_tokens(model.prompts[0]) <= 1800
+    assert "more pending tasks not shown" in model.prompts[0]
+    stats = agent.stats()["tokens"]
+    assert stats["turns"] == 1
+    assert stats["trimmed_turns"] == 1
+    assert stats["prompt_tokens"]["max"] <= 1800
+    assert stats["completion_tokens"]["max"] > 0
+    assert stats["slowest"][0]["user_id"] == "u1"
@@ -0,0 +1,173 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session, select
+from src.main import app
+from src.database.session import get_session
+from src.models.task import Task
+from src.services.task_service import TaskService, TaskSnapshot, task_versions
+from src.agents.todo_agent import TodoAgent
+from src.tools.tool_engine import ToolEngine, ToolSpec
+from .test_utils import create_test_token, StubModel, make_engine
+
+USER = "user_engine"
+
+
+@pytest.fixture(name="engine")
+def engine_fixture():
+    return make_engine()
+
+
+def count_statements(engine, kind):
+    seen = []
+    event.listen(engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: seen.append(statement)
+                 if statement.lstrip().upper().startswith(kind) else None)
+    return seen
+
+
+def titles(session):
+    return sorted(t.title for t in session.exec(select(Task).where(Task.user_id == USER)).all())
+
+
+def test_batch_groups_calls_by_kind(engine):
+    with Session(engine) as session:
+        for title in ("Milk", "Eggs", "Bread", "Rent"):
+            TaskService.create_task(session, USER, title)
+        session.commit()
+
+        updates = count_statements(engine, "UPDATE")
+        deletes = count_statements(engine, "DELETE")
+        results = ToolEngine().execute(session, USER, [
+            {"name": "add_task", "arguments": {"title": "Butter"}},
+            {"name": "add_task", "arguments": {"title": "Jam"}},
+            {"name": "complete_task", "arguments": {"task_id": "Milk"}},
+            {"name": "complete_task", "arguments": {"task_id": "Eggs"}},
+            {"name": "delete_task", "arguments": {"task_id": "Bread"}},
+            {"name": "delete_task", "arguments": {"task_id": "Rent"}},
+        ])
+
+        assert all(r["success"] for r in results)
+        assert results[0]["task_id"] and results[2]["task_id"]
+        assert len(updates) == 1 and len(deletes) == 1
+        assert titles(session) == ["Butter", "Eggs", "Jam", "Milk"]
+        done = session.exec(select(Task).where(Task.user_id == USER, Task.completed == True)).all()
+        assert sorted(t.title for t in done) == ["Eggs", "Milk"]
+
+
+def test_invalid_calls_fail_alone(engine):
+    with Session(engine) as session:
+        results = ToolEngine().execute(session, USER, [
+            {"name": "add_task", "arguments": {"title": "Call the plumber"}},
+            {"name": "add_task", "arguments": {}},
+            {"name": "complete_task", "arguments": {"task_id": "Nothing like this"}},
+            {"name": "fly_to_moon", "arguments": {}},
+            # Refers to a task added earlier in the same batch
+            {"name": "update_task", "arguments": {"task_id": "plumber", "new_title": "Call the electrician"}},
+        ])
+
+        assert [r["success"] for r in results] == [True, False, False, False, True]
+        assert results[1]["error"] == "add_task failed: Task title is required"
+        assert results[2]["error"] == "complete_task failed: Task 'Nothing like this' not found (NOT_FOUND)"
+        assert results[3]["error"] == "Unknown tool: fly_to_moon"
+        assert titles(session) == ["Call the electrician"]
+
+
+def test_database_error_rolls_back_the_batch(engine):
+    def failing(session, user_id, items):
+        raise RuntimeError("disk full")
+
+    tool_engine = ToolEngine()
+    tool_engine.register(ToolSpec("delete_task", lambda args: ({**args, "target": args["task_id"]}, None), failing,
+                                  target="target", phase=2))
+    with Session(engine) as session:
+        TaskService.create_task(session, USER, "Milk")
+        session.commit()
+        results = tool_engine.execute(session, USER, [
+            {"name": "add_task", "arguments": {"title": "Eggs"}},
+            {"name": "delete_task", "arguments": {"task_id": "Milk"}},
+        ])
+
+        assert not any(r["success"] for r in results)
+        assert results[0]["error"] == "Error executing add_task: disk full"
+        assert titles(session) == ["Milk"]
+        assert tool_engine.stats()["rollbacks"] == 1
+
+
+def test_batch_endpoint(engine):
+    session = Session(engine)
+    app.dependency_overrides[get_session] = lambda: session
+    try:
+        response = TestClient(app).post(
+            f"/api/{USER}/tasks/batch",
+            json={"calls": [{"name": "add_task", "arguments": {"title": "Milk"}},
+                            {"name": "complete_task", "arguments": {"task_id": "Milk"}}]},
+            headers={"Authorization": f"Bearer {create_test_token(USER)}"})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["success"] for r in results] == [True, True]
+    assert results[0]["task_id"] == results[1]["task_id"]
+    session.close()
+
+
+def test_resolve_tasks_uses_one_query(engine):
+    with Session(engine) as session:
+        for title in ("Buy milk", "Buy eggs", "Pay rent", "100% done"):
+            TaskService.create_task(session, USER, title)
+        session.commit()
+        rent = session.exec(select(Task).where(Task.title == "Pay rent")).one()
+
+        selects = count_statements(engine, "SELECT")
+        resolved = TaskService.resolve_tasks(session, USER, ["buy milk", "Buy", "rent", rent.id, "'eggs'",
+                                                             "100%", "1_0", "", "gym"])
+
+        assert len(selects) == 1
+        assert resolved["buy milk"][0].title == "Buy milk"
+        assert resolved["Buy"] == (None, "AMBIGUOUS")
+        assert resolved["rent"][0].id == rent.id and resolved[rent.id][0].id == rent.id
+        assert resolved["'eggs'"][0].title == "Buy eggs"
+        assert resolved["100%"][1] == "FOUND"
+        # LIKE wildcards in an identifier are matched literally
+        assert resolved["1_0"] == (None, "NOT_FOUND")
+        assert resolved[""] == (None, "NOT_FOUND") and resolved["gym"] == (None, "NOT_FOUND")
+        assert TaskService.resolve_task(session, USER, "milk")[1] == "FOUND"
+
+
+def test_calls_resolve_against_the_turn_snapshot(engine):
+    with Session(engine) as session:
+        for title in ("Buy milk", "Pay rent", "Call mom"):
+            TaskService.create_task(session, USER, title)
+        session.commit()
+        tasks = session.exec(select(Task).where(Task.user_id == USER)).all()
+        snapshot = TaskSnapshot.from_dicts(USER, task_versions.get(USER),
+                                           [{"id": t.id, "title": t.title, "completed": t.completed} for t in tasks])
+        # Changed after the snapshot was taken: one task deleted, one added
+        TaskService.delete_task(session, USER, next(t.id for t in tasks if t.title == "Call mom"))
+        TaskService.create_task(session, USER, "Water plants")
+        session.commit()
+
+        selects = count_statements(engine, "SELECT")
+        results = ToolEngine().execute(session, USER, [
+            {"name": "complete_task", "arguments": {"task_id": "milk"}},
+            {"name": "complete_task", "arguments": {"task_id": "Call mom"}},
+            {"name": "delete_task", "arguments": {"task_id": "Water plants"}},
+            {"name": "list_tasks", "arguments": {"status": "all"}},
+        ], snapshot)
+
+        assert [r["success"] for r in results] == [True, False, True, True]
+        assert results[1]["error"] == "complete_task failed: Task 'Call mom' no longer exists"
+        # Only the task the snapshot does not know is looked up
+        assert len([s for s in selects if "LIKE" in s.upper()]) == 1
+        assert titles(session) == ["Buy milk", "Pay rent"]
+
+
+def test_stream_starts_with_the_task_snapshot():
+    agent = TodoAgent(database_url="sqlite://", model=StubModel('{"response": "Theek hai", "tool_calls": []}'),
+                      model_name="stub")
+    events = list(agent.stream_message("user_snapshot", "what should I do about the garden"))
+
+    assert events[0]["type"] == "tasks"
+    assert events[0]["snapshot"].user_id == "user_snapshot" and events[0]["snapshot"].tasks == ()
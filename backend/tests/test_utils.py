@@ -2,6 +2,8 @@ from datetime import datetime, timedelta
 from jose import jwt
 import os
 from dotenv import load_dotenv
+from sqlmodel import SQLModel, create_engine
+from sqlmodel.pool import StaticPool
 
 load_dotenv()
 
@@ -24,4 +26,47 @@ def create_test_token(user_id: str, expires_delta: timedelta = None):
     }
     
     token = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
-    return token
\ No newline at end of file
+    return token
+
+def make_engine(path=None):
+    """
+    An engine with the schema created: in memory on one shared connection
+    (StaticPool) by default, or a file database at `path` with a real pool
+    for tests whose turns write on several worker threads at once.
+    """
+    if path is None:
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    else:
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(bind=engine)
+    return engine
+
+
+class StubResponse:
+    """Minimal stand-in for a Gemini GenerateContentResponse."""
+    def __init__(self, text: str):
+        self.text = text
+
+
+class StubModel:
+    """
+    Deterministic stand-in for GenerativeModel used by agent tests.
+    Returns `reply` for every prompt and records the prompts it received.
+    """
+    def __init__(self, reply: str = '{"response": "Theek hai 🙂", "tool_calls": []}', delay: float = 0.0):
+        self.reply = reply
+        self.delay = delay
+        self.prompts = []
+
+    def generate_content(self, prompt, stream: bool = False, **kwargs):
+        import time
+        self.prompts.append(prompt)
+        if self.delay:
+            time.sleep(self.delay)
+        if stream:
+            # Emit the reply a few characters at a time, like a streamed completion
+            return [StubResponse(self.reply[i:i + 7]) for i in range(0, len(self.reply), 7)]
+        return StubResponse(self.reply)
+
+    def count_tokens(self, text):
+        return len(str(text).split())